@@ -0,0 +1,365 @@
+"""
+Reproducible benchmarks for the redirect and shorten hot paths.
+
+Every scenario runs against local stand-ins (fakeredis and an in-memory table) with
+injected latency, short urls are requested following a Zipf distribution, and the
+results are saved as json so they can be compared between commits, e.g.:
+
+    python -m benchmarks.run_benchmarks --redis-latency-ms 0.5 --table-latency-ms 5
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/<previous>.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from itertools import accumulate
+from pathlib import Path
+from random import Random
+from statistics import mean, quantiles
+from time import perf_counter
+from typing import Callable, Dict, List
+
+import httpx
+from fakeredis import FakeStrictRedis
+from redis import Redis
+from fakeredis.aioredis import FakeRedis as FakeAsyncRedis
+from loguru import logger
+
+from benchmarks.stand_ins import InMemoryUrlTable, LatencyRedis
+from shortame.adapters.dynamodb_adapter import AsyncUrlTable
+from shortame.adapters.memory_adapter import LocalCacheQueue
+from shortame.adapters.redis_adapter import (AsyncBucketedCacheQueue, AsyncCacheQueue,
+                                             AsyncClickStatsCache, AsyncShortUrlQueue,
+                                             BucketedCacheQueue, CacheQueue,
+                                             CompactUrlCodec, ShortUrlQueue)
+from shortame.app import app
+from shortame.domain.model import Url
+from shortame.services.analytics_services import AsyncClickAggregator
+from shortame.services.key_generation_services import BASE62_ALPHABET, ShortUrlGenerator
+from shortame.services.redirect_services import RedirectPolicy
+from shortame.services.url_services import AsyncUrlShortener, UrlShortener
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# cache layout: whether urls are kept on buckets, whether long urls are compressed
+CACHE_LAYOUTS = {"strings": (False, False), "buckets": (True, False), "compressed_buckets": (True, True)}
+
+
+@dataclass
+class BenchmarkConfig:
+    requests: int = 5000
+    concurrency: int = 50
+    keys: int = 10_000
+    zipf_s: float = 1.1
+    redis_latency_ms: float = 0.2
+    table_latency_ms: float = 3.0
+    local_cache: bool = True
+    cache_layout: str = "strings"
+    redis_url: str | None = None
+    seed: int = 42
+
+    @property
+    def redis_latency(self) -> float:
+        return self.redis_latency_ms / 1000
+
+    @property
+    def table_latency(self) -> float:
+        return self.table_latency_ms / 1000
+
+
+def zipf_keys(keys: List[str], count: int, s: float, rng: Random) -> List[str]:
+    """Draws count keys, the k-th most popular being requested proportionally to 1/k**s."""
+    cum_weights = list(accumulate(1 / rank**s for rank in range(1, len(keys) + 1)))
+    return rng.choices(keys, cum_weights=cum_weights, k=count)
+
+
+def summarize(scenario: str, latencies: List[float], elapsed: float, ops: int | None = None) -> Dict:
+    """Throughput in ops/s and latency percentiles in milliseconds."""
+    cuts = quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "scenario": scenario,
+        "ops": ops if ops is not None else len(latencies),
+        "throughput": (ops if ops is not None else len(latencies)) / elapsed,
+        "mean_ms": mean(latencies) * 1000,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def sample_urls(config: BenchmarkConfig) -> List[Url]:
+    rng = Random(config.seed)
+    short_urls = dict.fromkeys("".join(rng.choices(BASE62_ALPHABET, k=7)) for _ in range(config.keys))
+    return [
+        Url(short_url=short_url, long_url=f"https://example.com/articles/{i}")
+        for i, short_url in enumerate(short_urls)
+    ]
+
+
+def create_cache(layout: str, redis_client, asynchronous: bool = False, prefix_length: int = 3):
+    bucketed, compress = CACHE_LAYOUTS[layout]
+    if not bucketed:
+        return (AsyncCacheQueue if asynchronous else CacheQueue)(redis_client=redis_client)
+    codec = CompactUrlCodec(prefix_length=prefix_length, compress=compress)
+    return (AsyncBucketedCacheQueue if asynchronous else BucketedCacheQueue)(redis_client=redis_client, codec=codec)
+
+
+def bucket_prefix_length(entries: int, max_bucket_size: int = 128) -> int:
+    """The shortest prefix keeping buckets within the default listpack size, on average."""
+    prefix_length = 0
+    while entries / len(BASE62_ALPHABET) ** prefix_length > max_bucket_size:
+        prefix_length += 1
+    return prefix_length
+
+
+def measure(calls: List[Callable[[], object]]) -> tuple[List[float], float]:
+    latencies = []
+    start = perf_counter()
+    for call in calls:
+        call_start = perf_counter()
+        call()
+        latencies.append(perf_counter() - call_start)
+    return latencies, perf_counter() - start
+
+
+def bench_get_long_url(config: BenchmarkConfig) -> Dict:
+    redis_client = LatencyRedis(FakeStrictRedis(version=7), config.redis_latency)
+    table = InMemoryUrlTable(latency=config.table_latency)
+    urls = sample_urls(config)
+    table.table.update({url.short_url: asdict(url) for url in urls})
+    shortener = UrlShortener(
+        queue=ShortUrlQueue(redis_client=redis_client),
+        table=table,
+        cache=create_cache(config.cache_layout, redis_client),
+        local_cache=LocalCacheQueue() if config.local_cache else None,
+        negative_caching=True,
+    )
+    requested = zipf_keys([url.short_url for url in urls], config.requests, config.zipf_s, Random(config.seed))
+    latencies, elapsed = measure([lambda key=key: shortener.get_long_url(key) for key in requested])
+    return summarize("get_long_url", latencies, elapsed)
+
+
+def bench_shorten_and_persist(config: BenchmarkConfig) -> Dict:
+    fake_redis = FakeStrictRedis(version=7)
+    redis_client = LatencyRedis(fake_redis, config.redis_latency)
+    fake_redis.lpush("available_urls", *(f"{i:07d}" for i in range(config.requests)))
+    shortener = UrlShortener(
+        queue=ShortUrlQueue(redis_client=redis_client),
+        table=InMemoryUrlTable(latency=config.table_latency),
+        cache=create_cache(config.cache_layout, redis_client),
+        local_cache=LocalCacheQueue() if config.local_cache else None,
+    )
+    latencies, elapsed = measure(
+        [
+            lambda i=i: shortener.shorten_and_persist(f"https://example.com/articles/{i}")
+            for i in range(config.requests)
+        ]
+    )
+    return summarize("shorten_and_persist", latencies, elapsed)
+
+
+def bench_generate_and_enque(config: BenchmarkConfig) -> List[Dict]:
+    redis_client = LatencyRedis(FakeStrictRedis(version=7), config.redis_latency)
+    table = InMemoryUrlTable(latency=config.table_latency)
+    table.table.update({url.short_url: asdict(url) for url in sample_urls(config)})
+    generator = ShortUrlGenerator(queue=ShortUrlQueue(redis_client=redis_client), table=table)
+    count = min(config.requests, 1000)
+    latencies, elapsed = measure([generator.generate_and_enque for _ in range(count)])
+    single = summarize("generate_and_enque", latencies, elapsed)
+    batches = max(count // 500, 1)
+    latencies, elapsed = measure([lambda: generator.generate_and_enqueue_batch(size=500)] * batches)
+    batch = summarize("generate_and_enqueue_batch", latencies, elapsed, ops=batches * 500)
+    return [single, batch]
+
+
+async def _drive(client: httpx.AsyncClient, requests: List[Callable], concurrency: int) -> tuple[List[float], float]:
+    pending = iter(requests)
+    latencies = []
+
+    async def worker():
+        for request in pending:
+            request_start = perf_counter()
+            response = await request(client)
+            latencies.append(perf_counter() - request_start)
+            if response.status_code >= 400:
+                raise RuntimeError(f"Unexpected response {response.status_code}: {response.text}")
+
+    start = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, perf_counter() - start
+
+
+async def _bench_app(config: BenchmarkConfig) -> List[Dict]:
+    fake_redis = FakeAsyncRedis(version=7)
+    redis_client = LatencyRedis(fake_redis, config.redis_latency)
+    table = InMemoryUrlTable(latency=config.table_latency)
+    urls = sample_urls(config)
+    table.table.update({url.short_url: asdict(url) for url in urls})
+    await fake_redis.lpush("available_urls", *(f"new{i:04d}" for i in range(config.requests)))
+    # the lifespan isn't run by the ASGI transport, the stand-ins take the place of its clients
+    app.state.shortener = AsyncUrlShortener(
+        queue=AsyncShortUrlQueue(redis_client=redis_client),
+        table=AsyncUrlTable(url_table=table),
+        cache=create_cache(config.cache_layout, redis_client, asynchronous=True),
+        local_cache=LocalCacheQueue() if config.local_cache else None,
+        negative_caching=True,
+    )
+    app.state.redirect_policy = RedirectPolicy()
+    # clicks are only counted in memory while requests run, as between two flushes
+    app.state.click_aggregator = AsyncClickAggregator(cache=AsyncClickStatsCache(redis_client=redis_client))
+    requested = zipf_keys([url.short_url for url in urls], config.requests, config.zipf_s, Random(config.seed))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        latencies, elapsed = await _drive(
+            client, [lambda client, key=key: client.get(f"/{key}") for key in requested], config.concurrency
+        )
+        redirect = summarize("app_redirect", latencies, elapsed)
+        latencies, elapsed = await _drive(
+            client,
+            [
+                lambda client, i=i: client.post("/url", json={"long_url": f"https://example.com/new/{i}"})
+                for i in range(config.requests)
+            ],
+            config.concurrency,
+        )
+        shorten = summarize("app_shorten", latencies, elapsed)
+    return [redirect, shorten]
+
+
+def bench_app(config: BenchmarkConfig) -> List[Dict]:
+    return asyncio.run(_bench_app(config))
+
+
+def _stored_bytes(redis_client, key: str) -> int:
+    if redis_client.type(key) == b"hash":
+        return len(key) + sum(len(field) + len(value) for field, value in redis_client.hgetall(key).items())
+    return len(key) + redis_client.strlen(key)
+
+
+def bench_cache_memory(config: BenchmarkConfig) -> List[Dict]:
+    """
+    Memory taken per cached url by each cache layout.
+
+    Measured with MEMORY USAGE on the Redis of --redis-url (the benchmark keys are
+    deleted afterwards, use a scratch database), otherwise only the bytes of the
+    keys, fields and values are counted, leaving out the per-key overhead of Redis.
+    Buckets are sized for --keys as they would be for the urls on production, e.g.:
+    3 char prefixes from ~250k urls.
+    """
+    urls = sample_urls(config)
+    prefix_length = bucket_prefix_length(len(urls))
+    results = []
+    for layout in CACHE_LAYOUTS:
+        redis_client = Redis.from_url(config.redis_url) if config.redis_url else FakeStrictRedis(version=7)
+        cache = create_cache(layout, redis_client, prefix_length=prefix_length)
+        for start in range(0, len(urls), 1000):
+            cache.add_many(urls[start : start + 1000])
+        if layout == "strings":
+            keys = {url.short_url for url in urls}
+        else:
+            keys = {cache.codec.locate(url.short_url)[0] for url in urls}
+        if config.redis_url:
+            total = sum(redis_client.memory_usage(key, samples=0) for key in keys)
+            redis_client.delete(*keys)
+        else:
+            total = sum(_stored_bytes(redis_client, key) for key in keys)
+        results.append(
+            {
+                "layout": layout,
+                "entries": len(urls),
+                "keys": len(keys),
+                "bytes_per_entry": total / len(urls),
+                "measured": bool(config.redis_url),
+            }
+        )
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(config: BenchmarkConfig) -> Dict:
+    results = [bench_get_long_url(config), bench_shorten_and_persist(config)]
+    results.extend(bench_generate_and_enque(config))
+    results.extend(bench_app(config))
+    return {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": asdict(config),
+        "results": results,
+        "cache_memory": bench_cache_memory(config),
+    }
+
+
+def compare(current: Dict, baseline: Dict) -> None:
+    print(f"Comparing {current['revision']} against {baseline['revision']}")
+    baseline_results = {result["scenario"]: result for result in baseline["results"]}
+    for result in current["results"]:
+        previous = baseline_results.get(result["scenario"])
+        if previous is None:
+            continue
+        throughput = (result["throughput"] / previous["throughput"] - 1) * 100
+        p99 = (result["p99_ms"] / previous["p99_ms"] - 1) * 100
+        print(f"{result['scenario']:<28} throughput {throughput:+7.1f}%   p99 {p99:+7.1f}%")
+    baseline_memory = {result["layout"]: result for result in baseline.get("cache_memory", [])}
+    for result in current.get("cache_memory", []):
+        previous = baseline_memory.get(result["layout"])
+        if previous is None or previous["measured"] != result["measured"]:
+            continue
+        memory = (result["bytes_per_entry"] / previous["bytes_per_entry"] - 1) * 100
+        print(f"cache_memory {result['layout']:<15} bytes/entry {memory:+7.1f}%")
+
+
+def main() -> None:
+    defaults = BenchmarkConfig()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=defaults.requests)
+    parser.add_argument("--concurrency", type=int, default=defaults.concurrency)
+    parser.add_argument("--keys", type=int, default=defaults.keys)
+    parser.add_argument("--zipf-s", type=float, default=defaults.zipf_s)
+    parser.add_argument("--redis-latency-ms", type=float, default=defaults.redis_latency_ms)
+    parser.add_argument("--table-latency-ms", type=float, default=defaults.table_latency_ms)
+    parser.add_argument("--no-local-cache", dest="local_cache", action="store_false")
+    parser.add_argument("--cache-layout", choices=list(CACHE_LAYOUTS), default=defaults.cache_layout)
+    parser.add_argument("--redis-url", help="a scratch Redis database to measure the cache memory on")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--output", type=Path, help="where to save the results, defaults to benchmarks/results/")
+    parser.add_argument("--compare", type=Path, help="previous results to compare against")
+    args = parser.parse_args()
+
+    logger.remove()
+    config = BenchmarkConfig(
+        **{key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    )
+    report = run(config)
+    for result in report["results"]:
+        print(
+            f"{result['scenario']:<28} {result['throughput']:>10.0f} ops/s   "
+            f"p50 {result['p50_ms']:.3f}ms   p95 {result['p95_ms']:.3f}ms   p99 {result['p99_ms']:.3f}ms"
+        )
+    for result in report["cache_memory"]:
+        source = "measured" if result["measured"] else "stored bytes only"
+        print(
+            f"cache_memory {result['layout']:<15} {result['bytes_per_entry']:>10.1f} bytes/entry "
+            f"over {result['keys']} keys ({source})"
+        )
+    output = args.output or RESULTS_DIR / f"{report['timestamp'][:19].replace(':', '')}-{report['revision']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results saved to {output}")
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# Local stand-ins for Redis and DynamoDB with injected latency, used by the benchmarks
+import asyncio
+from dataclasses import asdict
+from inspect import isawaitable
+from time import sleep
+from typing import Dict, Iterable, List
+
+from shortame.adapters.dynamodb_adapter import (BATCH_GET_MAX_KEYS,
+                                                BATCH_WRITE_MAX_ITEMS,
+                                                AbstractDynamoDBUrlTable,
+                                                ShortUrlNotFoundOnTable)
+from shortame.domain.model import Url
+
+
+def _delayed(result, latency: float):
+    """Delays a call result by latency seconds, awaiting it if it's a coroutine."""
+    if isawaitable(result):
+
+        async def delayed_result():
+            await asyncio.sleep(latency)
+            return await result
+
+        return delayed_result()
+    if latency:
+        sleep(latency)
+    return result
+
+
+class LatencyPipeline:
+    """Proxies a (fake) Redis pipeline, adding one round-trip of latency on execute"""
+
+    def __init__(self, pipeline, latency: float):
+        self._pipeline = pipeline
+        self.latency = latency
+
+    def execute(self, *args, **kwargs):
+        return _delayed(self._pipeline.execute(*args, **kwargs), self.latency)
+
+    def __getattr__(self, name):
+        return getattr(self._pipeline, name)
+
+
+class LatencyRedis:
+    """Proxies a (fake) Redis client, sync or asyncio, adding latency to each round-trip"""
+
+    def __init__(self, redis_client, latency: float):
+        """
+        :param redis_client: e.g.: a FakeStrictRedis or a fakeredis.aioredis.FakeRedis
+        :param latency: how many seconds each round-trip takes, e.g.: 0.0005
+        """
+        self._redis_client = redis_client
+        self.latency = latency
+
+    def pipeline(self, *args, **kwargs) -> LatencyPipeline:
+        return LatencyPipeline(self._redis_client.pipeline(*args, **kwargs), self.latency)
+
+    def __getattr__(self, name):
+        attr = getattr(self._redis_client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return _delayed(attr(*args, **kwargs), self.latency)
+
+        return call
+
+
+class InMemoryUrlTable(AbstractDynamoDBUrlTable):
+    """Dict-backed stand-in for UrlTable, each request to it takes latency seconds"""
+
+    def __init__(self, latency: float = 0, table_name: str = "url"):
+        self.latency = latency
+        self.table_name = table_name
+        self.table = self._load_table()
+
+    def _load_table(self) -> Dict[str, Dict[str, str]]:
+        return {}
+
+    def _round_trips(self, count: int) -> None:
+        if self.latency:
+            sleep(self.latency * count)
+
+    def add_url(self, url: Url) -> bool:
+        self._round_trips(1)
+        self.table[url.short_url] = asdict(url)
+        return True
+
+    def add_urls(self, urls: List[Url], **kwargs) -> bool:
+        self._round_trips(-(-len(urls) // BATCH_WRITE_MAX_ITEMS))
+        for url in urls:
+            self.table[url.short_url] = asdict(url)
+        return True
+
+    def get_url(self, short_url: str) -> Dict[str, str]:
+        self._round_trips(1)
+        if short_url not in self.table:
+            raise ShortUrlNotFoundOnTable(
+                f"Short url '{short_url}' does not exist on {self.table_name} table"
+            )
+        return dict(self.table[short_url])
+
+    def batch_get_urls(self, short_urls: Iterable[str], **kwargs) -> List[Dict[str, str]]:
+        short_urls = list(dict.fromkeys(short_urls))
+        self._round_trips(-(-len(short_urls) // BATCH_GET_MAX_KEYS))
+        return [dict(self.table[short_url]) for short_url in short_urls if short_url in self.table]
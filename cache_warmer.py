@@ -0,0 +1,59 @@
+import argparse
+
+from loguru import logger
+
+from shortame.config import settings
+from shortame.logs import configure_logging
+from shortame.services.cache_services import CacheWarmer
+from shortame.adapters.redis_adapter import (
+    BucketedCacheQueue,
+    CacheQueue,
+    CompactUrlCodec,
+    HotKeyTracker,
+    get_redis_clients,
+)
+from shortame.adapters.sharding_adapter import ShardedCacheQueue
+from shortame.adapters.dynamodb_adapter import FastUrlTable, UrlTable
+from shortame.adapters.embedded_adapter import EmbeddedUrlTable
+
+
+def create_node_cache(redis_client):
+    if settings.cache_layout == "buckets":
+        return BucketedCacheQueue(
+            redis_client=redis_client,
+            codec=CompactUrlCodec(
+                prefix_length=settings.cache_bucket_prefix_length,
+                compress=settings.cache_compression,
+            ),
+        )
+    return CacheQueue(redis_client=redis_client)
+
+
+def create_url_table():
+    if settings.url_table_adapter == "embedded":
+        return EmbeddedUrlTable(path=settings.embedded_table_path)
+    return FastUrlTable() if settings.url_table_adapter == "client" else UrlTable()
+
+
+def create_cache():
+    caches = {node: create_node_cache(redis_client) for node, redis_client in get_redis_clients().items()}
+    if len(caches) == 1:
+        return next(iter(caches.values()))
+    return ShardedCacheQueue(caches, vnodes=settings.redis_virtual_nodes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loads the most requested short urls into the cache")
+    parser.add_argument("--count", type=int, default=settings.cache_warm_up_size)
+    parser.add_argument("--rate-limit", type=float, default=settings.cache_warm_up_rate_limit, help="urls/s")
+    args = parser.parse_args()
+
+    configure_logging(sink="cache_warmer.log")
+    logger.info("Executing the Cache Warmer")
+    warmer = CacheWarmer(
+        tracker=HotKeyTracker(),
+        table=create_url_table(),
+        cache=create_cache(),
+        rate_limit=args.rate_limit,
+    )
+    warmer.warm_up(args.count)
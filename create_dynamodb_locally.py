@@ -13,22 +13,28 @@ resource = boto3.resource(
     aws_secret_access_key=settings.aws_secret_access_key,
     region_name=settings.aws_region_name,
 )
-table_name = "url"
-logger.info(f"DynamoDB table name: '{table_name}'")
-try:
-    logger.info(f"Verifying if table '{table_name}' exists")
-    resource.Table(table_name).load()
-    logger.info(f"Table '{table_name}' was already created")
-except ClientError as e:
-    if e.response["Error"]["Code"] == "ResourceNotFoundException":
-        logger.info(f"Table '{table_name}' does not exists, creating it now")
-        table = resource.create_table(
-            AttributeDefinitions=[
-                {"AttributeName": "short_url", "AttributeType": "S"},
-            ],
-            TableName=table_name,
-            KeySchema=[{"AttributeName": "short_url", "KeyType": "HASH"}],
-            BillingMode="PAY_PER_REQUEST",
-        )
-        table.wait_until_exists()
-        logger.info(f"Table {table_name} created")
+# table name: partition key
+tables = {
+    "url": "short_url",
+    settings.dedup_table_name: "long_url_hash",
+    settings.analytics_table_name: "short_url",
+}
+for table_name, key_name in tables.items():
+    logger.info(f"DynamoDB table name: '{table_name}'")
+    try:
+        logger.info(f"Verifying if table '{table_name}' exists")
+        resource.Table(table_name).load()
+        logger.info(f"Table '{table_name}' was already created")
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFoundException":
+            logger.info(f"Table '{table_name}' does not exists, creating it now")
+            table = resource.create_table(
+                AttributeDefinitions=[
+                    {"AttributeName": key_name, "AttributeType": "S"},
+                ],
+                TableName=table_name,
+                KeySchema=[{"AttributeName": key_name, "KeyType": "HASH"}],
+                BillingMode="PAY_PER_REQUEST",
+            )
+            table.wait_until_exists()
+            logger.info(f"Table {table_name} created")
@@ -1,25 +1,67 @@
-from time import sleep
+import os
+import socket
 
 from loguru import logger
 
 from shortame.config import settings
-from shortame.services.key_generation_services import ShortUrlGenerator
-from shortame.adapters.redis_adapter import ShortUrlQueue
-from shortame.adapters.dynamodb_adapter import UrlTable
+from shortame.logs import configure_logging
+from shortame.services.key_generation_services import KeyGeneratorService, ShortUrlGenerator
+from shortame.adapters.redis_adapter import GeneratorLease, ShortUrlQueue, get_redis_clients
+from shortame.adapters.sharding_adapter import ShardedShortUrlQueue
+from shortame.adapters.dynamodb_adapter import FastUrlTable, UrlTable, create_dyn_resource
+from shortame.adapters.embedded_adapter import EmbeddedUrlTable
+from shortame.adapters.bloom_filter_adapter import RedisBloomFilter
 
 if __name__ == "__main__":
-    logger.add(sink="key_generator.log")
+    configure_logging(sink="key_generator.log")
     logger.info("Executing the Key Generator service")
     queue = ShortUrlQueue()
-    table = UrlTable()
-    keygen = ShortUrlGenerator(queue=queue, table=table)
-    minimum_size = settings.short_url_minimum_queue_size
-    while True:
-        logger.info("Comparing the current queue size with the minimum size")
-        if keygen.queue.current_size() <= minimum_size:
-            logger.info(f"Queue size is less than {minimum_size}")
-            keygen.generate_and_enque()
-        else:
-            logger.info("Queue size is greather than minimum size")
-            logger.info("Sleeping for 5 seconds")
-            sleep(5)
+    redis_clients = list(get_redis_clients().values())
+    if len(redis_clients) > 1:
+        # the shards are refilled together, the least loaded first
+        queue = ShardedShortUrlQueue([ShortUrlQueue(redis_client=redis_client) for redis_client in redis_clients])
+    bloom_filter = (
+        RedisBloomFilter(
+            capacity=settings.bloom_filter_capacity,
+            error_rate=settings.bloom_filter_error_rate,
+        )
+        if settings.bloom_filter_enabled
+        else None
+    )
+    # the embedded table is shared by the workers, its reads take no lock
+    embedded_table = (
+        EmbeddedUrlTable(path=settings.embedded_table_path, sync=settings.embedded_table_sync)
+        if settings.url_table_adapter == "embedded"
+        else None
+    )
+    # each worker gets its own DynamoDB resource, they are not thread-safe (clients are)
+    generators = [
+        ShortUrlGenerator(
+            queue=queue,
+            table=(
+                embedded_table
+                if embedded_table is not None
+                else FastUrlTable()
+                if settings.url_table_adapter == "client"
+                else UrlTable(dyn_resource=create_dyn_resource())
+            ),
+            bloom_filter=bloom_filter,
+        )
+        for _ in range(settings.key_generator_workers)
+    ]
+    lease = GeneratorLease(
+        owner=f"{socket.gethostname()}:{os.getpid()}",
+        ttl=settings.key_generator_lease_ttl,
+    )
+    service = KeyGeneratorService(
+        generators=generators,
+        lease=lease,
+        low_watermark=settings.short_url_minimum_queue_size,
+        high_watermark=settings.short_url_maximum_queue_size,
+        batch_size=settings.short_url_generation_batch_size,
+        idle_timeout=settings.key_generator_idle_timeout,
+    )
+    try:
+        service.run()
+    finally:
+        lease.release()
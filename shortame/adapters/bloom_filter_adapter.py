@@ -0,0 +1,181 @@
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+from math import ceil, log
+from typing import Iterable, List
+
+from loguru import logger
+from loguru._logger import Logger
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+from shortame.adapters.redis_adapter import get_async_redis_client, get_redis_client
+
+
+class AbstractBloomFilter(ABC):
+    """
+    Abstract Bloom filter of issued short urls.
+
+    A negative answer is definitive (the key was never issued), a positive one
+    may be a false positive with probability error_rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        """
+        :param capacity: how many keys the filter is sized for, e.g.: 10_000_000
+        :param error_rate: the false positive rate expected at capacity, e.g.: 0.001
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+
+    def _positions(self, short_url: str) -> List[int]:
+        digest = blake2b(short_url.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    @abstractmethod
+    def add(self):
+        pass
+
+    @abstractmethod
+    def add_many(self):
+        pass
+
+    @abstractmethod
+    def might_contain(self):
+        pass
+
+    @abstractmethod
+    def might_contain_many(self):
+        pass
+
+
+class BloomFilter(AbstractBloomFilter):
+    """
+    In-process Bloom filter.
+
+    Only sound when a single process issues every key, e.g.: tests or single-node installs.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        super().__init__(capacity=capacity, error_rate=error_rate)
+        self.bits = bytearray(ceil(self.size / 8))
+
+    def add(self, short_url: str) -> None:
+        for position in self._positions(short_url):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def add_many(self, short_urls: Iterable[str]) -> None:
+        for short_url in short_urls:
+            self.add(short_url)
+
+    def might_contain(self, short_url: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(short_url)
+        )
+
+    def might_contain_many(self, short_urls: Iterable[str]) -> List[bool]:
+        return [self.might_contain(short_url) for short_url in short_urls]
+
+
+class RedisBloomFilter(AbstractBloomFilter):
+    """Bloom filter kept in a Redis bitmap, shared by every app worker and the key generator."""
+
+    def __init__(
+        self,
+        redis_client: Redis = None,
+        filter_name: str = "issued_urls_bloom",
+        capacity: int = 10_000_000,
+        error_rate: float = 0.001,
+        logger: Logger = logger,
+    ):
+        super().__init__(capacity=capacity, error_rate=error_rate)
+        self.redis_client = redis_client or get_redis_client()
+        self.filter_name = filter_name
+        self.logger = logger
+
+    def add(self, short_url: str) -> None:
+        self.add_many([short_url])
+
+    def add_many(self, short_urls: Iterable[str]) -> None:
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for short_url in short_urls:
+                for position in self._positions(short_url):
+                    pipe.setbit(self.filter_name, position, 1)
+            pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding short urls to filter {self.filter_name}")
+            raise e
+
+    def might_contain(self, short_url: str) -> bool:
+        return self.might_contain_many([short_url])[0]
+
+    def might_contain_many(self, short_urls: Iterable[str]) -> List[bool]:
+        short_urls = list(short_urls)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for short_url in short_urls:
+                for position in self._positions(short_url):
+                    pipe.getbit(self.filter_name, position)
+            bits = pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while checking short urls on filter {self.filter_name}")
+            raise e
+        return [
+            all(bits[i * self.hash_count : (i + 1) * self.hash_count])
+            for i in range(len(short_urls))
+        ]
+
+
+class AsyncRedisBloomFilter(AbstractBloomFilter):
+    """Non-blocking version of RedisBloomFilter, backed by redis.asyncio"""
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis = None,
+        filter_name: str = "issued_urls_bloom",
+        capacity: int = 10_000_000,
+        error_rate: float = 0.001,
+        logger: Logger = logger,
+    ):
+        super().__init__(capacity=capacity, error_rate=error_rate)
+        self.redis_client = redis_client or get_async_redis_client()
+        self.filter_name = filter_name
+        self.logger = logger
+
+    async def add(self, short_url: str) -> None:
+        await self.add_many([short_url])
+
+    async def add_many(self, short_urls: Iterable[str]) -> None:
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for short_url in short_urls:
+                for position in self._positions(short_url):
+                    pipe.setbit(self.filter_name, position, 1)
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding short urls to filter {self.filter_name}")
+            raise e
+
+    async def might_contain(self, short_url: str) -> bool:
+        return (await self.might_contain_many([short_url]))[0]
+
+    async def might_contain_many(self, short_urls: Iterable[str]) -> List[bool]:
+        short_urls = list(short_urls)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for short_url in short_urls:
+                for position in self._positions(short_url):
+                    pipe.getbit(self.filter_name, position)
+            bits = await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while checking short urls on filter {self.filter_name}")
+            raise e
+        return [
+            all(bits[i * self.hash_count : (i + 1) * self.hash_count])
+            for i in range(len(short_urls))
+        ]
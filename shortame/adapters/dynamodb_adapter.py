@@ -1,29 +1,80 @@
 # File with adapter for dynamodb usage
+import asyncio
+import os
 from abc import ABC, abstractmethod
-from dataclasses import asdict
-from typing import Dict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from decimal import Decimal
+from functools import partial
+from threading import local
+from time import sleep
+from typing import Callable, Dict, Iterable, Iterator, List
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from loguru import logger
 from loguru._logger import Logger
+from mypy_boto3_dynamodb.client import DynamoDBClient
 from mypy_boto3_dynamodb.service_resource import DynamoDBServiceResource, Table
 
-from shortame.config import settings
-from shortame.domain.model import Url
+from shortame.config import get_botocore_config, settings
+from shortame.domain.model import Url, hash_long_url, url_to_item
+
+
+def _connection_settings() -> Dict:
+    return {
+        "endpoint_url": settings.dynamodb_endpoint,
+        "aws_access_key_id": settings.aws_access_key_id,
+        "aws_secret_access_key": settings.aws_secret_access_key,
+        "region_name": settings.aws_region_name,
+        "config": get_botocore_config(),
+    }
+
+
+def create_dyn_resource() -> DynamoDBServiceResource:
+    """Creates a DynamoDB resource on its own session, resources must not be shared across threads."""
+    return boto3.session.Session().resource("dynamodb", **_connection_settings())
+
+
+def create_dyn_client() -> DynamoDBClient:
+    """Creates a low-level DynamoDB client, which unlike resources can be shared across threads."""
+    return boto3.session.Session().client("dynamodb", **_connection_settings())
+
+
+# created on first use and kept per process, so forked workers never share sockets
+_dyn_resources: Dict[int, DynamoDBServiceResource] = {}
+_dyn_clients: Dict[int, DynamoDBClient] = {}
+
+
+def get_dyn_resource() -> DynamoDBServiceResource:
+    """Returns the DynamoDB resource of the current process, creating it on first use."""
+    pid = os.getpid()
+    if pid not in _dyn_resources:
+        _dyn_resources[pid] = create_dyn_resource()
+    return _dyn_resources[pid]
+
+
+def get_dyn_client() -> DynamoDBClient:
+    """Returns the low-level DynamoDB client of the current process, creating it on first use."""
+    pid = os.getpid()
+    if pid not in _dyn_clients:
+        _dyn_clients[pid] = create_dyn_client()
+    return _dyn_clients[pid]
+
+
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_ITEMS = 25
+# what a redirect needs to read, the redirect overrides are only on some items
+URL_PROJECTION = "long_url, redirect_status, cache_max_age"
 
-dyn_resource = boto3.resource(
-    "dynamodb",
-    endpoint_url=settings.dynamodb_endpoint,
-    aws_access_key_id=settings.aws_access_key_id,
-    aws_secret_access_key=settings.aws_secret_access_key,
-    region_name=settings.aws_region_name,
-)
 
 class ShortUrlNotFoundOnTable(Exception):
     pass
 
 
+class LongUrlNotFoundOnIndex(Exception):
+    pass
+
+
 class AbstractDynamoDBUrlTable(ABC):
     """Abstract Dynamo DB table"""
 
@@ -35,34 +86,45 @@ class AbstractDynamoDBUrlTable(ABC):
     def add_url(self):
         pass
 
+    @abstractmethod
+    def add_urls(self):
+        pass
+
     @abstractmethod
     def get_url(self):
         pass
 
+    @abstractmethod
+    def batch_get_urls(self):
+        pass
+
 class UrlTable(AbstractDynamoDBUrlTable):
     """Encapsulates an Amazon DynamoDB table of shortened urls."""
 
     def __init__(
         self,
-        dyn_resource: DynamoDBServiceResource = dyn_resource,
+        dyn_resource: DynamoDBServiceResource = None,
         table_name: str = "url",
         logger: Logger = logger,
+        verify_table: bool = True,
     ):
         """
         Initializes a UrlTable object.
 
-        :param dyn_resource: A Boto3 DynamoDB resource.
+        :param dyn_resource: A Boto3 DynamoDB resource, defaults to the one of the current process.
         :param table_name: the name of the DynamoDB table, default to 'url'.
+        :param verify_table: describes the table to check it exists, set to False to skip
+            that network call when the table is known to exist.
         """
-        self.dyn_resource = dyn_resource
+        self.dyn_resource = dyn_resource or get_dyn_resource()
         self.table_name = table_name
         self.logger = logger
-        self.table = self._load_table()
+        self.table = self._load_table() if verify_table else self.dyn_resource.Table(self.table_name)
 
     def _load_table(self) -> Table:
         """Tries to load a table using the table's name."""
         try:
-            self.logger.info(f"Attempting to load table '{self.table_name}'")
+            self.logger.info("Attempting to load table '{}'", self.table_name)
             table = self.dyn_resource.Table(self.table_name)
             table.load()
         except ClientError as err:
@@ -72,18 +134,33 @@ class UrlTable(AbstractDynamoDBUrlTable):
                 error_response = err.response["Error"]["Code"]
                 error_message = err.response["Error"]["Message"]
                 self.logger.error(
-                    f"Couldn't check for existence of {table_name}. Here's why: {error_response}: {error_message}",
+                    f"Couldn't check for existence of {self.table_name}. Here's why: {error_response}: {error_message}",
                 )
                 raise
         else:
             return table
 
+    @property
+    def _batch_api(self):
+        """Where batch requests are sent, the resource (de)serializes their items."""
+        return self.dyn_resource
+
+    def _encode_item(self, url: Url) -> Dict:
+        return url_to_item(url)
+
+    def _encode_key(self, short_url: str) -> Dict:
+        return {"short_url": short_url}
+
+    def _decode_item(self, item: Dict) -> Dict[str, str | int]:
+        # the resource reads numbers (redirect overrides) as Decimal
+        return {name: int(value) if isinstance(value, Decimal) else value for name, value in item.items()}
+
     def add_url(self, url: Url) -> bool:
         """Add Url object to the database."""
         try:
-            self.logger.info(f"Adding url {url.short_url} to database")
-            self.table.put_item(Item=asdict(url))
-            self.logger.info(f"Successfully added url '{url}' on table")
+            self.logger.debug("Adding url {} to database", url.short_url)
+            self.table.put_item(Item=self._encode_item(url))
+            self.logger.debug("Successfully added url '{}' on table", url)
         except ClientError as err:
             error_code = err.response["Error"]["Code"]
             error_message = err.response["Error"]["Message"]
@@ -95,6 +172,45 @@ class UrlTable(AbstractDynamoDBUrlTable):
         else:
             return True
 
+    def add_urls(self, urls: List[Url], max_attempts: int = 5) -> bool:
+        """
+        Add several Url objects to the database, using BatchWriteItem.
+
+        Items are written in chunks of 25 (the BatchWriteItem limit) and unprocessed
+        items are retried with exponential backoff.
+
+        :param urls: the Url objects to be added, with distinct short urls
+        :param max_attempts: how many times unprocessed items are retried before giving up
+        """
+        self.logger.debug("Adding {} urls to database", len(urls))
+        for start in range(0, len(urls), BATCH_WRITE_MAX_ITEMS):
+            requests = [
+                {"PutRequest": {"Item": self._encode_item(url)}}
+                for url in urls[start : start + BATCH_WRITE_MAX_ITEMS]
+            ]
+            self._batch_write_chunk(requests, max_attempts)
+        self.logger.debug("Successfully added {} urls on table", len(urls))
+        return True
+
+    def _batch_write_chunk(self, requests: List[Dict], max_attempts: int) -> None:
+        request_items = {self.table_name: requests}
+        for attempt in range(max_attempts):
+            try:
+                response = self._batch_api.batch_write_item(RequestItems=request_items)
+            except ClientError as err:
+                error_code = err.response["Error"]["Code"]
+                error_message = err.response["Error"]["Message"]
+                self.logger.error(f"Couldn't batch add urls to table {self.table_name}.")
+                self.logger.error(f"Here's why: {error_code}: {error_message}")
+                raise
+            request_items = response.get("UnprocessedItems")
+            if not request_items:
+                return
+            sleep(0.05 * 2**attempt)
+        raise RuntimeError(
+            f"Couldn't add every url to {self.table_name} table after {max_attempts} attempts"
+        )
+
     def get_url(self, short_url: str) -> Dict[str, str] | None:
         """
         Gets a original long url from the database given a short_url input.
@@ -103,9 +219,7 @@ class UrlTable(AbstractDynamoDBUrlTable):
         :return url: the url dict with the long and short versions
         """
         try:
-            self.logger.info(
-                f"Attempting to get '{short_url}' from  {self.table_name} table"
-            )
+            self.logger.debug("Attempting to get '{}' from  {} table", short_url, self.table_name)
             response = self.table.get_item(Key={"short_url": short_url})
         except ClientError as err:
             error_code = err.response["Error"]["Code"]
@@ -120,6 +234,498 @@ class UrlTable(AbstractDynamoDBUrlTable):
                 raise ShortUrlNotFoundOnTable(
                     f"Short url '{short_url}' does not exist on {self.table_name} table"
                 )
-            url = response.get("Item")
-            self.logger.info(f"Successfully fetched url '{url}' from table")
+            url = self._decode_item(response.get("Item"))
+            self.logger.debug("Successfully fetched url '{}' from table", url)
             return url
+
+    def batch_get_urls(
+        self,
+        short_urls: Iterable[str],
+        projection: str | None = None,
+        max_attempts: int = 5,
+    ) -> List[Dict[str, str]]:
+        """
+        Gets every existing url among the given short urls, using BatchGetItem.
+
+        Keys are requested in chunks of 100 (the BatchGetItem limit) and unprocessed
+        keys are retried with exponential backoff.
+
+        :param short_urls: the paths of the shortened urls, e.g.: [xyz1234, abc9876]
+        :param projection: attributes to fetch, e.g.: 'short_url', defaults to the whole item
+        :param max_attempts: how many times unprocessed keys are retried before giving up
+        :return urls: the url dicts found on the table, in no particular order
+        """
+        keys = [self._encode_key(short_url) for short_url in dict.fromkeys(short_urls)]
+        urls = []
+        for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+            request = {"Keys": keys[start : start + BATCH_GET_MAX_KEYS]}
+            if projection:
+                request["ProjectionExpression"] = projection
+            urls.extend(self._batch_get_chunk(request, max_attempts))
+        self.logger.debug("Fetched {} of {} urls from table", len(urls), len(keys))
+        return urls
+
+    def _batch_get_chunk(self, request: Dict, max_attempts: int) -> List[Dict[str, str]]:
+        urls = []
+        request_items = {self.table_name: request}
+        for attempt in range(max_attempts):
+            try:
+                response = self._batch_api.batch_get_item(RequestItems=request_items)
+            except ClientError as err:
+                error_code = err.response["Error"]["Code"]
+                error_message = err.response["Error"]["Message"]
+                self.logger.error(f"Couldn't batch get urls from {self.table_name} table.")
+                self.logger.error(f"Here's why: {error_code}: {error_message}")
+                raise
+            urls.extend(self._decode_item(item) for item in response["Responses"].get(self.table_name, []))
+            request_items = response.get("UnprocessedKeys")
+            if not request_items:
+                return urls
+            sleep(0.05 * 2**attempt)
+        raise RuntimeError(
+            f"Couldn't fetch every key from {self.table_name} table after {max_attempts} attempts"
+        )
+
+    def _scan_page(self, **kwargs) -> Dict:
+        return self.table.scan(**kwargs)
+
+    def scan_urls(self, segment: int = 0, total_segments: int = 1) -> Iterator[Dict[str, str]]:
+        """
+        Yields every url on a segment of the table, using Scan.
+
+        :param segment: the segment to scan, from 0 to total_segments - 1
+        :param total_segments: how many segments the table is split into, each one can be scanned in parallel
+        """
+        kwargs = {"Segment": segment, "TotalSegments": total_segments}
+        while True:
+            try:
+                response = self._scan_page(**kwargs)
+            except ClientError as err:
+                error_code = err.response["Error"]["Code"]
+                error_message = err.response["Error"]["Message"]
+                self.logger.error(f"Couldn't scan segment {segment} of {self.table_name} table.")
+                self.logger.error(f"Here's why: {error_code}: {error_message}")
+                raise
+            for item in response["Items"]:
+                yield self._decode_item(item)
+            if "LastEvaluatedKey" not in response:
+                return
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class FastUrlTable(UrlTable):
+    """
+    UrlTable on the low-level DynamoDB client.
+
+    Items have a fixed schema ({short_url: S, long_url: S}), so they are encoded and
+    decoded by hand instead of going through boto3's TypeSerializer/TypeDeserializer.
+    Reads only fetch the long url and are eventually consistent by default, which
+    halves their cost in read capacity units.
+    """
+
+    def __init__(
+        self,
+        dyn_client: DynamoDBClient = None,
+        table_name: str = "url",
+        logger: Logger = logger,
+        verify_table: bool = True,
+        consistent_read: bool = False,
+    ):
+        """
+        Initializes a FastUrlTable object.
+
+        :param dyn_client: A low-level Boto3 DynamoDB client, defaults to the one of the current process.
+        :param table_name: the name of the DynamoDB table, default to 'url'.
+        :param verify_table: describes the table to check it exists, set to False to skip
+            that network call when the table is known to exist.
+        :param consistent_read: whether reads are strongly consistent, default to False.
+        """
+        self.dyn_client = dyn_client or get_dyn_client()
+        self.table_name = table_name
+        self.logger = logger
+        self.consistent_read = consistent_read
+        # there is no Table object on the client API, the table is referred to by its name
+        self.table = self._load_table() if verify_table else self.table_name
+
+    def _load_table(self) -> str | None:
+        """Checks the table exists, returns its name or None when it doesn't."""
+        try:
+            self.logger.info("Attempting to load table '{}'", self.table_name)
+            self.dyn_client.describe_table(TableName=self.table_name)
+        except ClientError as err:
+            if err.response["Error"]["Code"] == "ResourceNotFoundException":
+                return None
+            error_response = err.response["Error"]["Code"]
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(
+                f"Couldn't check for existence of {self.table_name}. Here's why: {error_response}: {error_message}",
+            )
+            raise
+        return self.table_name
+
+    @property
+    def _batch_api(self):
+        return self.dyn_client
+
+    def _encode_item(self, url: Url) -> Dict:
+        return {
+            name: {"N": str(value)} if isinstance(value, int) else {"S": value}
+            for name, value in url_to_item(url).items()
+        }
+
+    def _encode_key(self, short_url: str) -> Dict:
+        return {"short_url": {"S": short_url}}
+
+    def _decode_item(self, item: Dict) -> Dict[str, str | int]:
+        return {name: value["S"] if "S" in value else int(value["N"]) for name, value in item.items()}
+
+    def _scan_page(self, **kwargs) -> Dict:
+        return self.dyn_client.scan(TableName=self.table_name, **kwargs)
+
+    def add_url(self, url: Url) -> bool:
+        """Add Url object to the database."""
+        try:
+            self.logger.debug("Adding url {} to database", url.short_url)
+            self.dyn_client.put_item(TableName=self.table_name, Item=self._encode_item(url))
+        except ClientError as err:
+            error_code = err.response["Error"]["Code"]
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(
+                f"Couldn't add url {url.short_url} to table {self.table_name}."
+            )
+            self.logger.error(f"Here's why: {error_code}: {error_message}")
+            raise
+        else:
+            return True
+
+    def get_url(self, short_url: str) -> Dict[str, str] | None:
+        """
+        Gets a original long url from the database given a short_url input.
+
+        :param short_url: the path of the shortened url, e.g.: xyz1234
+        :return url: the url dict with the long and short versions
+        """
+        try:
+            self.logger.debug("Attempting to get '{}' from {} table", short_url, self.table_name)
+            response = self.dyn_client.get_item(
+                TableName=self.table_name,
+                Key=self._encode_key(short_url),
+                ProjectionExpression=URL_PROJECTION,
+                ConsistentRead=self.consistent_read,
+            )
+        except ClientError as err:
+            error_code = err.response["Error"]["Code"]
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(
+                f"Couldn't get short url '{short_url}' from {self.table_name} table."
+            )
+            self.logger.error(f"Here's why: {error_code}: {error_message}")
+            raise
+        item = response.get("Item")
+        if not item:
+            raise ShortUrlNotFoundOnTable(
+                f"Short url '{short_url}' does not exist on {self.table_name} table"
+            )
+        return {"short_url": short_url, **self._decode_item(item)}
+
+
+class ThreadLocalUrlTable(AbstractDynamoDBUrlTable):
+    """
+    Keeps a url table per thread, for tables which must not be shared across threads.
+
+    Meant for UrlTable, whose resource isn't thread-safe, when it's called from several
+    threads (e.g.: by AsyncUrlTable, from the executor). Each thread builds its table on
+    its first call.
+    """
+
+    def __init__(self, create_table: Callable[[], AbstractDynamoDBUrlTable], logger: Logger = logger):
+        """
+        Initializes a ThreadLocalUrlTable object.
+
+        :param create_table: builds the table of a thread, e.g.: a UrlTable on a resource of its own.
+        """
+        self.create_table = create_table
+        self.logger = logger
+        self._local = local()
+        self.table_name = self._thread_table().table_name
+        self.table = self._load_table()
+
+    def _thread_table(self) -> AbstractDynamoDBUrlTable:
+        table = getattr(self._local, "table", None)
+        if table is None:
+            table = self._local.table = self.create_table()
+        return table
+
+    def _load_table(self):
+        return self._thread_table().table
+
+    def add_url(self, url: Url) -> bool:
+        return self._thread_table().add_url(url)
+
+    def add_urls(self, urls: List[Url], **kwargs) -> bool:
+        return self._thread_table().add_urls(urls, **kwargs)
+
+    def get_url(self, short_url: str) -> Dict[str, str]:
+        return self._thread_table().get_url(short_url)
+
+    def batch_get_urls(self, short_urls: Iterable[str], **kwargs) -> List[Dict[str, str]]:
+        return self._thread_table().batch_get_urls(short_urls, **kwargs)
+
+    def scan_urls(self, **kwargs) -> Iterator[Dict[str, str]]:
+        return self._thread_table().scan_urls(**kwargs)
+
+
+class AsyncUrlTable(AbstractDynamoDBUrlTable):
+    """
+    Non-blocking facade over a UrlTable.
+
+    boto3 has no asyncio support, so every call is offloaded to an executor
+    and awaited, which keeps the event loop free while DynamoDB answers.
+    """
+
+    def __init__(
+        self,
+        url_table: AbstractDynamoDBUrlTable = None,
+        executor: Executor | None = None,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes an AsyncUrlTable object.
+
+        :param url_table: the synchronous table doing the actual work, called from the executor's
+            threads so it must be thread-safe, defaults to FastUrlTable() (clients are, unlike
+            resources: wrap a UrlTable in a ThreadLocalUrlTable).
+        :param executor: where blocking calls run, defaults to the loop's default executor.
+        """
+        self.url_table = url_table if url_table is not None else FastUrlTable()
+        self.executor = executor
+        self.logger = logger
+        self.table_name = self.url_table.table_name
+        self.table = self._load_table()
+
+    def _load_table(self) -> Table:
+        return self.url_table.table
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def add_url(self, url: Url) -> bool:
+        """Add Url object to the database without blocking the event loop."""
+        return await self._run(self.url_table.add_url, url)
+
+    async def add_urls(self, urls: List[Url], **kwargs) -> bool:
+        """Add several Url objects to the database without blocking the event loop."""
+        return await self._run(self.url_table.add_urls, urls, **kwargs)
+
+    async def get_url(self, short_url: str) -> Dict[str, str] | None:
+        """
+        Gets a original long url from the database without blocking the event loop.
+
+        :param short_url: the path of the shortened url, e.g.: xyz1234
+        :return url: the url dict with the long and short versions
+        """
+        return await self._run(self.url_table.get_url, short_url)
+
+    async def batch_get_urls(self, short_urls: Iterable[str], **kwargs) -> List[Dict[str, str]]:
+        """Gets every existing url among the given short urls without blocking the event loop."""
+        return await self._run(self.url_table.batch_get_urls, list(short_urls), **kwargs)
+
+
+class LongUrlIndexTable:
+    """
+    Encapsulates an Amazon DynamoDB table indexing short urls by a hash of their long url.
+
+    Used to deduplicate shortenings: a long url submitted again gets its first short url back.
+    It goes through the low-level client, as AsyncLongUrlIndexTable calls it from several threads.
+    """
+
+    def __init__(
+        self,
+        dyn_client: DynamoDBClient = None,
+        table_name: str = "url_dedup",
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a LongUrlIndexTable object.
+
+        :param dyn_client: A low-level Boto3 DynamoDB client, defaults to the one of the current process.
+        :param table_name: the name of the DynamoDB table, default to 'url_dedup'.
+        """
+        self.dyn_client = dyn_client or get_dyn_client()
+        self.table_name = table_name
+        self.logger = logger
+
+    def add(self, url: Url) -> bool:
+        """
+        Indexes an url by its long url, unless the long url is already indexed.
+
+        :return added: False if another short url already holds the long url
+        """
+        try:
+            self.logger.debug("Indexing url '{}' by its long url", url.short_url)
+            self.dyn_client.put_item(
+                TableName=self.table_name,
+                Item={"long_url_hash": {"S": hash_long_url(url.long_url)}, "short_url": {"S": url.short_url}},
+                ConditionExpression="attribute_not_exists(long_url_hash)",
+            )
+        except ClientError as err:
+            error_code = err.response["Error"]["Code"]
+            if error_code == "ConditionalCheckFailedException":
+                return False
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(f"Couldn't index url {url.short_url} on table {self.table_name}.")
+            self.logger.error(f"Here's why: {error_code}: {error_message}")
+            raise
+        return True
+
+    def get_short_url(self, long_url: str) -> str:
+        """
+        Gets the short url already issued for a long url.
+
+        :param long_url: the original url, e.g.: https://example.com
+        :return short_url: the path of the shortened url, e.g.: xyz1234
+        """
+        try:
+            response = self.dyn_client.get_item(
+                TableName=self.table_name,
+                Key={"long_url_hash": {"S": hash_long_url(long_url)}},
+                ProjectionExpression="short_url",
+            )
+        except ClientError as err:
+            error_code = err.response["Error"]["Code"]
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(f"Couldn't look up a long url on table {self.table_name}.")
+            self.logger.error(f"Here's why: {error_code}: {error_message}")
+            raise
+        if not response.get("Item"):
+            raise LongUrlNotFoundOnIndex(f"Long url is not indexed on {self.table_name} table")
+        return response["Item"]["short_url"]["S"]
+
+
+class AsyncLongUrlIndexTable:
+    """Non-blocking facade over a LongUrlIndexTable, see AsyncUrlTable"""
+
+    def __init__(
+        self,
+        index_table: LongUrlIndexTable = None,
+        executor: Executor | None = None,
+    ):
+        self.index_table = index_table if index_table is not None else LongUrlIndexTable()
+        self.executor = executor
+        self.table_name = self.index_table.table_name
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def add(self, url: Url) -> bool:
+        return await self._run(self.index_table.add, url)
+
+    async def get_short_url(self, long_url: str) -> str:
+        return await self._run(self.index_table.get_short_url, long_url)
+
+
+class ClickStatsTable:
+    """
+    Encapsulates an Amazon DynamoDB table of click counts per short url.
+
+    Counts are kept apart from the url table, so an update can never create a url
+    item without a long url. Each flush adds to the counts with one UpdateItem per url,
+    sent concurrently from a small thread pool (the client is thread-safe).
+    """
+
+    def __init__(
+        self,
+        dyn_client: DynamoDBClient = None,
+        table_name: str = "url_clicks",
+        logger: Logger = logger,
+        max_workers: int = 8,
+    ):
+        """
+        Initializes a ClickStatsTable object.
+
+        :param dyn_client: A low-level Boto3 DynamoDB client, defaults to the one of the current process.
+        :param table_name: the name of the DynamoDB table, default to 'url_clicks'.
+        :param max_workers: how many UpdateItem requests are in flight at once, e.g.: 8
+        """
+        self.dyn_client = dyn_client or get_dyn_client()
+        self.table_name = table_name
+        self.logger = logger
+        self.max_workers = max_workers
+        self._executor: ThreadPoolExecutor | None = None
+
+    def add_clicks(self, clicks: Dict[str, int]) -> Dict[str, int]:
+        """
+        Adds to the click counts of several short urls.
+
+        A url whose update fails doesn't stop the others from being written.
+
+        :param clicks: how many new clicks each short url got, e.g.: {"xyz1234": 3}
+        :return failed: the clicks which couldn't be written, by short url
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="click-stats")
+        written = self._executor.map(self._add_clicks_of, clicks.keys(), clicks.values())
+        return {short_url: count for (short_url, count), ok in zip(clicks.items(), written) if not ok}
+
+    def _add_clicks_of(self, short_url: str, count: int) -> bool:
+        try:
+            self.dyn_client.update_item(
+                TableName=self.table_name,
+                Key={"short_url": {"S": short_url}},
+                UpdateExpression="ADD clicks :count",
+                ExpressionAttributeValues={":count": {"N": str(count)}},
+            )
+        except ClientError as err:
+            error_code = err.response["Error"]["Code"]
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(f"Couldn't add clicks of '{short_url}' to table {self.table_name}.")
+            self.logger.error(f"Here's why: {error_code}: {error_message}")
+            return False
+        except BotoCoreError as err:
+            # timeouts and connection errors, which carry no response
+            self.logger.error(f"Couldn't add clicks of '{short_url}' to table {self.table_name}.")
+            self.logger.error(f"Here's why: {err}")
+            return False
+        return True
+
+    def get_clicks(self, short_url: str) -> int:
+        """Gets the click count of a short url, 0 if it was never clicked."""
+        try:
+            response = self.dyn_client.get_item(
+                TableName=self.table_name,
+                Key={"short_url": {"S": short_url}},
+                ProjectionExpression="clicks",
+            )
+        except ClientError as err:
+            error_code = err.response["Error"]["Code"]
+            error_message = err.response["Error"]["Message"]
+            self.logger.error(f"Couldn't get clicks of '{short_url}' from table {self.table_name}.")
+            self.logger.error(f"Here's why: {error_code}: {error_message}")
+            raise
+        item = response.get("Item")
+        return int(item["clicks"]["N"]) if item else 0
+
+
+class AsyncClickStatsTable:
+    """Non-blocking facade over a ClickStatsTable, see AsyncUrlTable"""
+
+    def __init__(
+        self,
+        stats_table: ClickStatsTable = None,
+        executor: Executor | None = None,
+    ):
+        self.stats_table = stats_table if stats_table is not None else ClickStatsTable()
+        self.executor = executor
+        self.table_name = self.stats_table.table_name
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def add_clicks(self, clicks: Dict[str, int]) -> Dict[str, int]:
+        return await self._run(self.stats_table.add_clicks, clicks)
+
+    async def get_clicks(self, short_url: str) -> int:
+        return await self._run(self.stats_table.get_clicks, short_url)
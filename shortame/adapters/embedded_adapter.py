@@ -0,0 +1,553 @@
+# File with an url table embedded on the app, stored on local files
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from functools import partial
+from hashlib import blake2b
+from threading import Lock, RLock, Thread
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.dynamodb_adapter import AbstractDynamoDBUrlTable, ShortUrlNotFoundOnTable
+from shortame.domain.model import Url, decode_long_url, encode_long_url, url_to_item
+
+# log record header: crc32 of the key and value, key length, value length
+LOG_RECORD = struct.Struct("<IHH")
+# index header: magic, version, retired flag, slot count, live keys, log records, bytes of the log indexed
+INDEX_HEADER = struct.Struct("<4sHBxQQQQ")
+INDEX_MAGIC = b"SHIX"
+INDEX_VERSION = 1
+RETIRED_OFFSET = 6
+# index slot: fingerprint of the key (0 when the slot is empty), offset of its record on the log
+INDEX_SLOT = struct.Struct("<QQ")
+# most records fit on a single read
+RECORD_READ_SIZE = 512
+# compaction writes the live records by chunks of this many bytes
+COMPACTION_WRITE_SIZE = 1 << 20
+
+
+class TableFiles:
+    """The open log and mapped index of a generation of an EmbeddedUrlTable."""
+
+    def __init__(self, generation: int, log_fd: int, index_fd: int, index: mmap.mmap):
+        self.generation = generation
+        self.log_fd = log_fd
+        self.index_fd = index_fd
+        self.index = index
+        self.slots = INDEX_HEADER.unpack_from(index, 0)[3]
+        # threads of this process reading it, a retired generation is only closed once they're done
+        self.readers = 0
+
+    @property
+    def retired(self) -> bool:
+        return bool(self.index[RETIRED_OFFSET])
+
+    def close(self) -> None:
+        self.index.close()
+        os.close(self.index_fd)
+        os.close(self.log_fd)
+
+
+class EmbeddedUrlTable(AbstractDynamoDBUrlTable):
+    """
+    Url table stored on local files, so reading it takes no network hop.
+
+    Urls are appended to a log, each record framed by its crc32 and lengths, and
+    located through a hash index on a memory mapped file: an open-addressing table of
+    key fingerprints and log offsets. A lookup reads the index without any lock and the
+    record with a single pread, both usually on the page cache. Writers append under a
+    flock, so the workers of a host and the key generator can share the same files.
+
+    The index remembers how much of the log it covers: on open, the records appended
+    after that are replayed into it, and a torn or corrupt tail (a crash mid-append) is
+    truncated. Once the index is half full, or half of the records are overwritten ones,
+    a background thread compacts the table into a new generation: a log of the live
+    records and an index four times their count. CURRENT names the generation in use,
+    and processes still on a retired one switch to the new one on their next call.
+    """
+
+    def __init__(
+        self,
+        path: str = "data/url_table",
+        table_name: str = "url",
+        logger: Logger = logger,
+        sync: bool = False,
+        initial_slots: int = 65536,
+        compaction_min_records: int = 1000,
+    ):
+        """
+        Initializes an EmbeddedUrlTable object, creating or recovering its files.
+
+        :param path: the directory of the table, shared by every process using it.
+        :param table_name: only names the table on logs and errors, default to 'url'.
+        :param sync: fsyncs the log on every write, otherwise writes survive a crash of
+            the process but not of the host.
+        :param initial_slots: index slots of a new table, e.g.: 65536 (1MiB)
+        :param compaction_min_records: overwritten records are only compacted past this many records
+        """
+        self.path = path
+        self.table_name = table_name
+        self.logger = logger
+        self.sync = sync
+        self.initial_slots = initial_slots
+        self.compaction_min_records = compaction_min_records
+        self._files = None
+        # generations replaced while readers of this process were still on them
+        self._retired_files: List[TableFiles] = []
+        self._compaction = None
+        # flock serializes the processes, the lock the threads of this one
+        self._lock = RLock()
+        # guards the generation in use and the readers count, never held while reading or writing
+        self._files_lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(path, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+        self.table = self._load_table()
+
+    def _load_table(self) -> str:
+        """Opens the current generation of the table, recovering its log."""
+        self.logger.info("Attempting to load embedded table '{}' from '{}'", self.table_name, self.path)
+        with self._exclusive():
+            with self._files_lock:
+                self._switch(self._open(self._current_generation()))
+            self._recover(self._files)
+        return self.table_name
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        with self._lock:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _file(self, name: str, generation: int) -> str:
+        return os.path.join(self.path, f"{name}.{generation}")
+
+    def _current_generation(self) -> int:
+        try:
+            with open(os.path.join(self.path, "CURRENT")) as current:
+                return int(current.read())
+        except FileNotFoundError:
+            return 0
+
+    def _set_current_generation(self, generation: int) -> None:
+        """Points CURRENT to a generation, atomically."""
+        temporary = os.path.join(self.path, "CURRENT.tmp")
+        with open(temporary, "w") as current:
+            current.write(str(generation))
+            current.flush()
+            os.fsync(current.fileno())
+        os.replace(temporary, os.path.join(self.path, "CURRENT"))
+        directory = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def _create_index(self, fd: int, slots: int) -> None:
+        os.ftruncate(fd, INDEX_HEADER.size + slots * INDEX_SLOT.size)
+        os.pwrite(fd, INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, slots, 0, 0, 0), 0)
+
+    def _open(self, generation: int, create: bool = True) -> TableFiles:
+        """Maps the index of a generation, creating an empty one if needed (and allowed), and opens its log."""
+        flags = os.O_RDWR | os.O_CREAT if create else os.O_RDWR
+        log_fd = os.open(self._file("log", generation), flags | os.O_APPEND, 0o644)
+        try:
+            index_fd = os.open(self._file("index", generation), flags, 0o644)
+        except OSError:
+            os.close(log_fd)
+            raise
+        size = os.fstat(index_fd).st_size
+        if size < INDEX_HEADER.size:
+            self._create_index(index_fd, self.initial_slots)
+            size = os.fstat(index_fd).st_size
+        files = TableFiles(generation, log_fd, index_fd, mmap.mmap(index_fd, size))
+        magic, version = INDEX_HEADER.unpack_from(files.index, 0)[:2]
+        valid_size = size == INDEX_HEADER.size + files.slots * INDEX_SLOT.size
+        if (magic, version) != (INDEX_MAGIC, INDEX_VERSION) or not valid_size:
+            files.close()
+            raise ValueError(f"Index of embedded table '{self.path}' is not valid, remove it to rebuild it")
+        return files
+
+    def _open_current(self) -> TableFiles:
+        """Opens the generation CURRENT names, again if a compaction retired and removed it meanwhile."""
+        while True:
+            generation = self._current_generation()
+            try:
+                return self._open(generation, create=False)
+            except FileNotFoundError:
+                if self._current_generation() == generation:
+                    raise
+
+    def _switch(self, files: TableFiles) -> None:
+        """Makes a generation the one in use, under the files lock."""
+        if self._files is not None:
+            self._retired_files.append(self._files)
+        self._files = files
+        self._close_retired()
+
+    def _close_retired(self) -> None:
+        """Closes the retired generations no reader is on anymore, under the files lock."""
+        for files in [files for files in self._retired_files if not files.readers]:
+            files.close()
+            self._retired_files.remove(files)
+
+    @contextmanager
+    def _reading(self) -> Iterator[TableFiles]:
+        """Yields the files of the generation in use, switching to a new one if it was retired."""
+        with self._files_lock:
+            if self._files.retired:
+                self._switch(self._open_current())
+            files = self._files
+            files.readers += 1
+        try:
+            yield files
+        finally:
+            with self._files_lock:
+                files.readers -= 1
+                if files is not self._files:
+                    self._close_retired()
+
+    def _header(self, files: TableFiles) -> Tuple[int, int, int]:
+        """Returns the live keys, the log records and the bytes of the log indexed."""
+        return INDEX_HEADER.unpack_from(files.index, 0)[4:]
+
+    def _set_header(self, files: TableFiles, keys: int, records: int, indexed: int) -> None:
+        INDEX_HEADER.pack_into(files.index, 0, INDEX_MAGIC, INDEX_VERSION, 0, files.slots, keys, records, indexed)
+
+    def _recover(self, files: TableFiles) -> None:
+        """Indexes the records appended since the index was last written, truncating a torn tail."""
+        keys, records, indexed = self._header(files)
+        log_size = os.fstat(files.log_fd).st_size
+        if indexed > log_size:
+            self.logger.warning("Index of embedded table '{}' is ahead of its log, rebuilding it", self.path)
+            files.index[INDEX_HEADER.size :] = bytes(files.slots * INDEX_SLOT.size)
+            keys, records, indexed = 0, 0, 0
+        end = indexed
+        for offset, key, length in self._scan(files, indexed):
+            keys += self._index_put(files, key, offset)
+            records += 1
+            end = offset + length
+        if end < log_size:
+            self.logger.warning(
+                "Truncating {} bytes of a torn or corrupt record on embedded table '{}'", log_size - end, self.path
+            )
+            os.ftruncate(files.log_fd, end)
+        if end != indexed:
+            self.logger.info("Replayed the log of embedded table '{}' from byte {} to {}", self.path, indexed, end)
+        self._set_header(files, keys, records, end)
+
+    def _scan(self, files: TableFiles, start: int) -> Iterator[Tuple[int, bytes, int]]:
+        """Yields the offset, key and length of every valid record from start on."""
+        with open(self._file("log", files.generation), "rb") as log:
+            log.seek(start)
+            offset = start
+            while len(header := log.read(LOG_RECORD.size)) == LOG_RECORD.size:
+                checksum, key_length, value_length = LOG_RECORD.unpack(header)
+                data = log.read(key_length + value_length)
+                if len(data) != key_length + value_length or zlib.crc32(data) != checksum:
+                    return
+                yield offset, data[:key_length], LOG_RECORD.size + len(data)
+                offset += LOG_RECORD.size + len(data)
+
+    @staticmethod
+    def _fingerprint(key: bytes) -> int:
+        return int.from_bytes(blake2b(key, digest_size=8).digest(), "little") or 1
+
+    @staticmethod
+    def _slot_offset(slot: int) -> int:
+        return INDEX_HEADER.size + slot * INDEX_SLOT.size
+
+    @staticmethod
+    def _encode(key: bytes, value: bytes) -> bytes:
+        return LOG_RECORD.pack(zlib.crc32(key + value), len(key), len(value)) + key + value
+
+    def _read_record(self, files: TableFiles, offset: int) -> Tuple[bytes, bytes]:
+        data = os.pread(files.log_fd, RECORD_READ_SIZE, offset)
+        _, key_length, value_length = LOG_RECORD.unpack_from(data)
+        end = LOG_RECORD.size + key_length + value_length
+        if len(data) < end:
+            data += os.pread(files.log_fd, end - len(data), offset + len(data))
+        return data[LOG_RECORD.size : LOG_RECORD.size + key_length], data[LOG_RECORD.size + key_length : end]
+
+    def _index_put(self, files: TableFiles, key: bytes, offset: int) -> int:
+        """Points key to a record, returns 1 if the key is new, 0 if it was overwritten."""
+        fingerprint = self._fingerprint(key)
+        slot = fingerprint % files.slots
+        while True:
+            position = self._slot_offset(slot)
+            slot_fingerprint, record = INDEX_SLOT.unpack_from(files.index, position)
+            if slot_fingerprint == 0:
+                # the offset goes first, readers only follow slots with a fingerprint
+                INDEX_SLOT.pack_into(files.index, position, 0, offset)
+                INDEX_SLOT.pack_into(files.index, position, fingerprint, offset)
+                return 1
+            if slot_fingerprint == fingerprint and self._read_record(files, record)[0] == key:
+                INDEX_SLOT.pack_into(files.index, position, fingerprint, offset)
+                return 0
+            slot = (slot + 1) % files.slots
+
+    def _lookup(self, files: TableFiles, key: bytes) -> bytes | None:
+        fingerprint = self._fingerprint(key)
+        slot = fingerprint % files.slots
+        for _ in range(files.slots):
+            slot_fingerprint, offset = INDEX_SLOT.unpack_from(files.index, self._slot_offset(slot))
+            if slot_fingerprint == 0:
+                return None
+            if slot_fingerprint == fingerprint:
+                record_key, value = self._read_record(files, offset)
+                if record_key == key:
+                    return value
+            slot = (slot + 1) % files.slots
+        return None
+
+    def _append(self, urls: List[Url]) -> None:
+        # redirect overrides are folded into the long url, as on the caches
+        entries = [(url.short_url.encode("utf-8"), encode_long_url(url).encode("utf-8")) for url in urls]
+        with self._exclusive(), self._reading() as files:
+            keys, records, indexed = self._header(files)
+            if os.fstat(files.log_fd).st_size != indexed:
+                # a writer died mid-append, its records are replayed or truncated before appending after them
+                self._recover(files)
+                keys, records, indexed = self._header(files)
+            if keys + len(entries) > files.slots * 0.9:
+                # no time to wait for the background compaction, the index must not fill up
+                files = self._compact(min_keys=keys + len(entries))
+                keys, records, indexed = self._header(files)
+            self._write(files.log_fd, b"".join(self._encode(key, value) for key, value in entries))
+            if self.sync:
+                os.fsync(files.log_fd)
+            offset = indexed
+            for key, value in entries:
+                keys += self._index_put(files, key, offset)
+                offset += LOG_RECORD.size + len(key) + len(value)
+            records += len(entries)
+            self._set_header(files, keys, records, offset)
+        self._maybe_compact(files, keys, records)
+
+    @staticmethod
+    def _write(fd: int, data: bytes) -> None:
+        """Writes all of data, os.write may write only part of it."""
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:])
+
+    def _maybe_compact(self, files: TableFiles, keys: int, records: int) -> None:
+        """Starts a background compaction once the index is half full or half the records are dead."""
+        index_full = keys > files.slots // 2
+        log_bloated = records > self.compaction_min_records and keys < records // 2
+        if not (index_full or log_bloated):
+            return
+        with self._lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = Thread(target=self.compact_quietly, daemon=True)
+                self._compaction.start()
+
+    def _compact(self, min_keys: int = 0) -> TableFiles:
+        """Writes the live records to a new generation and retires the current one, under the locks."""
+        with self._reading() as files:
+            return self._compact_files(files, min_keys)
+
+    def _compact_files(self, files: TableFiles, min_keys: int) -> TableFiles:
+        keys, records, _ = self._header(files)
+        generation = files.generation + 1
+        slots = self.initial_slots
+        while slots < max(keys, min_keys) * 4:
+            slots *= 2
+        self.logger.info(
+            "Compacting embedded table '{}': {} keys out of {} records, {} index slots", self.path, keys, records, slots
+        )
+        for name in ("log", "index"):
+            if os.path.exists(self._file(name, generation)):
+                os.remove(self._file(name, generation))
+        index_fd = os.open(self._file("index", generation), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            self._create_index(index_fd, slots)
+        finally:
+            os.close(index_fd)
+        compacted = self._open(generation)
+        chunk, live, offset = bytearray(), 0, 0
+        for slot in range(files.slots):
+            fingerprint, record = INDEX_SLOT.unpack_from(files.index, self._slot_offset(slot))
+            if fingerprint:
+                key, value = self._read_record(files, record)
+                data = self._encode(key, value)
+                chunk += data
+                # keys are unique on the index, so the new one needs no key comparison
+                self._index_insert(compacted, fingerprint, offset)
+                live += 1
+                offset += len(data)
+                if len(chunk) >= COMPACTION_WRITE_SIZE:
+                    self._write(compacted.log_fd, chunk)
+                    chunk.clear()
+        self._write(compacted.log_fd, chunk)
+        os.fsync(compacted.log_fd)
+        self._set_header(compacted, live, live, offset)
+        compacted.index.flush()
+        self._set_current_generation(generation)
+        # processes still on the retired generation switch once they see the flag
+        files.index[RETIRED_OFFSET] = 1
+        with self._files_lock:
+            self._switch(compacted)
+        for name in ("log", "index"):
+            os.remove(self._file(name, files.generation))
+        return compacted
+
+    def _index_insert(self, files: TableFiles, fingerprint: int, offset: int) -> None:
+        slot = fingerprint % files.slots
+        while INDEX_SLOT.unpack_from(files.index, self._slot_offset(slot))[0]:
+            slot = (slot + 1) % files.slots
+        INDEX_SLOT.pack_into(files.index, self._slot_offset(slot), fingerprint, offset)
+
+    def compact(self) -> None:
+        """Rewrites the table with only its live records, blocking writers (not readers) meanwhile."""
+        with self._exclusive():
+            self._compact()
+
+    def compact_quietly(self) -> None:
+        try:
+            self.compact()
+        except Exception:
+            self.logger.opt(exception=True).error("Error while compacting embedded table '{}'", self.path)
+
+    def _to_item(self, short_url: str, value: bytes) -> Dict[str, str | int]:
+        return url_to_item(decode_long_url(short_url, value.decode("utf-8")))
+
+    def add_url(self, url: Url) -> bool:
+        """Add Url object to the table."""
+        try:
+            self.logger.debug("Adding url {} to embedded table", url.short_url)
+            self._append([url])
+        except OSError as e:
+            self.logger.error(f"Couldn't add url {url.short_url} to table {self.table_name}.")
+            raise e
+        return True
+
+    def add_urls(self, urls: List[Url], max_attempts: int = 5) -> bool:
+        """
+        Add several Url objects to the table, with a single append.
+
+        :param max_attempts: unused, kept for compatibility with UrlTable
+        """
+        try:
+            self.logger.debug("Adding {} urls to embedded table", len(urls))
+            self._append(urls)
+        except OSError as e:
+            self.logger.error(f"Couldn't batch add urls to table {self.table_name}.")
+            raise e
+        return True
+
+    def get_url(self, short_url: str) -> Dict[str, str]:
+        """
+        Gets a original long url from the table given a short_url input.
+
+        :param short_url: the path of the shortened url, e.g.: xyz1234
+        :return url: the url dict with the long and short versions
+        """
+        with self._reading() as files:
+            value = self._lookup(files, short_url.encode("utf-8"))
+        if value is None:
+            raise ShortUrlNotFoundOnTable(f"Short url '{short_url}' does not exist on {self.table_name} table")
+        return self._to_item(short_url, value)
+
+    def batch_get_urls(
+        self,
+        short_urls: Iterable[str],
+        projection: str | None = None,
+        max_attempts: int = 5,
+    ) -> List[Dict[str, str]]:
+        """
+        Gets every existing url among the given short urls.
+
+        :param projection: attributes to fetch, e.g.: 'short_url', defaults to the whole item
+        :param max_attempts: unused, kept for compatibility with UrlTable
+        :return urls: the url dicts found on the table
+        """
+        attributes = [name.strip() for name in projection.split(",")] if projection else None
+        urls = []
+        with self._reading() as files:
+            for short_url in dict.fromkeys(short_urls):
+                value = self._lookup(files, short_url.encode("utf-8"))
+                if value is None:
+                    continue
+                url = self._to_item(short_url, value)
+                urls.append({name: url[name] for name in attributes if name in url} if attributes else url)
+        return urls
+
+    def scan_urls(self, segment: int = 0, total_segments: int = 1) -> Iterator[Dict[str, str]]:
+        """
+        Yields every url on a segment of the index, see UrlTable.scan_urls.
+
+        Urls added while scanning may or may not be yielded.
+        """
+        with self._reading() as files:
+            first, last = segment * files.slots // total_segments, (segment + 1) * files.slots // total_segments
+            for slot in range(first, last):
+                fingerprint, offset = INDEX_SLOT.unpack_from(files.index, self._slot_offset(slot))
+                if fingerprint:
+                    key, value = self._read_record(files, offset)
+                    yield self._to_item(key.decode("utf-8"), value)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the generation, live keys, log records and bytes, and index slots of the table."""
+        with self._reading() as files:
+            keys, records, indexed = self._header(files)
+            return {
+                "generation": files.generation,
+                "keys": keys,
+                "records": records,
+                "bytes": indexed,
+                "slots": files.slots,
+            }
+
+    def close(self) -> None:
+        if self._compaction is not None:
+            self._compaction.join()
+        for files in [*self._retired_files, self._files]:
+            files.close()
+        self._retired_files = []
+        os.close(self._lock_fd)
+
+
+class AsyncEmbeddedUrlTable(EmbeddedUrlTable):
+    """
+    Non-blocking version of EmbeddedUrlTable.
+
+    Reads only touch the page cache, so they run on the event loop: going through an
+    executor would cost more than the lookup itself. Appends run on the executor, as
+    they wait for the locks other writers and compactions hold (and for the disk if
+    sync is set).
+    """
+
+    def __init__(self, *args, executor: Executor | None = None, **kwargs):
+        """
+        Initializes an AsyncEmbeddedUrlTable object, see EmbeddedUrlTable.
+
+        :param executor: where appends run, defaults to the loop's default executor.
+        """
+        super().__init__(*args, **kwargs)
+        self.executor = executor
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def add_url(self, url: Url) -> bool:
+        return await self._run(super().add_url, url)
+
+    async def add_urls(self, urls: List[Url], **kwargs) -> bool:
+        return await self._run(super().add_urls, urls, **kwargs)
+
+    async def get_url(self, short_url: str) -> Dict[str, str]:
+        return super().get_url(short_url)
+
+    async def batch_get_urls(self, short_urls: Iterable[str], **kwargs) -> List[Dict[str, str]]:
+        return super().batch_get_urls(short_urls, **kwargs)
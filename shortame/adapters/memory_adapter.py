@@ -0,0 +1,283 @@
+import asyncio
+from collections import OrderedDict, deque
+from threading import Lock, Thread
+from time import monotonic
+from typing import Dict, List
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.redis_adapter import (MISSING_URL_MARKER, AbstractCacheQueue,
+                                             AbstractUrlQueue, EmptyQueueException,
+                                             ShortUrlMarkedAsMissing, ShortUrlNotFoundOnCache)
+from shortame.domain.model import Url
+
+
+class LocalCacheQueue(AbstractCacheQueue):
+    """
+    Bounded in-process cache of short urls, meant to sit in front of CacheQueue.
+
+    Entries are evicted in least recently used order once max_size is reached and
+    expire ttl seconds after being added, so hot links resolve without any network hop.
+    Expired urls are kept stale_ttl seconds more (unless evicted), only for get_stale.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10_000,
+        ttl: float = 300,
+        logger: Logger = logger,
+        negative_ttl: float = 60,
+        stale_ttl: float = 0,
+    ):
+        """
+        Initializes a LocalCacheQueue object.
+
+        :param max_size: how many urls are kept before evicting the least recently used one.
+        :param ttl: how many seconds an url is kept, e.g.: 300
+        :param negative_ttl: how many seconds a missing short url is remembered, e.g.: 60
+        :param stale_ttl: how many seconds an expired url can still be read with get_stale, e.g.: 3600
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = Lock()
+
+    def add(self, url: Url) -> bool:
+        self._put(url.short_url, url.long_url, self.ttl)
+        return True
+
+    def add_many(self, urls: List[Url]) -> bool:
+        for url in urls:
+            self._put(url.short_url, url.long_url, self.ttl)
+        return True
+
+    def add_missing(self, short_url: str) -> bool:
+        self._put(short_url, MISSING_URL_MARKER, self.negative_ttl)
+        return True
+
+    def _put(self, short_url: str, long_url: str, ttl: float) -> None:
+        with self._lock:
+            self._entries[short_url] = (long_url, monotonic() + ttl)
+            self._entries.move_to_end(short_url)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, short_url: str) -> str:
+        with self._lock:
+            entry = self._entries.get(short_url)
+            if entry is not None and entry[1] > monotonic():
+                self._entries.move_to_end(short_url)
+                self.hits += 1
+                if entry[0] == MISSING_URL_MARKER:
+                    raise ShortUrlMarkedAsMissing(
+                        f"Short url '{short_url}' is marked as missing on local cache"
+                    )
+                return entry[0]
+            if entry is not None and entry[1] + self.stale_ttl <= monotonic():
+                del self._entries[short_url]
+            self.misses += 1
+        raise ShortUrlNotFoundOnCache(
+            f"Short url '{short_url}' not found on local cache"
+        )
+
+    def get_stale(self, short_url: str) -> str:
+        """Returns the long url of a short url even if it expired less than stale_ttl seconds ago."""
+        with self._lock:
+            entry = self._entries.get(short_url)
+            if entry is not None and entry[0] != MISSING_URL_MARKER and entry[1] + self.stale_ttl > monotonic():
+                return entry[0]
+        raise ShortUrlNotFoundOnCache(
+            f"Short url '{short_url}' not found on local cache, not even stale"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counters plus the current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+        }
+
+
+class BufferedShortUrlQueue(AbstractUrlQueue):
+    """
+    Keeps a block of short urls reserved from a ShortUrlQueue in memory.
+
+    Short urls are served from the local buffer, which is refilled in the background
+    with a single RPOP once it goes below low_watermark, so most shortens need no
+    round-trip to get a key. Call release on shutdown to give unused keys back.
+    """
+
+    def __init__(
+        self,
+        queue: AbstractUrlQueue,
+        block_size: int = 256,
+        low_watermark: int = 64,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a BufferedShortUrlQueue object.
+
+        :param queue: the shared queue the short urls are reserved from.
+        :param block_size: how many short urls are reserved at once, e.g.: 256
+        :param low_watermark: buffer size below which a refill is started, e.g.: 64
+        """
+        self.queue = queue
+        self.queue_name = queue.queue_name
+        self.block_size = block_size
+        self.low_watermark = low_watermark
+        self.logger = logger
+        self._buffer: deque[str] = deque()
+        self._refill_lock = Lock()
+        self._refill_thread: Thread | None = None
+
+    def deque_short_url_key(self) -> str:
+        if not self._buffer:
+            self._refill()
+        try:
+            key = self._buffer.popleft()
+        except IndexError:
+            raise EmptyQueueException(f"There are no keys left on queue {self.queue_name}")
+        if len(self._buffer) < self.low_watermark:
+            self._refill_in_background()
+        return key
+
+    def deque_short_url_keys(self, count: int) -> List[str]:
+        if count > len(self._buffer):
+            return self.queue.deque_short_url_keys(count)
+        try:
+            return [self._buffer.popleft() for _ in range(count)]
+        except IndexError:
+            raise EmptyQueueException(f"There are less than {count} keys left on queue {self.queue_name}")
+
+    def enqueue_short_url_key(self, short_url: str) -> int:
+        return self.queue.enqueue_short_url_key(short_url)
+
+    def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        return self.queue.enqueue_short_url_keys(short_urls)
+
+    def current_size(self) -> int:
+        return self.queue.current_size()
+
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def _refill_in_background(self) -> None:
+        if self._refill_thread is not None and self._refill_thread.is_alive():
+            return
+        self._refill_thread = Thread(target=self._refill_quietly, daemon=True)
+        self._refill_thread.start()
+
+    def _refill_quietly(self) -> None:
+        try:
+            self._refill()
+        except Exception:
+            self.logger.opt(exception=True).error("Error while refilling the buffer of queue {}", self.queue_name)
+
+    def _refill(self) -> None:
+        with self._refill_lock:
+            if len(self._buffer) >= max(self.low_watermark, 1):
+                return
+            try:
+                self._buffer.extend(self._reserve())
+            except EmptyQueueException:
+                self.logger.warning("Queue {} is empty, can't refill the buffer", self.queue_name)
+
+    def _reserve(self) -> List[str]:
+        self.logger.info("Reserving {} short urls from queue {}", self.block_size, self.queue_name)
+        try:
+            return self.queue.deque_short_url_keys(self.block_size)
+        except EmptyQueueException:
+            # less than a block left, take them one at a time
+            return [self.queue.deque_short_url_key()]
+
+    def release(self) -> int:
+        """Gives the unused short urls back to the shared queue, returns how many."""
+        with self._refill_lock:
+            keys = list(self._buffer)
+            self._buffer.clear()
+        if keys:
+            self.logger.info("Releasing {} unused short urls to queue {}", len(keys), self.queue_name)
+            self.queue.enqueue_short_url_keys(keys)
+        return len(keys)
+
+
+class AsyncBufferedShortUrlQueue(BufferedShortUrlQueue):
+    """Non-blocking version of BufferedShortUrlQueue, to wrap an AsyncShortUrlQueue"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._async_refill_lock = asyncio.Lock()
+        self._refill_task: asyncio.Task | None = None
+
+    async def deque_short_url_key(self) -> str:
+        if not self._buffer:
+            await self._refill()
+        try:
+            key = self._buffer.popleft()
+        except IndexError:
+            raise EmptyQueueException(f"There are no keys left on queue {self.queue_name}")
+        if len(self._buffer) < self.low_watermark:
+            self._refill_in_background()
+        return key
+
+    async def deque_short_url_keys(self, count: int) -> List[str]:
+        if count > len(self._buffer):
+            return await self.queue.deque_short_url_keys(count)
+        return [self._buffer.popleft() for _ in range(count)]
+
+    async def enqueue_short_url_key(self, short_url: str) -> int:
+        return await self.queue.enqueue_short_url_key(short_url)
+
+    async def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        return await self.queue.enqueue_short_url_keys(short_urls)
+
+    async def current_size(self) -> int:
+        return await self.queue.current_size()
+
+    def _refill_in_background(self) -> None:
+        if self._refill_task is not None and not self._refill_task.done():
+            return
+        self._refill_task = asyncio.ensure_future(self._refill_quietly())
+
+    async def _refill_quietly(self) -> None:
+        try:
+            await self._refill()
+        except Exception:
+            self.logger.opt(exception=True).error("Error while refilling the buffer of queue {}", self.queue_name)
+
+    async def _refill(self) -> None:
+        async with self._async_refill_lock:
+            if len(self._buffer) >= max(self.low_watermark, 1):
+                return
+            try:
+                self._buffer.extend(await self._reserve())
+            except EmptyQueueException:
+                self.logger.warning("Queue {} is empty, can't refill the buffer", self.queue_name)
+
+    async def _reserve(self) -> List[str]:
+        self.logger.info("Reserving {} short urls from queue {}", self.block_size, self.queue_name)
+        try:
+            return await self.queue.deque_short_url_keys(self.block_size)
+        except EmptyQueueException:
+            return [await self.queue.deque_short_url_key()]
+
+    async def release(self) -> int:
+        """Gives the unused short urls back to the shared queue, returns how many."""
+        if self._refill_task is not None:
+            await asyncio.gather(self._refill_task, return_exceptions=True)
+        keys = list(self._buffer)
+        self._buffer.clear()
+        if keys:
+            self.logger.info("Releasing {} unused short urls to queue {}", len(keys), self.queue_name)
+            await self.queue.enqueue_short_url_keys(keys)
+        return len(keys)
@@ -1,14 +1,66 @@
+import asyncio
+import os
+import zlib
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from random import random
+from typing import Dict, List, Set, Tuple
 
 from fakeredis import FakeStrictRedis
 from loguru import logger
 from loguru._logger import Logger
-from redis import Redis
+from redis import BlockingConnectionPool, Redis, ResponseError, WatchError
+from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis
 
-from shortame.config import get_redis_host_and_port
-from shortame.domain.model import Url
+from shortame.config import get_redis_connection_settings, get_redis_nodes
+from shortame.domain.model import Url, hash_long_url
 
-r = Redis(**get_redis_host_and_port())
+# clients are created on first use and kept per process, so forked workers never share sockets
+_redis_clients: Dict[int, Dict[str, Redis]] = {}
+_async_redis_clients: Dict[int, Dict[str, AsyncRedis]] = {}
+
+
+def get_redis_clients() -> Dict[str, Redis]:
+    """Returns the Redis clients of the current process by node, creating them on first use."""
+    pid = os.getpid()
+    if pid not in _redis_clients:
+        _redis_clients[pid] = {
+            node: Redis(connection_pool=BlockingConnectionPool(**get_redis_connection_settings(node)))
+            for node in get_redis_nodes()
+        }
+    return _redis_clients[pid]
+
+
+def get_redis_client() -> Redis:
+    """Returns the Redis client of the current process for the primary node."""
+    return next(iter(get_redis_clients().values()))
+
+
+def get_async_redis_clients() -> Dict[str, AsyncRedis]:
+    """Returns the redis.asyncio clients of the current process by node, creating them on first use."""
+    pid = os.getpid()
+    if pid not in _async_redis_clients:
+        _async_redis_clients[pid] = {
+            node: AsyncRedis(connection_pool=AsyncBlockingConnectionPool(**get_redis_connection_settings(node)))
+            for node in get_redis_nodes()
+        }
+    return _async_redis_clients[pid]
+
+
+def get_async_redis_client() -> AsyncRedis:
+    """Returns the redis.asyncio client of the current process for the primary node."""
+    return next(iter(get_async_redis_clients().values()))
+
+
+async def close_async_redis_client() -> None:
+    """Disconnects the redis.asyncio clients of the current process, if they were ever created."""
+    clients = _async_redis_clients.pop(os.getpid(), {})
+    for client in clients.values():
+        await client.connection_pool.disconnect()
+
+# value cached for short urls known not to exist, it can never be a valid long url
+MISSING_URL_MARKER = "__missing__"
 
 
 class EmptyQueueException(Exception):
@@ -19,15 +71,27 @@ class ShortUrlNotFoundOnCache(Exception):
     pass
 
 
+class ShortUrlMarkedAsMissing(ShortUrlNotFoundOnCache):
+    """The cache remembers that the short url does not exist on the table"""
+
+
 class AbstractUrlQueue(ABC):
     @abstractmethod
     def deque_short_url_key(self):
         pass
 
+    @abstractmethod
+    def deque_short_url_keys(self):
+        pass
+
     @abstractmethod
     def enqueue_short_url_key(self):
         pass
 
+    @abstractmethod
+    def enqueue_short_url_keys(self):
+        pass
+
     @abstractmethod
     def current_size(self):
         pass
@@ -38,6 +102,14 @@ class AbstractCacheQueue(ABC):
     def add(self):
         pass
 
+    @abstractmethod
+    def add_many(self):
+        pass
+
+    @abstractmethod
+    def add_missing(self):
+        pass
+
     @abstractmethod
     def get(self):
         pass
@@ -47,20 +119,65 @@ class ShortUrlQueue(AbstractUrlQueue):
 
     def __init__(
         self,
-        redis_client: Redis = r,
+        redis_client: Redis = None,
         queue_name: str = "available_urls",
         logger: Logger = logger,
+        low_watermark: int = 0,
+        signal_client: Redis = None,
     ):
-        self.redis_client = redis_client
+        """
+        :param low_watermark: if set, the key generator is signaled whenever a dequeue
+            leaves less short urls than this on the queue.
+        :param signal_client: the client of the node the key generator waits for signals
+            on, defaults to redis_client (e.g.: the primary node, for a shard of the queue).
+        """
+        self.redis_client = redis_client or get_redis_client()
         self.queue_name = queue_name
         self.logger = logger
+        self.low_watermark = low_watermark
+        self.signal_name = f"{queue_name}:low_stock"
+        self.signal_client = signal_client or self.redis_client
+
+    def _rpop(self, count: int | None = None):
+        """Pops from the queue, checking its size within the same round-trip if needed."""
+        if not self.low_watermark:
+            return self.redis_client.rpop(self.queue_name, count)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpop(self.queue_name, count)
+        pipe.llen(self.queue_name)
+        popped, queue_size = pipe.execute()
+        if queue_size < self.low_watermark:
+            self.signal_low_stock()
+        return popped
+
+    def signal_low_stock(self) -> None:
+        """Wakes the key generator up, at most one signal is kept pending."""
+        pipe = self.signal_client.pipeline(transaction=False)
+        pipe.lpush(self.signal_name, 1)
+        pipe.ltrim(self.signal_name, 0, 0)
+        pipe.execute()
+
+    def wait_for_low_stock(self, timeout: float) -> bool:
+        """
+        Blocks until the queue is signaled as low on stock.
+
+        :param timeout: how many seconds to wait at most, e.g.: 5
+        :return signaled: False if the timeout was reached
+        """
+        return self.signal_client.blpop([self.signal_name], timeout=timeout) is not None
+
+    def publish_stats(self, stats: Dict[str, float]) -> None:
+        """Publishes the stats of whoever fills the queue, e.g.: the key generator."""
+        self.redis_client.hset(f"{self.queue_name}:stats", mapping=stats)
+
+    def read_stats(self) -> Dict[str, float]:
+        stats = self.redis_client.hgetall(f"{self.queue_name}:stats")
+        return {key.decode("utf-8"): float(value) for key, value in stats.items()}
 
     def deque_short_url_key(self) -> str:
         try:
-            self.logger.info(
-                f"Dequeing an available short url from queue {self.queue_name}"
-            )
-            key = self.redis_client.rpop(self.queue_name)
+            self.logger.debug("Dequeing an available short url from queue {}", self.queue_name)
+            key = self._rpop()
         except Exception as e:
             self.logger.error(
                 f"Error while dequeing short url from queue {self.queue_name}"
@@ -73,9 +190,33 @@ class ShortUrlQueue(AbstractUrlQueue):
                 )
             return key.decode("utf-8")
 
+    def deque_short_url_keys(self, count: int) -> List[str]:
+        """
+        Dequeues several short urls with a single RPOP, it's all or nothing.
+
+        :param count: how many short urls to dequeue, e.g.: 100
+        :return short_urls: the dequeued short urls
+        """
+        try:
+            self.logger.debug("Dequeing {} available short urls from queue {}", count, self.queue_name)
+            keys = self._rpop(count) or []
+            if len(keys) < count and keys:
+                self.redis_client.rpush(self.queue_name, *reversed(keys))
+        except Exception as e:
+            self.logger.error(
+                f"Error while dequeing short urls from queue {self.queue_name}"
+            )
+            raise e
+        else:
+            if len(keys) < count:
+                raise EmptyQueueException(
+                    f"There are less than {count} keys left on queue {self.queue_name}"
+                )
+            return [key.decode("utf-8") for key in keys]
+
     def enqueue_short_url_key(self, short_url: str) -> int:
         try:
-            self.logger.info(f"Enqueing short url on queue {self.queue_name}")
+            self.logger.debug("Enqueing short url on queue {}", self.queue_name)
             queue_size = self.redis_client.lpush(self.queue_name, short_url)
         except Exception as e:
             self.logger.error(
@@ -85,9 +226,24 @@ class ShortUrlQueue(AbstractUrlQueue):
         else:
             return queue_size
 
+    def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        """Enqueues several short urls with a single multi-value LPUSH."""
+        if not short_urls:
+            return self.current_size()
+        try:
+            self.logger.debug("Enqueing {} short urls on queue {}", len(short_urls), self.queue_name)
+            queue_size = self.redis_client.lpush(self.queue_name, *short_urls)
+        except Exception as e:
+            self.logger.error(
+                f"Error while enqueing short urls on queue {self.queue_name}"
+            )
+            raise e
+        else:
+            return queue_size
+
     def current_size(self) -> int:
         try:
-            self.logger.info(f"Fetching the current size of queue {self.queue_name}")
+            self.logger.debug("Fetching the current size of queue {}", self.queue_name)
             queue_size = self.redis_client.llen(self.queue_name)
         except Exception as e:
             self.logger.error(
@@ -97,25 +253,96 @@ class ShortUrlQueue(AbstractUrlQueue):
         else:
             return queue_size
 
+    def peek_short_url_keys(self) -> List[str]:
+        """Returns every short url on the queue without dequeuing them, the queue is kept small."""
+        return [key.decode("utf-8") for key in self.redis_client.lrange(self.queue_name, 0, -1)]
+
+    def remove_short_url_keys(self, short_urls: List[str]) -> int:
+        """
+        Removes short urls from the queue (e.g.: imported on the table) with a pipelined LREM each.
+
+        :return removed: how many short urls were on the queue
+        """
+        if not short_urls:
+            return 0
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for short_url in short_urls:
+                pipe.lrem(self.queue_name, 0, short_url)
+            removed = sum(pipe.execute())
+        except Exception as e:
+            self.logger.error(
+                f"Error while removing short urls from queue {self.queue_name}"
+            )
+            raise e
+        else:
+            return removed
+
 
 class CacheQueue(AbstractCacheQueue):
-    def __init__(self, redis_client: Redis = r, logger: Logger = logger):
-        self.redis_client = redis_client
+    def __init__(
+        self, redis_client: Redis = None, logger: Logger = logger, negative_ttl: int = 60
+    ):
+        self.redis_client = redis_client or get_redis_client()
         self.logger = logger
         self.ttl = 30 * 24 * 60 * 60
+        self.negative_ttl = negative_ttl
 
     def add(self, url: Url) -> bool:
         try:
-            self.logger.info(f"Adding url '{url}' to the cache")
+            self.logger.debug("Adding url '{}' to the cache", url)
             added = self.redis_client.set(url.short_url, url.long_url, ex=self.ttl)
         except Exception as e:
             self.logger.error(f"Error while adding {url} to the cache")
             raise e
         return added
 
+    def add_many(self, urls: List[Url]) -> bool:
+        """Adds several urls to the cache with a single pipeline."""
+        try:
+            self.logger.debug("Adding {} urls to the cache", len(urls))
+            pipe = self.redis_client.pipeline(transaction=False)
+            for url in urls:
+                pipe.set(url.short_url, url.long_url, ex=self.ttl)
+            added = pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding {len(urls)} urls to the cache")
+            raise e
+        return all(added)
+
+    def add_missing(self, short_url: str) -> bool:
+        """Remembers for negative_ttl seconds that a short url does not exist."""
+        try:
+            self.logger.debug("Marking short url '{}' as missing on the cache", short_url)
+            added = self.redis_client.set(
+                short_url, MISSING_URL_MARKER, ex=self.negative_ttl, nx=True
+            )
+        except Exception as e:
+            self.logger.error(f"Error while marking '{short_url}' as missing on the cache")
+            raise e
+        return bool(added)
+
+    def acquire_refill_lock(self, short_url: str, ttl: float) -> bool:
+        """
+        Takes a short-lived lock, so a single process refills a short url from the table.
+
+        The lock is never released, it expires after ttl seconds.
+
+        :param ttl: how many seconds the lock is held, e.g.: 0.5
+        :return acquired: True if the lock was free
+        """
+        try:
+            acquired = self.redis_client.set(
+                f"refill_lock:{short_url}", 1, px=int(ttl * 1000), nx=True
+            )
+        except Exception as e:
+            self.logger.error(f"Error while locking '{short_url}' for refill")
+            raise e
+        return bool(acquired)
+
     def get(self, short_url: str) -> str:
         try:
-            self.logger.info(f"Retrieving short url '{short_url}' from cache")
+            self.logger.debug("Retrieving short url '{}' from cache", short_url)
             long_url = self.redis_client.get(short_url)
         except Exception as e:
             self.logger.error(f"Error while getting '{short_url}' from cache")
@@ -125,7 +352,935 @@ class CacheQueue(AbstractCacheQueue):
                 raise ShortUrlNotFoundOnCache(
                     f"Short url '{short_url}' not found on cache"
                 )
-            self.logger.info(
-                f"Long url for the given key is '{long_url.decode('utf-8')[:30]}...'"
+            if long_url == MISSING_URL_MARKER.encode("utf-8"):
+                raise ShortUrlMarkedAsMissing(
+                    f"Short url '{short_url}' is marked as missing on cache"
+                )
+            long_url = long_url.decode("utf-8")
+            self.logger.debug("Long url for the given key is '{}...'", long_url[:30])
+            return long_url
+
+
+class AsyncShortUrlQueue(AbstractUrlQueue):
+    """Non-blocking version of ShortUrlQueue, backed by redis.asyncio"""
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis = None,
+        queue_name: str = "available_urls",
+        logger: Logger = logger,
+        low_watermark: int = 0,
+        signal_client: AsyncRedis = None,
+    ):
+        """
+        :param low_watermark: if set, the key generator is signaled whenever a dequeue
+            leaves less short urls than this on the queue.
+        :param signal_client: the client of the node the key generator waits for signals
+            on, defaults to redis_client (e.g.: the primary node, for a shard of the queue).
+        """
+        self.redis_client = redis_client or get_async_redis_client()
+        self.queue_name = queue_name
+        self.logger = logger
+        self.low_watermark = low_watermark
+        self.signal_name = f"{queue_name}:low_stock"
+        self.signal_client = signal_client or self.redis_client
+
+    async def _rpop(self, count: int | None = None):
+        """Pops from the queue, checking its size within the same round-trip if needed."""
+        if not self.low_watermark:
+            return await self.redis_client.rpop(self.queue_name, count)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.rpop(self.queue_name, count)
+        pipe.llen(self.queue_name)
+        popped, queue_size = await pipe.execute()
+        if queue_size < self.low_watermark:
+            await self.signal_low_stock()
+        return popped
+
+    async def signal_low_stock(self) -> None:
+        """Wakes the key generator up, at most one signal is kept pending."""
+        pipe = self.signal_client.pipeline(transaction=False)
+        pipe.lpush(self.signal_name, 1)
+        pipe.ltrim(self.signal_name, 0, 0)
+        await pipe.execute()
+
+    async def wait_for_low_stock(self, timeout: float) -> bool:
+        """
+        Blocks until the queue is signaled as low on stock.
+
+        :param timeout: how many seconds to wait at most, e.g.: 5
+        :return signaled: False if the timeout was reached
+        """
+        return await self.signal_client.blpop([self.signal_name], timeout=timeout) is not None
+
+    async def deque_short_url_key(self) -> str:
+        try:
+            self.logger.debug("Dequeing an available short url from queue {}", self.queue_name)
+            key = await self._rpop()
+        except Exception as e:
+            self.logger.error(
+                f"Error while dequeing short url from queue {self.queue_name}"
+            )
+            raise e
+        else:
+            if not key:
+                raise EmptyQueueException(
+                    f"There are no keys left on queue {self.queue_name}"
+                )
+            return key.decode("utf-8")
+
+    async def deque_short_url_keys(self, count: int) -> List[str]:
+        """
+        Dequeues several short urls with a single RPOP, it's all or nothing.
+
+        :param count: how many short urls to dequeue, e.g.: 100
+        :return short_urls: the dequeued short urls
+        """
+        try:
+            self.logger.debug("Dequeing {} available short urls from queue {}", count, self.queue_name)
+            keys = await self._rpop(count) or []
+            if len(keys) < count and keys:
+                await self.redis_client.rpush(self.queue_name, *reversed(keys))
+        except Exception as e:
+            self.logger.error(
+                f"Error while dequeing short urls from queue {self.queue_name}"
+            )
+            raise e
+        else:
+            if len(keys) < count:
+                raise EmptyQueueException(
+                    f"There are less than {count} keys left on queue {self.queue_name}"
+                )
+            return [key.decode("utf-8") for key in keys]
+
+    async def enqueue_short_url_key(self, short_url: str) -> int:
+        try:
+            self.logger.debug("Enqueing short url on queue {}", self.queue_name)
+            queue_size = await self.redis_client.lpush(self.queue_name, short_url)
+        except Exception as e:
+            self.logger.error(
+                f"Error while enqueing short url on queue {self.queue_name}"
+            )
+            raise e
+        else:
+            return queue_size
+
+    async def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        """Enqueues several short urls with a single multi-value LPUSH."""
+        if not short_urls:
+            return await self.current_size()
+        try:
+            self.logger.debug("Enqueing {} short urls on queue {}", len(short_urls), self.queue_name)
+            queue_size = await self.redis_client.lpush(self.queue_name, *short_urls)
+        except Exception as e:
+            self.logger.error(
+                f"Error while enqueing short urls on queue {self.queue_name}"
+            )
+            raise e
+        else:
+            return queue_size
+
+    async def current_size(self) -> int:
+        try:
+            self.logger.debug("Fetching the current size of queue {}", self.queue_name)
+            queue_size = await self.redis_client.llen(self.queue_name)
+        except Exception as e:
+            self.logger.error(
+                f"Error while fetching the current size of queue {self.queue_name}"
+            )
+            raise e
+        else:
+            return queue_size
+
+
+class AsyncCacheQueue(AbstractCacheQueue):
+    """Non-blocking version of CacheQueue, backed by redis.asyncio"""
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis = None,
+        logger: Logger = logger,
+        negative_ttl: int = 60,
+    ):
+        self.redis_client = redis_client or get_async_redis_client()
+        self.logger = logger
+        self.ttl = 30 * 24 * 60 * 60
+        self.negative_ttl = negative_ttl
+
+    async def add(self, url: Url) -> bool:
+        try:
+            self.logger.debug("Adding url '{}' to the cache", url)
+            added = await self.redis_client.set(
+                url.short_url, url.long_url, ex=self.ttl
+            )
+        except Exception as e:
+            self.logger.error(f"Error while adding {url} to the cache")
+            raise e
+        return added
+
+    async def add_many(self, urls: List[Url]) -> bool:
+        """Adds several urls to the cache with a single pipeline."""
+        try:
+            self.logger.debug("Adding {} urls to the cache", len(urls))
+            pipe = self.redis_client.pipeline(transaction=False)
+            for url in urls:
+                pipe.set(url.short_url, url.long_url, ex=self.ttl)
+            added = await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding {len(urls)} urls to the cache")
+            raise e
+        return all(added)
+
+    async def add_missing(self, short_url: str) -> bool:
+        """Remembers for negative_ttl seconds that a short url does not exist."""
+        try:
+            self.logger.debug("Marking short url '{}' as missing on the cache", short_url)
+            added = await self.redis_client.set(
+                short_url, MISSING_URL_MARKER, ex=self.negative_ttl, nx=True
+            )
+        except Exception as e:
+            self.logger.error(f"Error while marking '{short_url}' as missing on the cache")
+            raise e
+        return bool(added)
+
+    async def acquire_refill_lock(self, short_url: str, ttl: float) -> bool:
+        """
+        Takes a short-lived lock, so a single process refills a short url from the table.
+
+        The lock is never released, it expires after ttl seconds.
+
+        :param ttl: how many seconds the lock is held, e.g.: 0.5
+        :return acquired: True if the lock was free
+        """
+        try:
+            acquired = await self.redis_client.set(
+                f"refill_lock:{short_url}", 1, px=int(ttl * 1000), nx=True
             )
-            return long_url.decode("utf-8")
+        except Exception as e:
+            self.logger.error(f"Error while locking '{short_url}' for refill")
+            raise e
+        return bool(acquired)
+
+    async def get(self, short_url: str) -> str:
+        try:
+            self.logger.debug("Retrieving short url '{}' from cache", short_url)
+            long_url = await self.redis_client.get(short_url)
+        except Exception as e:
+            self.logger.error(f"Error while getting '{short_url}' from cache")
+            raise e
+        else:
+            if not long_url:
+                raise ShortUrlNotFoundOnCache(
+                    f"Short url '{short_url}' not found on cache"
+                )
+            if long_url == MISSING_URL_MARKER.encode("utf-8"):
+                raise ShortUrlMarkedAsMissing(
+                    f"Short url '{short_url}' is marked as missing on cache"
+                )
+            long_url = long_url.decode("utf-8")
+            self.logger.debug("Long url for the given key is '{}...'", long_url[:30])
+            return long_url
+
+
+# common url prefixes and fragments, the most frequent last (closest to the data)
+URL_DICTIONARY = (
+    b".html.php?id=&page=&ref=&utm_content=&utm_term=&utm_campaign=&utm_medium=?utm_source="
+    b"https://medium.com/https://www.reddit.com/r/https://www.linkedin.com/in/https://www.instagram.com/"
+    b"https://www.facebook.com/https://twitter.com/https://www.amazon.com/https://docs.google.com/"
+    b"https://github.com/https://en.wikipedia.org/wiki/https://www.youtube.com/watch?v="
+    b".net/.org/.com.br/.com/http://www.https://www."
+)
+# compressed values start with a byte no url can start with
+COMPRESSED_VALUE_TAG = b"\x00"
+
+
+class CompactUrlCodec:
+    """
+    Lays short urls out on buckets and optionally compresses long urls, for BucketedCacheQueue.
+
+    A short url is split on a bucket (its first prefix_length chars) and a field (the
+    rest), e.g.: 'abcd123' is field 'd123' of bucket 'urls:abc'. Long urls are
+    compressed with raw deflate and URL_DICTIONARY, only kept compressed when shorter.
+    """
+
+    def __init__(self, prefix_length: int = 3, compress: bool = False, bucket_prefix: str = "urls:"):
+        """
+        :param prefix_length: how many chars of the short url name its bucket, 3 makes
+            62**3 (~238k) buckets for base62 keys, ~42 entries each at 10M urls.
+        :param compress: whether long urls are compressed.
+        """
+        self.prefix_length = prefix_length
+        self.compress = compress
+        self.bucket_prefix = bucket_prefix
+
+    def locate(self, short_url: str) -> Tuple[str, str]:
+        """Returns the bucket and field of a short url."""
+        return f"{self.bucket_prefix}{short_url[:self.prefix_length]}", short_url[self.prefix_length:]
+
+    def encode(self, long_url: str) -> bytes:
+        value = long_url.encode("utf-8")
+        if not self.compress:
+            return value
+        compressor = zlib.compressobj(level=9, wbits=-15, zdict=URL_DICTIONARY)
+        compressed = COMPRESSED_VALUE_TAG + compressor.compress(value) + compressor.flush()
+        return compressed if len(compressed) < len(value) else value
+
+    def decode(self, value: bytes) -> str:
+        if value[:1] == COMPRESSED_VALUE_TAG:
+            decompressor = zlib.decompressobj(wbits=-15, zdict=URL_DICTIONARY)
+            value = decompressor.decompress(value[1:]) + decompressor.flush()
+        return value.decode("utf-8")
+
+
+class BucketedCacheQueue(CacheQueue):
+    """
+    Drop-in CacheQueue keeping urls on small Redis hashes instead of one key per url.
+
+    Small hashes are stored as listpacks, a single allocation with no per-entry
+    key, expiry or dict overhead, which takes a fraction of the memory of a string key
+    per url. Redis only keeps them as listpacks up to hash-max-listpack-entries
+    fields of up to hash-max-listpack-value bytes (128 and 64 by default), so raise
+    the latter to fit most (compressed) long urls, e.g.: 256.
+
+    Expiry is per bucket: a bucket expires ttl seconds after its last write. Run
+    Redis with maxmemory-policy allkeys-lfu, so the coldest buckets are evicted first
+    under memory pressure. Missing short urls are still marked with a string key of
+    their own, since they only live for negative_ttl seconds.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis = None,
+        logger: Logger = logger,
+        negative_ttl: int = 60,
+        codec: CompactUrlCodec | None = None,
+    ):
+        """
+        :param codec: how urls are laid out and encoded, defaults to a CompactUrlCodec
+            with 3 char prefixes and no compression.
+        """
+        super().__init__(redis_client=redis_client, logger=logger, negative_ttl=negative_ttl)
+        self.codec = codec or CompactUrlCodec()
+
+    def _pipeline_add(self, urls: List[Url]):
+        buckets = defaultdict(dict)
+        for url in urls:
+            bucket, field = self.codec.locate(url.short_url)
+            buckets[bucket][field] = self.codec.encode(url.long_url)
+        pipe = self.redis_client.pipeline(transaction=False)
+        for bucket, fields in buckets.items():
+            pipe.hset(bucket, mapping=fields)
+            pipe.expire(bucket, self.ttl)
+        return pipe
+
+    def _pipeline_get(self, short_url: str):
+        bucket, field = self.codec.locate(short_url)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hget(bucket, field)
+        pipe.get(short_url)
+        return pipe
+
+    def _to_long_url(self, short_url: str, value: bytes | None, marker: bytes | None) -> str:
+        if value is not None:
+            long_url = self.codec.decode(value)
+            self.logger.debug("Long url for the given key is '{}...'", long_url[:30])
+            return long_url
+        if marker == MISSING_URL_MARKER.encode("utf-8"):
+            raise ShortUrlMarkedAsMissing(f"Short url '{short_url}' is marked as missing on cache")
+        raise ShortUrlNotFoundOnCache(f"Short url '{short_url}' not found on cache")
+
+    def add(self, url: Url) -> bool:
+        return self.add_many([url])
+
+    def add_many(self, urls: List[Url]) -> bool:
+        """Adds several urls to their buckets with a single pipeline."""
+        try:
+            self.logger.debug("Adding {} urls to the cache", len(urls))
+            self._pipeline_add(urls).execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding {len(urls)} urls to the cache")
+            raise e
+        return True
+
+    def get(self, short_url: str) -> str:
+        """Reads the bucket of a short url and its missing marker, in a single round-trip."""
+        try:
+            self.logger.debug("Retrieving short url '{}' from cache", short_url)
+            value, marker = self._pipeline_get(short_url).execute()
+        except Exception as e:
+            self.logger.error(f"Error while getting '{short_url}' from cache")
+            raise e
+        return self._to_long_url(short_url, value, marker)
+
+
+class AsyncBucketedCacheQueue(AsyncCacheQueue, BucketedCacheQueue):
+    """
+    Non-blocking version of BucketedCacheQueue, backed by redis.asyncio
+
+    Redis calls come from AsyncCacheQueue, the bucket layout from BucketedCacheQueue.
+    """
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis = None,
+        logger: Logger = logger,
+        negative_ttl: int = 60,
+        codec: CompactUrlCodec | None = None,
+    ):
+        super().__init__(redis_client=redis_client, logger=logger, negative_ttl=negative_ttl)
+        self.codec = codec or CompactUrlCodec()
+
+    async def add(self, url: Url) -> bool:
+        return await self.add_many([url])
+
+    async def add_many(self, urls: List[Url]) -> bool:
+        try:
+            self.logger.debug("Adding {} urls to the cache", len(urls))
+            await self._pipeline_add(urls).execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding {len(urls)} urls to the cache")
+            raise e
+        return True
+
+    async def get(self, short_url: str) -> str:
+        try:
+            self.logger.debug("Retrieving short url '{}' from cache", short_url)
+            value, marker = await self._pipeline_get(short_url).execute()
+        except Exception as e:
+            self.logger.error(f"Error while getting '{short_url}' from cache")
+            raise e
+        return self._to_long_url(short_url, value, marker)
+
+
+class IdRangeCounter:
+    """Hands out disjoint ranges of numeric ids from a Redis counter"""
+
+    def __init__(
+        self,
+        redis_client: Redis = None,
+        counter_name: str = "short_url_id",
+        logger: Logger = logger,
+    ):
+        self.redis_client = redis_client or get_redis_client()
+        self.counter_name = counter_name
+        self.logger = logger
+
+    def lease(self, size: int) -> Tuple[int, int]:
+        """
+        Leases the next size ids with a single INCRBY.
+
+        :param size: how many ids to lease, e.g.: 1000
+        :return range: the leased ids, as a (start, end) half-open range
+        """
+        try:
+            self.logger.info("Leasing {} ids from counter {}", size, self.counter_name)
+            end = self.redis_client.incrby(self.counter_name, size)
+        except Exception as e:
+            self.logger.error(f"Error while leasing ids from counter {self.counter_name}")
+            raise e
+        return end - size, end
+
+
+class AsyncIdRangeCounter(IdRangeCounter):
+    """Non-blocking version of IdRangeCounter, backed by redis.asyncio"""
+
+    def __init__(
+        self,
+        redis_client: AsyncRedis = None,
+        counter_name: str = "short_url_id",
+        logger: Logger = logger,
+    ):
+        super().__init__(
+            redis_client=redis_client or get_async_redis_client(), counter_name=counter_name, logger=logger
+        )
+
+    async def lease(self, size: int) -> Tuple[int, int]:
+        try:
+            self.logger.info("Leasing {} ids from counter {}", size, self.counter_name)
+            end = await self.redis_client.incrby(self.counter_name, size)
+        except Exception as e:
+            self.logger.error(f"Error while leasing ids from counter {self.counter_name}")
+            raise e
+        return end - size, end
+
+
+class LongUrlIndexCache:
+    """Caches the short url issued for each long url, in front of a LongUrlIndexTable"""
+
+    def __init__(self, redis_client: Redis = None, logger: Logger = logger):
+        self.redis_client = redis_client or get_redis_client()
+        self.logger = logger
+        self.ttl = 30 * 24 * 60 * 60
+
+    def add(self, url: Url) -> bool:
+        try:
+            added = self.redis_client.set(
+                f"dedup:{hash_long_url(url.long_url)}", url.short_url, ex=self.ttl
+            )
+        except Exception as e:
+            self.logger.error(f"Error while indexing {url} on the cache")
+            raise e
+        return added
+
+    def get_short_url(self, long_url: str) -> str | None:
+        """Returns the short url issued for a long url, None if it's not cached."""
+        try:
+            short_url = self.redis_client.get(f"dedup:{hash_long_url(long_url)}")
+        except Exception as e:
+            self.logger.error("Error while looking up a long url on the cache")
+            raise e
+        return short_url.decode("utf-8") if short_url else None
+
+
+class AsyncLongUrlIndexCache(LongUrlIndexCache):
+    """Non-blocking version of LongUrlIndexCache, backed by redis.asyncio"""
+
+    def __init__(self, redis_client: AsyncRedis = None, logger: Logger = logger):
+        super().__init__(redis_client=redis_client or get_async_redis_client(), logger=logger)
+
+    async def add(self, url: Url) -> bool:
+        try:
+            added = await self.redis_client.set(
+                f"dedup:{hash_long_url(url.long_url)}", url.short_url, ex=self.ttl
+            )
+        except Exception as e:
+            self.logger.error(f"Error while indexing {url} on the cache")
+            raise e
+        return added
+
+    async def get_short_url(self, long_url: str) -> str | None:
+        try:
+            short_url = await self.redis_client.get(f"dedup:{hash_long_url(long_url)}")
+        except Exception as e:
+            self.logger.error("Error while looking up a long url on the cache")
+            raise e
+        return short_url.decode("utf-8") if short_url else None
+
+
+class GeneratorLease:
+    """
+    Redis lease electing which key generator replica refills the queue.
+
+    The owner renews it while running, the other replicas stand by and take over
+    once it expires.
+    """
+
+    def __init__(
+        self,
+        owner: str,
+        redis_client: Redis = None,
+        lease_name: str = "key_generator:lease",
+        ttl: float = 15,
+        logger: Logger = logger,
+    ):
+        """
+        :param owner: unique name of the replica, e.g.: hostname and pid
+        :param ttl: how many seconds the lease lasts without renewal, e.g.: 15
+        """
+        self.owner = owner
+        self.redis_client = redis_client or get_redis_client()
+        self.lease_name = lease_name
+        self.ttl = ttl
+        self.logger = logger
+
+    def acquire(self) -> bool:
+        """Takes the lease if it's free, or renews it if already owned."""
+        ttl = int(self.ttl * 1000)
+        if self.redis_client.set(self.lease_name, self.owner, px=ttl, nx=True):
+            self.logger.info("Lease {} acquired by {}", self.lease_name, self.owner)
+            return True
+        with self.redis_client.pipeline() as pipe:
+            try:
+                pipe.watch(self.lease_name)
+                holder = pipe.get(self.lease_name)
+                if holder is None or holder.decode("utf-8") != self.owner:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.pexpire(self.lease_name, ttl)
+                pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    def release(self) -> None:
+        holder = self.redis_client.get(self.lease_name)
+        if holder is not None and holder.decode("utf-8") == self.owner:
+            self.redis_client.delete(self.lease_name)
+
+
+class HotKeyTracker:
+    """
+    Decaying top-K of the most requested short urls, kept in a Redis sorted set.
+
+    A sample of the redirects increments the score of their short url. At most once
+    per decay_interval, across every worker, scores are multiplied by decay and only
+    the max_size highest are kept, so the set follows what is hot now and stays bounded.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis = None,
+        key: str = "hot_urls",
+        sample_rate: float = 0.01,
+        max_size: int = 10_000,
+        decay: float = 0.5,
+        decay_interval: int = 3600,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a HotKeyTracker object.
+
+        :param sample_rate: the fraction of the redirects that is recorded, e.g.: 0.01
+        :param max_size: how many short urls are tracked, e.g.: 10_000
+        :param decay: what the scores are multiplied by on every decay, e.g.: 0.5
+        :param decay_interval: how many seconds between decays, e.g.: 3600
+        """
+        self.redis_client = redis_client or get_redis_client()
+        self.key = key
+        self.sample_rate = sample_rate
+        self.max_size = max_size
+        self.decay = decay
+        self.decay_interval = decay_interval
+        self.logger = logger
+
+    def record(self, short_url: str) -> None:
+        """Records a request of the short url, if sampled. Errors are logged, never raised."""
+        if random() >= self.sample_rate:
+            return
+        try:
+            self._increment(short_url)
+        except Exception:
+            self.logger.warning("Couldn't record a request of short url '{}'", short_url)
+
+    def _increment(self, short_url: str) -> None:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zincrby(self.key, 1, short_url)
+        pipe.set(f"{self.key}:decayed", 1, nx=True, ex=self.decay_interval)
+        _, should_decay = pipe.execute()
+        if should_decay:
+            self.decay_scores()
+
+    def decay_scores(self) -> None:
+        try:
+            self.logger.info("Decaying the scores of {}", self.key)
+            pipe = self.redis_client.pipeline()
+            pipe.zunionstore(self.key, {self.key: self.decay})
+            pipe.zremrangebyrank(self.key, 0, -(self.max_size + 1))
+            pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while decaying the scores of {self.key}")
+            raise e
+
+    def top(self, count: int) -> List[str]:
+        """Returns up to count short urls, the most requested first."""
+        try:
+            short_urls = self.redis_client.zrevrange(self.key, 0, count - 1)
+        except Exception as e:
+            self.logger.error(f"Error while fetching the top {count} short urls of {self.key}")
+            raise e
+        return [short_url.decode("utf-8") for short_url in short_urls]
+
+    def acquire_warm_up_lock(self, ttl: float) -> bool:
+        """Lets a single worker warm the cache up within ttl seconds."""
+        return bool(self.redis_client.set(f"{self.key}:warm_up_lock", 1, nx=True, px=int(ttl * 1000)))
+
+
+class AsyncHotKeyTracker(HotKeyTracker):
+    """
+    Non-blocking version of HotKeyTracker, backed by redis.asyncio.
+
+    Sampled requests are recorded on a background task, so redirects never wait for it.
+    """
+
+    def __init__(self, redis_client: AsyncRedis = None, **kwargs):
+        super().__init__(redis_client=redis_client or get_async_redis_client(), **kwargs)
+        self._pending: Set[asyncio.Task] = set()
+
+    def record(self, short_url: str) -> None:
+        if random() >= self.sample_rate:
+            return
+        task = asyncio.ensure_future(self._record_quietly(short_url))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _record_quietly(self, short_url: str) -> None:
+        try:
+            await self._increment(short_url)
+        except Exception:
+            self.logger.warning("Couldn't record a request of short url '{}'", short_url)
+
+    async def _increment(self, short_url: str) -> None:
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.zincrby(self.key, 1, short_url)
+        pipe.set(f"{self.key}:decayed", 1, nx=True, ex=self.decay_interval)
+        _, should_decay = await pipe.execute()
+        if should_decay:
+            await self.decay_scores()
+
+    async def decay_scores(self) -> None:
+        try:
+            self.logger.info("Decaying the scores of {}", self.key)
+            pipe = self.redis_client.pipeline()
+            pipe.zunionstore(self.key, {self.key: self.decay})
+            pipe.zremrangebyrank(self.key, 0, -(self.max_size + 1))
+            await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while decaying the scores of {self.key}")
+            raise e
+
+    async def top(self, count: int) -> List[str]:
+        try:
+            short_urls = await self.redis_client.zrevrange(self.key, 0, count - 1)
+        except Exception as e:
+            self.logger.error(f"Error while fetching the top {count} short urls of {self.key}")
+            raise e
+        return [short_url.decode("utf-8") for short_url in short_urls]
+
+    async def acquire_warm_up_lock(self, ttl: float) -> bool:
+        return bool(
+            await self.redis_client.set(f"{self.key}:warm_up_lock", 1, nx=True, px=int(ttl * 1000))
+        )
+
+
+class ClickStatsCache:
+    """
+    Click counts and unique visitor estimates per short url, kept on Redis.
+
+    Clicks are plain counters (clicks:<short url>) and unique visitors a HyperLogLog
+    (visitors:<short url>), which estimates any number of visitors within 12KB.
+    """
+
+    def __init__(self, redis_client: Redis = None, logger: Logger = logger):
+        self.redis_client = redis_client or get_redis_client()
+        self.logger = logger
+
+    def _pipeline_clicks(self, clicks: Dict[str, int], visitors: Dict[str, Set[str]]):
+        pipe = self.redis_client.pipeline(transaction=False)
+        for short_url, count in clicks.items():
+            pipe.incrby(f"clicks:{short_url}", count)
+        for short_url, visitor_ids in visitors.items():
+            if visitor_ids:
+                pipe.pfadd(f"visitors:{short_url}", *visitor_ids)
+        return pipe
+
+    def add_clicks(self, clicks: Dict[str, int], visitors: Dict[str, Set[str]]) -> None:
+        """
+        Adds to the click counts and visitors of several short urls, in a single pipeline.
+
+        :param clicks: how many new clicks each short url got, e.g.: {"xyz1234": 3}
+        :param visitors: who clicked on each short url, e.g.: {"xyz1234": {"203.0.113.7|curl/8.0"}}
+        """
+        try:
+            self.logger.debug("Adding clicks of {} short urls to the cache", len(clicks))
+            self._pipeline_clicks(clicks, visitors).execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding clicks of {len(clicks)} short urls to the cache")
+            raise e
+
+    def get_stats(self, short_url: str) -> Tuple[int | None, int]:
+        """Returns the click count (None if unknown to the cache) and unique visitors of a short url."""
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(f"clicks:{short_url}")
+            pipe.pfcount(f"visitors:{short_url}")
+            clicks, unique_visitors = pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while retrieving the stats of '{short_url}' from cache")
+            raise e
+        return (int(clicks) if clicks is not None else None), unique_visitors
+
+
+class AsyncClickStatsCache(ClickStatsCache):
+    """Non-blocking version of ClickStatsCache, backed by redis.asyncio"""
+
+    def __init__(self, redis_client: AsyncRedis = None, logger: Logger = logger):
+        super().__init__(redis_client=redis_client or get_async_redis_client(), logger=logger)
+
+    async def add_clicks(self, clicks: Dict[str, int], visitors: Dict[str, Set[str]]) -> None:
+        try:
+            self.logger.debug("Adding clicks of {} short urls to the cache", len(clicks))
+            await self._pipeline_clicks(clicks, visitors).execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding clicks of {len(clicks)} short urls to the cache")
+            raise e
+
+    async def get_stats(self, short_url: str) -> Tuple[int | None, int]:
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.get(f"clicks:{short_url}")
+            pipe.pfcount(f"visitors:{short_url}")
+            clicks, unique_visitors = await pipe.execute()
+        except Exception as e:
+            self.logger.error(f"Error while retrieving the stats of '{short_url}' from cache")
+            raise e
+        return (int(clicks) if clicks is not None else None), unique_visitors
+
+
+class PendingUrlStream:
+    """
+    Urls shortened but not yet written on the table, kept on Redis until flushed.
+
+    Each url is appended to a stream (pending_urls), read by the flushers through a
+    consumer group, and indexed by short url on a hash (pending_urls:index) so it
+    can be resolved before reaching the table. Both are written in a single
+    MULTI/EXEC, and removed once the url is on the table. Urls read by a flusher
+    that died before acknowledging them are claimed by another after min_idle.
+    """
+
+    def __init__(
+        self,
+        redis_client: Redis = None,
+        stream: str = "pending_urls",
+        group: str = "url_flusher",
+        logger: Logger = logger,
+    ):
+        self.redis_client = redis_client or get_redis_client()
+        self.stream = stream
+        self.index = f"{stream}:index"
+        self.group = group
+        self.logger = logger
+
+    def _pipeline_add(self, urls: List[Url]):
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.hset(self.index, mapping={url.short_url: url.long_url for url in urls})
+        for url in urls:
+            pipe.xadd(self.stream, {"short_url": url.short_url, "long_url": url.long_url})
+        return pipe
+
+    def _pipeline_ack(self, entry_ids: List[bytes], urls: List[Url]):
+        pipe = self.redis_client.pipeline(transaction=True)
+        pipe.xack(self.stream, self.group, *entry_ids)
+        pipe.xdel(self.stream, *entry_ids)
+        pipe.hdel(self.index, *(url.short_url for url in urls))
+        return pipe
+
+    def _to_entries(self, entries) -> List[Tuple[bytes, Url]]:
+        return [
+            (entry_id, Url(short_url=fields[b"short_url"].decode(), long_url=fields[b"long_url"].decode()))
+            for entry_id, fields in entries
+            if fields
+        ]
+
+    def ensure_group(self) -> None:
+        """Creates the stream and its consumer group, unless they already exist."""
+        try:
+            self.redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise e
+
+    def add(self, url: Url) -> bool:
+        return self.add_many([url])
+
+    def add_many(self, urls: List[Url]) -> bool:
+        """Adds several urls to the stream and the index, in a single transaction."""
+        try:
+            self.logger.debug("Adding {} urls to the pending stream", len(urls))
+            self._pipeline_add(urls).execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding {len(urls)} urls to the pending stream")
+            raise e
+        return True
+
+    def get(self, short_url: str) -> str | None:
+        """Returns the long url of a short url not yet flushed, None if there's none."""
+        try:
+            long_url = self.redis_client.hget(self.index, short_url)
+        except Exception as e:
+            self.logger.error(f"Error while retrieving '{short_url}' from the pending stream")
+            raise e
+        return long_url.decode() if long_url is not None else None
+
+    def read(self, consumer: str, count: int, min_idle: float = 60) -> List[Tuple[bytes, Url]]:
+        """
+        Reads up to count urls to be flushed by consumer.
+
+        Urls read by any consumer at least min_idle seconds ago and never acknowledged
+        are read again first, then the ones never read.
+
+        :param consumer: the name of the flusher, unique per process
+        :return entries: the stream entry ids and their urls
+        """
+        try:
+            _, claimed, *_ = self.redis_client.xautoclaim(
+                self.stream, self.group, consumer, min_idle_time=int(min_idle * 1000), count=count
+            )
+            if claimed:
+                return self._to_entries(claimed)
+            response = self.redis_client.xreadgroup(self.group, consumer, {self.stream: ">"}, count=count)
+        except Exception as e:
+            self.logger.error(f"Error while reading urls from the pending stream as '{consumer}'")
+            raise e
+        return self._to_entries(response[0][1]) if response else []
+
+    def ack(self, entries: List[Tuple[bytes, Url]]) -> None:
+        """Removes flushed urls from the stream and the index."""
+        entry_ids, urls = zip(*entries)
+        try:
+            self._pipeline_ack(list(entry_ids), list(urls)).execute()
+        except Exception as e:
+            self.logger.error(f"Error while acknowledging {len(entries)} urls on the pending stream")
+            raise e
+
+    def size(self) -> int:
+        """Returns how many urls are waiting to be flushed."""
+        return self.redis_client.hlen(self.index)
+
+
+class AsyncPendingUrlStream(PendingUrlStream):
+    """Non-blocking version of PendingUrlStream, backed by redis.asyncio"""
+
+    def __init__(self, redis_client: AsyncRedis = None, **kwargs):
+        super().__init__(redis_client=redis_client or get_async_redis_client(), **kwargs)
+
+    async def ensure_group(self) -> None:
+        try:
+            await self.redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise e
+
+    async def add(self, url: Url) -> bool:
+        return await self.add_many([url])
+
+    async def add_many(self, urls: List[Url]) -> bool:
+        try:
+            self.logger.debug("Adding {} urls to the pending stream", len(urls))
+            await self._pipeline_add(urls).execute()
+        except Exception as e:
+            self.logger.error(f"Error while adding {len(urls)} urls to the pending stream")
+            raise e
+        return True
+
+    async def get(self, short_url: str) -> str | None:
+        try:
+            long_url = await self.redis_client.hget(self.index, short_url)
+        except Exception as e:
+            self.logger.error(f"Error while retrieving '{short_url}' from the pending stream")
+            raise e
+        return long_url.decode() if long_url is not None else None
+
+    async def read(self, consumer: str, count: int, min_idle: float = 60) -> List[Tuple[bytes, Url]]:
+        try:
+            _, claimed, *_ = await self.redis_client.xautoclaim(
+                self.stream, self.group, consumer, min_idle_time=int(min_idle * 1000), count=count
+            )
+            if claimed:
+                return self._to_entries(claimed)
+            response = await self.redis_client.xreadgroup(self.group, consumer, {self.stream: ">"}, count=count)
+        except Exception as e:
+            self.logger.error(f"Error while reading urls from the pending stream as '{consumer}'")
+            raise e
+        return self._to_entries(response[0][1]) if response else []
+
+    async def ack(self, entries: List[Tuple[bytes, Url]]) -> None:
+        entry_ids, urls = zip(*entries)
+        try:
+            await self._pipeline_ack(list(entry_ids), list(urls)).execute()
+        except Exception as e:
+            self.logger.error(f"Error while acknowledging {len(entries)} urls on the pending stream")
+            raise e
+
+    async def size(self) -> int:
+        return await self.redis_client.hlen(self.index)
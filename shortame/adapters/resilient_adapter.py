@@ -0,0 +1,295 @@
+import asyncio
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from functools import partial
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.dynamodb_adapter import AbstractDynamoDBUrlTable, FastUrlTable, ShortUrlNotFoundOnTable
+from shortame.domain.model import Url
+
+
+class TableUnavailable(Exception):
+    pass
+
+
+class TableDeadlineExceeded(TableUnavailable):
+    pass
+
+
+class TableCircuitOpen(TableUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while the service behind them is degraded.
+
+    Closed, it lets every call through and opens after failure_threshold failures
+    in a row. Open, it rejects every call for reset_timeout seconds, then lets a
+    single probe call through (half-open): the circuit closes if it succeeds and
+    opens again otherwise. A probe never recorded (e.g.: its call was cancelled) is
+    given up on after reset_timeout seconds, and another one let through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10, name: str = "", logger: Logger = logger):
+        """
+        Initializes a CircuitBreaker object.
+
+        :param failure_threshold: how many failures in a row open the circuit, e.g.: 5
+        :param reset_timeout: how many seconds the circuit stays open before a probe call, e.g.: 10
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.logger = logger
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing_since: float | None = None
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        """Returns whether a call may go through, taking the probe call when half-open."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            if self._probing_since is not None and now - self._probing_since < self.reset_timeout:
+                return False
+            self._probing_since = now
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                self.logger.info("Circuit to {} closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._probing_since = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing_since is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.logger.warning("Circuit to {} opened after {} failures", self.name, self.failures)
+                self.opened_at = monotonic()
+            self._probing_since = None
+
+
+class LatencyTracker:
+    """Keeps the latencies of the last window calls, to know how long a slow call takes."""
+
+    def __init__(self, percentile: float = 0.95, window: int = 1000, min_samples: int = 50):
+        """
+        Initializes a LatencyTracker object.
+
+        :param percentile: the share of calls faster than a slow one, e.g.: 0.95
+        :param window: how many of the last latencies are kept, e.g.: 1000
+        :param min_samples: how many latencies are needed before estimating the percentile, e.g.: 50
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._recorded = 0
+        self._value: float | None = None
+        self._lock = Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._latencies.append(latency)
+            self._recorded += 1
+            # sorting the window on every call would cost more than the calls it hedges
+            if self._value is None or self._recorded % 100 == 0:
+                self._value = self._estimate()
+
+    def _estimate(self) -> float | None:
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * self.percentile), len(latencies) - 1)]
+
+    def value(self) -> float | None:
+        """Returns the latency of the percentile, None until min_samples latencies were recorded."""
+        return self._value
+
+
+class ResilientUrlTable(AbstractDynamoDBUrlTable):
+    """
+    Bounds the latency of the url reads on the redirect path (get_url).
+
+    A read gives up once deadline seconds elapsed, whatever botocore's own timeouts
+    and retries, and is sent a second time (hedged) if the first request hasn't
+    answered after the hedge_percentile latency of recent reads, the first answer
+    winning. Reads failing or timing out failure_threshold times in a row open the
+    circuit, every read then fails fast with TableCircuitOpen for reset_timeout
+    seconds (see UrlShortener's serve_stale). Requests given up on still run to
+    completion on the executor, their answer is dropped. Writes, batch and scan
+    reads go straight to the table.
+    """
+
+    def __init__(
+        self,
+        url_table: AbstractDynamoDBUrlTable = None,
+        deadline: float = 0.5,
+        hedging: bool = True,
+        hedge_percentile: float = 0.95,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10,
+        executor: Executor | None = None,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a ResilientUrlTable object.
+
+        :param url_table: the table doing the actual work, read from several threads at once so it
+            must be thread-safe, defaults to FastUrlTable() (see ThreadLocalUrlTable otherwise).
+        :param deadline: how many seconds a read may take, hedge included, e.g.: 0.5
+        :param hedging: if True, slow reads are sent a second time.
+        :param hedge_percentile: the percentile of recent read latencies after which a read is hedged, e.g.: 0.95
+        :param failure_threshold: how many failed reads in a row open the circuit, e.g.: 5
+        :param reset_timeout: how many seconds the circuit stays open, e.g.: 10
+        :param executor: where reads run, defaults to a thread pool of its own.
+        """
+        self.url_table = url_table if url_table is not None else FastUrlTable()
+        self.deadline = deadline
+        self.hedging = hedging
+        self.executor = executor
+        self.logger = logger
+        self.table_name = self.url_table.table_name
+        self.table = self._load_table()
+        self.latencies = LatencyTracker(percentile=hedge_percentile)
+        self.circuit = CircuitBreaker(failure_threshold, reset_timeout, name=f"{self.table_name} table", logger=logger)
+        self.hedged = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    def _load_table(self):
+        return self.url_table.table
+
+    def add_url(self, url: Url) -> bool:
+        return self.url_table.add_url(url)
+
+    def add_urls(self, urls: List[Url], **kwargs) -> bool:
+        return self.url_table.add_urls(urls, **kwargs)
+
+    def batch_get_urls(self, short_urls: Iterable[str], **kwargs) -> List[Dict[str, str]]:
+        return self.url_table.batch_get_urls(short_urls, **kwargs)
+
+    def scan_urls(self, **kwargs):
+        return self.url_table.scan_urls(**kwargs)
+
+    def get_url(self, short_url: str) -> Dict[str, str]:
+        """
+        Gets an url from the table within the deadline.
+
+        :raises TableCircuitOpen: if the circuit is open.
+        :raises TableDeadlineExceeded: if no read answered in time.
+        """
+        self._check_circuit(short_url)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(thread_name_prefix="url-table-read")
+        started = monotonic()
+        attempts = [self._attempt(self.executor.submit(self.url_table.get_url, short_url))]
+        done, _ = wait(attempts, timeout=self._hedge_delay())
+        if not done and self._should_hedge(short_url):
+            attempts.append(self._attempt(self.executor.submit(self.url_table.get_url, short_url)))
+            done, _ = wait(attempts, timeout=self._remaining(started), return_when=FIRST_COMPLETED)
+        return self._settle(short_url, done)
+
+    def _attempt(self, future: Future) -> Future:
+        future.add_done_callback(lambda future, started=monotonic(): self._record(future, monotonic() - started))
+        return future
+
+    def _record(self, future, latency: float) -> None:
+        # also marks the exception of a dropped asyncio future as retrieved
+        error = future.exception()
+        if error is None or isinstance(error, ShortUrlNotFoundOnTable):
+            self.latencies.record(latency)
+
+    def _check_circuit(self, short_url: str) -> None:
+        if not self.circuit.allow():
+            self.rejected += 1
+            raise TableCircuitOpen(
+                f"Circuit to {self.table_name} table is open, short url '{short_url}' was not read"
+            )
+
+    def _hedge_delay(self) -> float:
+        delay = self.latencies.value() if self.hedging else None
+        return self.deadline if delay is None else min(delay, self.deadline)
+
+    def _should_hedge(self, short_url: str) -> bool:
+        if self._hedge_delay() >= self.deadline:
+            return False
+        self.hedged += 1
+        self.logger.debug("Hedging the read of short url '{}' on {} table", short_url, self.table_name)
+        return True
+
+    def _remaining(self, started: float) -> float:
+        return max(0.0, self.deadline - (monotonic() - started))
+
+    def _settle(self, short_url: str, done) -> Dict[str, str]:
+        """Returns the answer of the first attempt done (a successful one if several are), recording it."""
+        if not done:
+            self.timed_out += 1
+            self.circuit.record_failure()
+            raise TableDeadlineExceeded(
+                f"Short url '{short_url}' was not read from {self.table_name} table within {self.deadline}s"
+            )
+        attempt = min(done, key=lambda attempt: attempt.exception() is not None)
+        error = attempt.exception()
+        if error is None or isinstance(error, ShortUrlNotFoundOnTable):
+            self.circuit.record_success()
+        else:
+            self.circuit.record_failure()
+        return attempt.result()
+
+    def stats(self) -> Dict[str, int | str]:
+        """Returns the hedged, timed out and rejected read counters plus the state of the circuit."""
+        return {
+            "hedged": self.hedged,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+            "circuit": self.circuit.state,
+        }
+
+
+class AsyncResilientUrlTable(ResilientUrlTable):
+    """Non-blocking version of ResilientUrlTable, reads run on the executor (the loop's default one if not given)."""
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def add_url(self, url: Url) -> bool:
+        return await self._run(self.url_table.add_url, url)
+
+    async def add_urls(self, urls: List[Url], **kwargs) -> bool:
+        return await self._run(self.url_table.add_urls, urls, **kwargs)
+
+    async def batch_get_urls(self, short_urls: Iterable[str], **kwargs) -> List[Dict[str, str]]:
+        return await self._run(self.url_table.batch_get_urls, list(short_urls), **kwargs)
+
+    async def get_url(self, short_url: str) -> Dict[str, str]:
+        self._check_circuit(short_url)
+        loop = asyncio.get_running_loop()
+        started = monotonic()
+        attempts = [self._attempt(loop.run_in_executor(self.executor, self.url_table.get_url, short_url))]
+        done, _ = await asyncio.wait(attempts, timeout=self._hedge_delay())
+        if not done and self._should_hedge(short_url):
+            attempts.append(self._attempt(loop.run_in_executor(self.executor, self.url_table.get_url, short_url)))
+            done, _ = await asyncio.wait(
+                attempts, timeout=self._remaining(started), return_when=asyncio.FIRST_COMPLETED
+            )
+        return self._settle(short_url, done)
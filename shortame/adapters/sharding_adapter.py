@@ -0,0 +1,231 @@
+# File with adapters spreading the cache and the key queue over several Redis nodes
+import asyncio
+import heapq
+from bisect import bisect
+from collections import defaultdict
+from hashlib import blake2b
+from random import sample
+from typing import Dict, List
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.redis_adapter import (AbstractCacheQueue, AbstractUrlQueue,
+                                             EmptyQueueException)
+from shortame.domain.model import Url
+
+
+class HashRing:
+    """
+    Consistent hashing of keys over nodes, each node placed vnodes times on the ring.
+
+    A key belongs to the first node clockwise from its hash, so adding or removing one
+    of n nodes only moves ~1/n of the keys, and virtual nodes keep the shares even.
+    """
+
+    def __init__(self, nodes: List[str], vnodes: int = 160):
+        """
+        :param nodes: the names of the nodes, e.g.: ["redis-1:6379", "redis-2:6379"]
+        :param vnodes: how many points each node takes on the ring, e.g.: 160
+        """
+        self.nodes = list(nodes)
+        points = sorted((self._hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def node_for(self, key: str) -> str:
+        index = bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ShardedCacheQueue(AbstractCacheQueue):
+    """
+    Spreads the cache over several nodes, each short url living on a single one.
+
+    Short urls are assigned to nodes with a HashRing, so a url, its missing marker
+    and its refill lock are always on the same node.
+    """
+
+    def __init__(self, caches: Dict[str, AbstractCacheQueue], vnodes: int = 160, logger: Logger = logger):
+        """
+        Initializes a ShardedCacheQueue object.
+
+        :param caches: the cache of each node, by node name (its place on the ring)
+        """
+        self.caches = caches
+        self.ring = HashRing(list(caches), vnodes=vnodes)
+        self.logger = logger
+
+    def shard(self, short_url: str) -> AbstractCacheQueue:
+        return self.caches[self.ring.node_for(short_url)]
+
+    def _group(self, urls: List[Url]) -> Dict[str, List[Url]]:
+        groups = defaultdict(list)
+        for url in urls:
+            groups[self.ring.node_for(url.short_url)].append(url)
+        return groups
+
+    def add(self, url: Url) -> bool:
+        return self.shard(url.short_url).add(url)
+
+    def add_many(self, urls: List[Url]) -> bool:
+        """Adds several urls to the cache with a pipeline per node."""
+        return all([self.caches[node].add_many(group) for node, group in self._group(urls).items()])
+
+    def add_missing(self, short_url: str) -> bool:
+        return self.shard(short_url).add_missing(short_url)
+
+    def acquire_refill_lock(self, short_url: str, ttl: float) -> bool:
+        return self.shard(short_url).acquire_refill_lock(short_url, ttl)
+
+    def get(self, short_url: str) -> str:
+        return self.shard(short_url).get(short_url)
+
+
+class AsyncShardedCacheQueue(ShardedCacheQueue):
+    """Non-blocking version of ShardedCacheQueue, to wrap asynchronous caches"""
+
+    async def add(self, url: Url) -> bool:
+        return await self.shard(url.short_url).add(url)
+
+    async def add_many(self, urls: List[Url]) -> bool:
+        added = await asyncio.gather(
+            *(self.caches[node].add_many(group) for node, group in self._group(urls).items())
+        )
+        return all(added)
+
+    async def add_missing(self, short_url: str) -> bool:
+        return await self.shard(short_url).add_missing(short_url)
+
+    async def acquire_refill_lock(self, short_url: str, ttl: float) -> bool:
+        return await self.shard(short_url).acquire_refill_lock(short_url, ttl)
+
+    async def get(self, short_url: str) -> str:
+        return await self.shard(short_url).get(short_url)
+
+
+class ShardedShortUrlQueue(AbstractUrlQueue):
+    """
+    Partitions the queue of available short urls over several nodes.
+
+    Short urls are popped from a random shard, falling back on the others when it's
+    empty, and pushed to the least loaded ones. The key generator sees a single queue
+    as large as all of its shards together, and waits for signals on the first one,
+    which every shard signals (see the signal_client of ShortUrlQueue).
+    """
+
+    def __init__(self, queues: List[AbstractUrlQueue], logger: Logger = logger):
+        """
+        :param queues: a queue per node, the first one on the primary node
+        """
+        self.queues = queues
+        self.queue_name = queues[0].queue_name
+        self.logger = logger
+
+    def _shuffled(self) -> List[AbstractUrlQueue]:
+        return sample(self.queues, len(self.queues))
+
+    def _spread(self, short_urls: List[str], sizes: List[int]) -> List[List[str]]:
+        """Splits short urls over the shards, evening their sizes out."""
+        shares = [[] for _ in self.queues]
+        heap = [(size, index) for index, size in enumerate(sizes)]
+        heapq.heapify(heap)
+        for short_url in short_urls:
+            size, index = heapq.heappop(heap)
+            shares[index].append(short_url)
+            heapq.heappush(heap, (size + 1, index))
+        return shares
+
+    def signal_low_stock(self) -> None:
+        self.queues[0].signal_low_stock()
+
+    def wait_for_low_stock(self, timeout: float) -> bool:
+        return self.queues[0].wait_for_low_stock(timeout)
+
+    def publish_stats(self, stats: Dict[str, float]) -> None:
+        self.queues[0].publish_stats(stats)
+
+    def read_stats(self) -> Dict[str, float]:
+        return self.queues[0].read_stats()
+
+    def deque_short_url_key(self) -> str:
+        for queue in self._shuffled():
+            try:
+                return queue.deque_short_url_key()
+            except EmptyQueueException:
+                continue
+        raise EmptyQueueException(f"There are no keys left on queue {self.queue_name}")
+
+    def deque_short_url_keys(self, count: int) -> List[str]:
+        """Dequeues several short urls from a single shard, it's all or nothing."""
+        for queue in self._shuffled():
+            try:
+                return queue.deque_short_url_keys(count)
+            except EmptyQueueException:
+                continue
+        raise EmptyQueueException(f"There are less than {count} keys left on any shard of queue {self.queue_name}")
+
+    def enqueue_short_url_key(self, short_url: str) -> int:
+        return self.enqueue_short_url_keys([short_url])
+
+    def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        """Enqueues several short urls on the least loaded shards, with a LPUSH per shard."""
+        sizes = [queue.current_size() for queue in self.queues]
+        shares = self._spread(short_urls, sizes)
+        return sum(
+            queue.enqueue_short_url_keys(share) if share else size
+            for queue, share, size in zip(self.queues, shares, sizes)
+        )
+
+    def current_size(self) -> int:
+        return sum(queue.current_size() for queue in self.queues)
+
+    def peek_short_url_keys(self) -> List[str]:
+        return [short_url for queue in self.queues for short_url in queue.peek_short_url_keys()]
+
+    def remove_short_url_keys(self, short_urls: List[str]) -> int:
+        return sum(queue.remove_short_url_keys(short_urls) for queue in self.queues)
+
+
+class AsyncShardedShortUrlQueue(ShardedShortUrlQueue):
+    """Non-blocking version of ShardedShortUrlQueue, to wrap AsyncShortUrlQueue shards"""
+
+    async def signal_low_stock(self) -> None:
+        await self.queues[0].signal_low_stock()
+
+    async def wait_for_low_stock(self, timeout: float) -> bool:
+        return await self.queues[0].wait_for_low_stock(timeout)
+
+    async def deque_short_url_key(self) -> str:
+        for queue in self._shuffled():
+            try:
+                return await queue.deque_short_url_key()
+            except EmptyQueueException:
+                continue
+        raise EmptyQueueException(f"There are no keys left on queue {self.queue_name}")
+
+    async def deque_short_url_keys(self, count: int) -> List[str]:
+        for queue in self._shuffled():
+            try:
+                return await queue.deque_short_url_keys(count)
+            except EmptyQueueException:
+                continue
+        raise EmptyQueueException(f"There are less than {count} keys left on any shard of queue {self.queue_name}")
+
+    async def enqueue_short_url_key(self, short_url: str) -> int:
+        return await self.enqueue_short_url_keys([short_url])
+
+    async def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        sizes = await asyncio.gather(*(queue.current_size() for queue in self.queues))
+        shares = self._spread(short_urls, list(sizes))
+        enqueued = await asyncio.gather(
+            *(queue.enqueue_short_url_keys(share) for queue, share in zip(self.queues, shares) if share)
+        )
+        return sum(enqueued) + sum(size for share, size in zip(shares, sizes) if not share)
+
+    async def current_size(self) -> int:
+        return sum(await asyncio.gather(*(queue.current_size() for queue in self.queues)))
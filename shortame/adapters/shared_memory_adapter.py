@@ -0,0 +1,227 @@
+# File with an in-memory cache shared by the processes of a host
+import fcntl
+import mmap
+import os
+import struct
+import zlib
+from threading import Lock
+from time import time
+from typing import Dict, List, Tuple
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.redis_adapter import (MISSING_URL_MARKER, AbstractCacheQueue,
+                                             ShortUrlMarkedAsMissing, ShortUrlNotFoundOnCache)
+from shortame.domain.model import Url
+
+# file header: magic, version, slot count, slot size
+FILE_HEADER = struct.Struct("<4sHxxII")
+FILE_MAGIC = b"SHRT"
+FILE_VERSION = 1
+# slot header: sequence, expiry (unix seconds), crc32, key length, value length
+SLOT_HEADER = struct.Struct("<IIIBxH")
+SEQUENCE = struct.Struct("<I")
+KEY_LENGTH_OFFSET = 12
+
+
+class SharedMemoryCacheQueue(AbstractCacheQueue):
+    """
+    Fixed-size cache of short urls on a memory mapped file, shared by the workers of a host.
+
+    The file is an open-addressing hash table: a short url lives on one of the
+    max_probes slots following its hash, each slot holding the short and long urls
+    plus their expiry. Readers take no lock, slots are written under a seqlock: the
+    sequence is odd while a write is under way and changes with every write, so a
+    reader seeing an odd or changed sequence (or a bad crc32) treats the slot as a
+    miss. A process only writes a slot holding its (non-blocking) fcntl lock, writes
+    finding the slot locked by another worker are dropped.
+
+    Long urls that don't fit on a slot are not cached. Put the file on a tmpfs
+    (e.g.: /dev/shm) so it's never written to disk. Expired urls can still be read
+    with get_stale for stale_ttl seconds, until their slot is taken.
+    """
+
+    def __init__(
+        self,
+        path: str = "/dev/shm/shortame-redirects",
+        slots: int = 65536,
+        slot_size: int = 256,
+        ttl: float = 300,
+        negative_ttl: float = 60,
+        max_probes: int = 4,
+        stale_ttl: float = 0,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a SharedMemoryCacheQueue object, creating the file if it doesn't exist.
+
+        :param path: the file shared by the workers, they must all use the same slots and slot_size.
+        :param slots: how many urls fit on the cache, e.g.: 65536
+        :param slot_size: bytes per slot, header included, e.g.: 256 (long urls of up to ~230 chars)
+        :param ttl: how many seconds an url is kept, e.g.: 300
+        :param negative_ttl: how many seconds a missing short url is remembered, e.g.: 60
+        :param max_probes: how many slots a short url may take after the one of its hash
+        :param stale_ttl: how many seconds an expired url can still be read with get_stale, e.g.: 3600
+        """
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_probes = max_probes
+        self.stale_ttl = stale_ttl
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+        self._lock = Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._initialize()
+        self._map = mmap.mmap(self._fd, FILE_HEADER.size + slots * slot_size)
+
+    def _initialize(self) -> None:
+        """Sizes the file and writes its header once, checks it on every other process."""
+        size = FILE_HEADER.size + self.slots * self.slot_size
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, FILE_HEADER.size, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self.slots, self.slot_size), 0)
+                self.logger.info("Created shared cache '{}' with {} slots", self.path, self.slots)
+                return
+            header = FILE_HEADER.unpack(os.pread(self._fd, FILE_HEADER.size, 0))
+            if header != (FILE_MAGIC, FILE_VERSION, self.slots, self.slot_size):
+                raise ValueError(
+                    f"Shared cache '{self.path}' was created with another layout, remove it or change its path"
+                )
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, FILE_HEADER.size, 0)
+
+    def _offset(self, slot: int) -> int:
+        return FILE_HEADER.size + slot * self.slot_size
+
+    def _probes(self, key: bytes) -> List[int]:
+        start = zlib.crc32(key) % self.slots
+        return [(start + probe) % self.slots for probe in range(self.max_probes)]
+
+    def _read(self, slot: int) -> Tuple[bytes, bytes, int] | None:
+        """Returns the key, value and expiry on a slot, None if it's empty or being written."""
+        offset = self._offset(slot)
+        sequence, expires_at, checksum, key_length, value_length = SLOT_HEADER.unpack_from(self._map, offset)
+        if sequence & 1 or not key_length:
+            return None
+        start = offset + SLOT_HEADER.size
+        data = self._map[start : start + key_length + value_length]
+        if SEQUENCE.unpack_from(self._map, offset)[0] != sequence or zlib.crc32(data, expires_at) != checksum:
+            return None
+        return data[:key_length], data[key_length:], expires_at
+
+    def _choose_slot(self, key: bytes, now: int) -> int:
+        """The slot of key if it's cached, else a free or expired one, else the one expiring first."""
+        free_slot, oldest_slot, oldest_expiry = None, None, None
+        for slot in self._probes(key):
+            entry = self._read(slot)
+            if entry is None:
+                free_slot = slot if free_slot is None else free_slot
+                continue
+            entry_key, _, expires_at = entry
+            if entry_key == key:
+                return slot
+            if expires_at <= now:
+                free_slot = slot if free_slot is None else free_slot
+            elif oldest_expiry is None or expires_at < oldest_expiry:
+                oldest_slot, oldest_expiry = slot, expires_at
+        if free_slot is not None:
+            return free_slot
+        self.evictions += 1
+        return oldest_slot
+
+    def _write(self, slot: int, key: bytes, value: bytes, expires_at: int) -> bool:
+        offset = self._offset(slot)
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, self.slot_size, offset)
+        except OSError:
+            return False
+        try:
+            # odd while writing, even after, whatever a writer which died mid-write left
+            writing = ((SEQUENCE.unpack_from(self._map, offset)[0] + 1) | 1) & 0xFFFFFFFF
+            SEQUENCE.pack_into(self._map, offset, writing)
+            start = offset + SLOT_HEADER.size
+            data = key + value
+            self._map[start : start + len(data)] = data
+            SLOT_HEADER.pack_into(
+                self._map,
+                offset,
+                writing,
+                expires_at,
+                zlib.crc32(data, expires_at),
+                len(key),
+                len(value),
+            )
+            SEQUENCE.pack_into(self._map, offset, (writing + 1) & 0xFFFFFFFF)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, self.slot_size, offset)
+        return True
+
+    def _put(self, short_url: str, long_url: str, ttl: float) -> bool:
+        key, value = short_url.encode("utf-8"), long_url.encode("utf-8")
+        if len(key) > 255 or SLOT_HEADER.size + len(key) + len(value) > self.slot_size:
+            self.skipped += 1
+            return False
+        now = int(time())
+        with self._lock:
+            return self._write(self._choose_slot(key, now), key, value, int(now + ttl))
+
+    def add(self, url: Url) -> bool:
+        return self._put(url.short_url, url.long_url, self.ttl)
+
+    def add_many(self, urls: List[Url]) -> bool:
+        return all([self._put(url.short_url, url.long_url, self.ttl) for url in urls])
+
+    def add_missing(self, short_url: str) -> bool:
+        return self._put(short_url, MISSING_URL_MARKER, self.negative_ttl)
+
+    def get(self, short_url: str) -> str:
+        key = short_url.encode("utf-8")
+        for slot in self._probes(key):
+            entry = self._read(slot)
+            if entry is None or entry[0] != key:
+                continue
+            if entry[2] <= time():
+                break
+            self.hits += 1
+            long_url = entry[1].decode("utf-8")
+            if long_url == MISSING_URL_MARKER:
+                raise ShortUrlMarkedAsMissing(f"Short url '{short_url}' is marked as missing on shared cache")
+            return long_url
+        self.misses += 1
+        raise ShortUrlNotFoundOnCache(f"Short url '{short_url}' not found on shared cache")
+
+    def get_stale(self, short_url: str) -> str:
+        """Returns the long url of a short url even if it expired less than stale_ttl seconds ago."""
+        key = short_url.encode("utf-8")
+        for slot in self._probes(key):
+            entry = self._read(slot)
+            if entry is None or entry[0] != key:
+                continue
+            if entry[2] + self.stale_ttl > time() and entry[1] != MISSING_URL_MARKER.encode("utf-8"):
+                return entry[1].decode("utf-8")
+            break
+        raise ShortUrlNotFoundOnCache(f"Short url '{short_url}' not found on shared cache, not even stale")
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss, eviction and skip counters of this process, plus the size of the cache."""
+        key_lengths = self._map[FILE_HEADER.size + KEY_LENGTH_OFFSET :: self.slot_size]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "skipped": self.skipped,
+            "size": len(key_lengths) - key_lengths.count(0),
+        }
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
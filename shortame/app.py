@@ -1,20 +1,319 @@
-from dataclasses import asdict
-from typing import Annotated, Dict
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Annotated, Dict, List
 
-from fastapi import Body, FastAPI, status
+from fastapi import Body, FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse
 from loguru import logger
 from pydantic import HttpUrl
 
 from shortame.config import settings
-from shortame.services.url_services import UrlShortener
-from shortame.adapters.redis_adapter import ShortUrlQueue, CacheQueue
-from shortame.adapters.dynamodb_adapter import UrlTable
+from shortame.logs import SampledAccessLog, configure_logging
+from shortame.services.key_generation_services import AsyncLeasedRangeKeyQueue, FeistelKeyPermutation
+from shortame.services.analytics_services import AsyncClickAggregator
+from shortame.services.cache_services import AsyncCacheWarmer
+from shortame.services.redirect_services import RedirectPolicy
+from shortame.services.metrics import (
+    Instrumented,
+    InstrumentedCache,
+    InstrumentedUrlShortener,
+    MultiProcessRegistry,
+    registry,
+)
+from shortame.services.url_services import AsyncUrlShortener
+from shortame.services.write_behind_services import AsyncUrlFlusher
+from shortame.adapters.redis_adapter import (
+    AsyncBucketedCacheQueue,
+    AsyncShortUrlQueue,
+    AsyncCacheQueue,
+    AsyncClickStatsCache,
+    AsyncHotKeyTracker,
+    AsyncIdRangeCounter,
+    AsyncLongUrlIndexCache,
+    AsyncPendingUrlStream,
+    CompactUrlCodec,
+    close_async_redis_client,
+    get_async_redis_clients,
+)
+from shortame.adapters.shared_memory_adapter import SharedMemoryCacheQueue
+from shortame.adapters.sharding_adapter import AsyncShardedCacheQueue, AsyncShardedShortUrlQueue
+from shortame.adapters.bloom_filter_adapter import AsyncRedisBloomFilter
+from shortame.adapters.dynamodb_adapter import (
+    AsyncClickStatsTable,
+    AsyncLongUrlIndexTable,
+    AsyncUrlTable,
+    ClickStatsTable,
+    FastUrlTable,
+    LongUrlIndexTable,
+    ThreadLocalUrlTable,
+    UrlTable,
+    create_dyn_resource,
+)
+from shortame.adapters.embedded_adapter import AsyncEmbeddedUrlTable
+from shortame.adapters.resilient_adapter import AsyncResilientUrlTable
+from shortame.adapters.memory_adapter import AsyncBufferedShortUrlQueue, LocalCacheQueue
+from shortame.domain.model import CacheMaxAge, RedirectStatus, url_to_item
+
+configure_logging(sink="app.log")
+
+
+def instrument(target, component: str, proxy=Instrumented):
+    """Wraps target with a metrics recording proxy when metrics are enabled."""
+    if target is None or not settings.metrics_enabled:
+        return target
+    return proxy(target, component=component)
+
+
+def create_queue(url_table):
+    if settings.key_strategy == "leased_range":
+        return AsyncLeasedRangeKeyQueue(
+            counter=AsyncIdRangeCounter(),
+            permutation=FeistelKeyPermutation(secret=settings.key_permutation_secret),
+            lease_size=settings.key_lease_size,
+            table=url_table if settings.key_lease_check_table else None,
+        )
+    redis_clients = list(get_async_redis_clients().values())
+    if len(redis_clients) == 1:
+        queue = AsyncShortUrlQueue(low_watermark=settings.short_url_minimum_queue_size)
+    else:
+        # every shard signals the key generator through the primary node
+        queue = AsyncShardedShortUrlQueue(
+            [
+                AsyncShortUrlQueue(
+                    redis_client=redis_client,
+                    low_watermark=settings.short_url_minimum_queue_size // len(redis_clients),
+                    signal_client=redis_clients[0],
+                )
+                for redis_client in redis_clients
+            ]
+        )
+    if settings.key_buffer_enabled:
+        queue = AsyncBufferedShortUrlQueue(
+            queue=queue,
+            block_size=settings.key_buffer_block_size,
+            low_watermark=settings.key_buffer_low_watermark,
+        )
+    return queue
+
+
+def create_local_cache():
+    if not settings.local_cache_enabled:
+        return None
+    if settings.local_cache_backend == "shared_memory":
+        return SharedMemoryCacheQueue(
+            path=settings.shared_cache_path,
+            slots=settings.shared_cache_slots,
+            slot_size=settings.shared_cache_slot_size,
+            ttl=settings.local_cache_ttl,
+            negative_ttl=settings.negative_cache_ttl,
+            stale_ttl=settings.local_cache_stale_ttl,
+        )
+    return LocalCacheQueue(
+        max_size=settings.local_cache_max_size,
+        ttl=settings.local_cache_ttl,
+        negative_ttl=settings.negative_cache_ttl,
+        stale_ttl=settings.local_cache_stale_ttl,
+    )
+
+
+def create_node_cache(redis_client):
+    if settings.cache_layout == "buckets":
+        return AsyncBucketedCacheQueue(
+            redis_client=redis_client,
+            negative_ttl=settings.negative_cache_ttl,
+            codec=CompactUrlCodec(
+                prefix_length=settings.cache_bucket_prefix_length,
+                compress=settings.cache_compression,
+            ),
+        )
+    return AsyncCacheQueue(redis_client=redis_client, negative_ttl=settings.negative_cache_ttl)
+
+
+def create_cache():
+    caches = {node: create_node_cache(redis_client) for node, redis_client in get_async_redis_clients().items()}
+    if len(caches) == 1:
+        return next(iter(caches.values()))
+    return AsyncShardedCacheQueue(caches, vnodes=settings.redis_virtual_nodes)
+
+
+def create_url_table():
+    if settings.url_table_adapter == "client":
+        return FastUrlTable(
+            verify_table=settings.dynamodb_verify_table,
+            consistent_read=settings.dynamodb_consistent_read,
+        )
+    # called from the executor's threads, a resource must not be shared across them
+    return ThreadLocalUrlTable(
+        lambda: UrlTable(dyn_resource=create_dyn_resource(), verify_table=settings.dynamodb_verify_table)
+    )
+
+
+def create_async_url_table():
+    if settings.url_table_adapter == "embedded":
+        # reads are served from the page cache, no executor needed
+        return AsyncEmbeddedUrlTable(path=settings.embedded_table_path, sync=settings.embedded_table_sync)
+    if settings.dynamodb_resilience_enabled:
+        return AsyncResilientUrlTable(
+            url_table=create_url_table(),
+            deadline=settings.dynamodb_read_deadline,
+            hedging=settings.dynamodb_hedging_enabled,
+            hedge_percentile=settings.dynamodb_hedge_percentile,
+            failure_threshold=settings.dynamodb_circuit_failure_threshold,
+            reset_timeout=settings.dynamodb_circuit_reset_timeout,
+        )
+    return AsyncUrlTable(url_table=create_url_table())
+
+
+def create_hot_key_tracker():
+    if not settings.hot_keys_enabled:
+        return None
+    return AsyncHotKeyTracker(
+        sample_rate=settings.hot_keys_sample_rate,
+        max_size=settings.hot_keys_max_size,
+        decay_interval=settings.hot_keys_decay_interval,
+    )
+
+
+def create_click_aggregator():
+    if not settings.analytics_enabled:
+        return None
+    # with the embedded url table there's no DynamoDB to keep the clicks on, only Redis
+    table = (
+        AsyncClickStatsTable(stats_table=ClickStatsTable(table_name=settings.analytics_table_name))
+        if settings.url_table_adapter != "embedded"
+        else None
+    )
+    return AsyncClickAggregator(cache=AsyncClickStatsCache(), table=table)
+
+
+def create_pending_urls():
+    if not settings.write_behind_enabled:
+        return None
+    return AsyncPendingUrlStream()
 
-logger.add(sink="app.log")
 
-app = FastAPI()
+def create_shortener(queue, table, local_cache, hot_key_tracker, pending_urls):
+    cache = create_cache()
+    bloom_filter = (
+        AsyncRedisBloomFilter(
+            capacity=settings.bloom_filter_capacity,
+            error_rate=settings.bloom_filter_error_rate,
+        )
+        if settings.bloom_filter_enabled
+        else None
+    )
+    dedup_table, dedup_cache = None, None
+    if settings.dedup_enabled:
+        dedup_table = AsyncLongUrlIndexTable(
+            index_table=LongUrlIndexTable(table_name=settings.dedup_table_name)
+        )
+        dedup_cache = AsyncLongUrlIndexCache()
+    return instrument(
+        AsyncUrlShortener(
+            queue=instrument(queue, "key_queue"),
+            table=instrument(table, "url_table"),
+            cache=instrument(cache, "cache", InstrumentedCache),
+            local_cache=instrument(local_cache, "local_cache", InstrumentedCache),
+            bloom_filter=bloom_filter,
+            negative_caching=settings.negative_cache_enabled,
+            refill_lock_ttl=settings.cache_refill_lock_ttl,
+            dedup_table=dedup_table,
+            dedup_cache=dedup_cache,
+            hot_key_tracker=hot_key_tracker,
+            pending_urls=instrument(pending_urls, "pending_urls"),
+            serve_stale=settings.serve_stale_enabled,
+        ),
+        "url_shortener",
+        InstrumentedUrlShortener,
+    )
+
+
+def create_redirect_policy():
+    return RedirectPolicy(
+        status=settings.redirect_status,
+        cache_max_age=settings.redirect_cache_max_age,
+        max_size=settings.local_cache_max_size,
+    )
+
+
+def create_multiprocess_registry():
+    if not (settings.metrics_enabled and settings.metrics_multiprocess_enabled):
+        return None
+    return MultiProcessRegistry(directory=settings.metrics_multiprocess_dir)
+
+
+async def finish(task: asyncio.Future | None) -> None:
+    """Cancels a task doing its last work once cancelled, and waits for it."""
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Creates the clients once the worker started, so importing the app needs no network calls."""
+    url_table = create_async_url_table()
+    app.state.queue = create_queue(url_table)
+    app.state.local_cache = create_local_cache()
+    app.state.redirect_policy = create_redirect_policy()
+    hot_key_tracker = create_hot_key_tracker()
+    pending_urls = create_pending_urls()
+    app.state.shortener = create_shortener(
+        app.state.queue, url_table, app.state.local_cache, hot_key_tracker, pending_urls
+    )
+    url_flush = None
+    if pending_urls is not None:
+        await pending_urls.ensure_group()
+        flusher = AsyncUrlFlusher(
+            pending_urls=pending_urls,
+            table=url_table,
+            batch_size=settings.write_behind_batch_size,
+            min_idle=settings.write_behind_min_idle,
+        )
+        url_flush = asyncio.ensure_future(flusher.run(settings.write_behind_flush_interval))
+    app.state.click_aggregator = create_click_aggregator()
+    click_flush = None
+    if app.state.click_aggregator is not None:
+        click_flush = asyncio.ensure_future(app.state.click_aggregator.run(settings.analytics_flush_interval))
+    app.state.metrics, metrics_write = create_multiprocess_registry(), None
+    if app.state.metrics is not None:
+        metrics_write = asyncio.ensure_future(
+            app.state.metrics.run(settings.metrics_multiprocess_interval, update=partial(update_gauges, app))
+        )
+    warm_up = None
+    if hot_key_tracker is not None and settings.cache_warm_up_enabled:
+        warmer = AsyncCacheWarmer(
+            tracker=hot_key_tracker,
+            table=url_table,
+            cache=create_cache(),
+            rate_limit=settings.cache_warm_up_rate_limit,
+        )
+        # runs alongside the requests, a single worker warms the cache up per deploy
+        warm_up = asyncio.ensure_future(
+            warmer.warm_up_quietly(settings.cache_warm_up_size, lock_ttl=settings.cache_warm_up_lock_ttl)
+        )
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    if url_flush is not None:
+        # urls not flushed yet stay on the stream, for the flushers of the other workers
+        url_flush.cancel()
+    # the tasks flush the clicks still on memory, and write this worker's metrics, once cancelled
+    await finish(click_flush)
+    await finish(metrics_write)
+    if isinstance(app.state.queue, AsyncBufferedShortUrlQueue):
+        await app.state.queue.release()
+    if isinstance(app.state.local_cache, SharedMemoryCacheQueue):
+        app.state.local_cache.close()
+    if isinstance(url_table, AsyncEmbeddedUrlTable):
+        url_table.close()
+    await close_async_redis_client()
+    await logger.complete()
+
+
+app = FastAPI(lifespan=lifespan)
 
 ORIGINS = ["http://localhost:5000", "http://127.0.0.1:5000", settings.domain_name]
 
@@ -25,20 +324,81 @@ HEADERS = ["*"]
 app.add_middleware(
     CORSMiddleware, allow_origins=ORIGINS, allow_methods=METHODS, allow_headers=HEADERS
 )
+if settings.log_mode == "production":
+    app.add_middleware(SampledAccessLog, sample_rate=settings.log_request_sample_rate)
+
+key_queue_depth = registry.gauge("shortame_key_queue_depth", "Short urls left on the key queue")
+key_buffer_size = registry.gauge("shortame_key_buffer_size", "Short urls reserved on this worker's buffer")
+local_cache_size = registry.gauge("shortame_local_cache_size", "Urls kept on this worker's local cache")
+
 
-queue = ShortUrlQueue()
-table = UrlTable()
-cache = CacheQueue()
-shortener = UrlShortener(queue=queue, table=table, cache=cache)
+async def update_gauges(app: FastAPI) -> None:
+    queue, local_cache = app.state.queue, app.state.local_cache
+    key_queue_depth.set(await queue.current_size())
+    if isinstance(queue, AsyncBufferedShortUrlQueue):
+        key_buffer_size.set(queue.buffered())
+    if local_cache is not None:
+        local_cache_size.set(local_cache.stats()["size"])
+
+
+RedirectStatusBody = Annotated[RedirectStatus | None, Body(embed=True)]
+
+CacheMaxAgeBody = Annotated[CacheMaxAge | None, Body(embed=True)]
 
 
 @app.post("/url", status_code=status.HTTP_200_OK)
-async def url(long_url: Annotated[HttpUrl, Body(embed=True)]) -> Dict[str, str]:
-    url = shortener.shorten_and_persist(long_url=long_url.unicode_string())
-    return asdict(url)
+async def url(
+    request: Request,
+    long_url: Annotated[HttpUrl, Body(embed=True)],
+    redirect_status: RedirectStatusBody = None,
+    cache_max_age: CacheMaxAgeBody = None,
+) -> Dict[str, str | int]:
+    url = await request.app.state.shortener.shorten_and_persist(
+        long_url=long_url.unicode_string(), redirect_status=redirect_status, cache_max_age=cache_max_age
+    )
+    return url_to_item(url)
+
+
+@app.post("/urls", status_code=status.HTTP_200_OK)
+async def urls(
+    request: Request,
+    long_urls: Annotated[
+        List[HttpUrl], Body(embed=True, max_length=settings.bulk_shorten_max_size)
+    ],
+    redirect_status: RedirectStatusBody = None,
+    cache_max_age: CacheMaxAgeBody = None,
+) -> List[Dict[str, str | int]]:
+    urls = await request.app.state.shortener.shorten_many(
+        long_urls=[long_url.unicode_string() for long_url in long_urls],
+        redirect_status=redirect_status,
+        cache_max_age=cache_max_age,
+    )
+    return [url_to_item(url) for url in urls]
+
+
+if settings.metrics_enabled:
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics(request: Request):
+        await update_gauges(request.app)
+        # with several workers, the one answering renders the metrics of all of them
+        multiprocess = request.app.state.metrics
+        text = multiprocess.render() if multiprocess is not None else registry.render()
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+if settings.analytics_enabled:
+
+    @app.get("/stats/{short_url}", status_code=status.HTTP_200_OK)
+    async def stats(request: Request, short_url: str) -> Dict[str, int | str]:
+        return await request.app.state.click_aggregator.get_stats(short_url=short_url)
 
 
 @app.get("/{short_url}", status_code=status.HTTP_200_OK)
-async def redirect(short_url: str):
-    long_url = shortener.get_long_url(short_url=short_url)
-    return RedirectResponse(long_url)
+async def redirect(request: Request, short_url: str):
+    url = await request.app.state.shortener.get_url(short_url=short_url)
+    click_aggregator = request.app.state.click_aggregator
+    if click_aggregator is not None:
+        client_host = request.client.host if request.client else ""
+        click_aggregator.record(short_url, f"{client_host}|{request.headers.get('user-agent', '')}")
+    return request.app.state.redirect_policy.response(url)
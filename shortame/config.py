@@ -1,3 +1,6 @@
+from typing import Dict, List
+
+from botocore.config import Config
 from dynaconf import Dynaconf
 
 settings = Dynaconf(
@@ -10,3 +13,50 @@ settings = Dynaconf(
 
 def get_redis_host_and_port():
     return {"host": settings.redis_host, "port": settings.redis_port}
+
+
+def get_redis_nodes() -> List[str]:
+    """
+    The Redis nodes as "host:port", from REDIS_NODES or else REDIS_HOST and REDIS_PORT.
+
+    The first one is the primary node, which also keeps everything that isn't sharded
+    (locks, stats, hot keys, counters...).
+    """
+    nodes = settings.get("redis_nodes")
+    if nodes:
+        return list(nodes)
+    host_and_port = get_redis_host_and_port()
+    return [f"{host_and_port['host']}:{host_and_port['port']}"]
+
+
+def get_redis_connection_settings(node: str | None = None) -> Dict:
+    """
+    Keyword arguments of the Redis connection pools, sized and timed out by the settings.
+
+    :param node: the "host:port" of the node, defaults to REDIS_HOST and REDIS_PORT
+    """
+    if node is None:
+        host_and_port = get_redis_host_and_port()
+    else:
+        host, port = node.rsplit(":", 1)
+        host_and_port = {"host": host, "port": int(port)}
+    return {
+        **host_and_port,
+        "max_connections": settings.redis_max_connections,
+        "timeout": settings.redis_pool_timeout,
+        "socket_timeout": settings.redis_socket_timeout,
+        "socket_connect_timeout": settings.redis_socket_connect_timeout,
+        "socket_keepalive": True,
+        "health_check_interval": settings.redis_health_check_interval,
+    }
+
+
+def get_botocore_config() -> Config:
+    """Connection pool, keep-alive, timeouts and retries of the DynamoDB clients."""
+    return Config(
+        max_pool_connections=settings.dynamodb_max_pool_connections,
+        tcp_keepalive=settings.dynamodb_tcp_keepalive,
+        connect_timeout=settings.dynamodb_connect_timeout,
+        read_timeout=settings.dynamodb_read_timeout,
+        retries={"max_attempts": settings.dynamodb_max_attempts, "mode": settings.dynamodb_retry_mode},
+    )
@@ -1,4 +1,9 @@
 # from dataclasses import dataclass
+from dataclasses import asdict
+from hashlib import sha256
+from typing import Annotated, Dict, Literal
+
+from pydantic import Field, HttpUrl
 from pydantic.dataclasses import dataclass
 
 
@@ -9,3 +14,104 @@ class Url:
 
     def __str__(self):
         return "{" + f"{self.short_url}: {self.long_url[:30]}..." + "}"
+
+
+# statuses a link may redirect with, 301 and 308 are permanent (cached by browsers as such)
+REDIRECT_STATUSES = (301, 302, 307, 308)
+# tags long urls carrying redirect overrides on caches, long urls never start with it
+REDIRECT_TAG = "!"
+# the longest cache max age of a redirect (a year), as HTTP caches may not honour longer ones
+MAX_CACHE_MAX_AGE = 31536000
+
+# what the API accepts, urls written by other means (e.g.: imported) are validated the same way
+RedirectStatus = Literal[REDIRECT_STATUSES]
+CacheMaxAge = Annotated[int, Field(ge=0, le=MAX_CACHE_MAX_AGE)]
+
+
+@dataclass
+class RedirectUrl(Url):
+    """Url overriding the default redirect status or cache max age (in seconds) of the app."""
+
+    redirect_status: int | None = None
+    cache_max_age: int | None = None
+
+
+def build_url(
+    short_url: str, long_url: str, redirect_status: int | None = None, cache_max_age: int | None = None
+) -> Url:
+    """Returns a RedirectUrl if there's any override, else a plain Url."""
+    if redirect_status is None and cache_max_age is None:
+        return Url(short_url=short_url, long_url=long_url)
+    return RedirectUrl(
+        short_url=short_url, long_url=long_url, redirect_status=redirect_status, cache_max_age=cache_max_age
+    )
+
+
+@dataclass
+class UrlInput:
+    """An url as given from outside, with the types the API enforces."""
+
+    short_url: Annotated[str, Field(min_length=1)]
+    long_url: HttpUrl
+    redirect_status: RedirectStatus | None = None
+    cache_max_age: CacheMaxAge | None = None
+
+
+def validate_url(
+    short_url: str, long_url: str, redirect_status: int | str | None = None, cache_max_age: int | str | None = None
+) -> Url:
+    """
+    Returns the url built from the given values, once validated like the API does.
+
+    The long url is kept as given, not normalized by HttpUrl.
+
+    :raises ValueError: if a value isn't valid, e.g.: a long url which isn't http(s).
+    """
+    url = UrlInput(
+        short_url=short_url, long_url=long_url, redirect_status=redirect_status, cache_max_age=cache_max_age
+    )
+    return build_url(short_url, long_url, url.redirect_status, url.cache_max_age)
+
+
+def url_to_item(url: Url) -> Dict:
+    """The item of an url on a table, overrides not set are left out."""
+    return {name: value for name, value in asdict(url).items() if value is not None}
+
+
+def url_from_item(item: Dict) -> Url:
+    return build_url(
+        item["short_url"], item["long_url"], item.get("redirect_status"), item.get("cache_max_age")
+    )
+
+
+def encode_long_url(url: Url) -> str:
+    """
+    Folds the overrides of an url into its long url, e.g.: '!308,86400!https://example.com'.
+
+    This is what caches store, so an url without overrides (most of them) is cached
+    as its bare long url, and the others need no extra round-trip.
+    """
+    if not isinstance(url, RedirectUrl):
+        return url.long_url
+    redirect_status = "" if url.redirect_status is None else url.redirect_status
+    cache_max_age = "" if url.cache_max_age is None else url.cache_max_age
+    return f"{REDIRECT_TAG}{redirect_status},{cache_max_age}{REDIRECT_TAG}{url.long_url}"
+
+
+def decode_long_url(short_url: str, value: str) -> Url:
+    """Inverse of encode_long_url."""
+    if not value.startswith(REDIRECT_TAG):
+        return Url(short_url=short_url, long_url=value)
+    overrides, long_url = value[1:].split(REDIRECT_TAG, 1)
+    redirect_status, cache_max_age = overrides.split(",")
+    return build_url(
+        short_url,
+        long_url,
+        int(redirect_status) if redirect_status else None,
+        int(cache_max_age) if cache_max_age else None,
+    )
+
+
+def hash_long_url(long_url: str) -> str:
+    """Fixed-size digest of a long url, used to index urls by their long version."""
+    return sha256(long_url.encode("utf-8")).hexdigest()[:32]
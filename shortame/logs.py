@@ -0,0 +1,76 @@
+import sys
+from random import random
+from time import perf_counter
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.config import settings
+
+
+def configure_logging(sink: str) -> None:
+    """
+    Adds the log file of a shortame process, according to LOG_MODE.
+
+    On "development" every operation is logged and written synchronously. On
+    "production" only LOG_LEVEL and up is kept, so per-operation debug lines are
+    dropped before being formatted, and records are written by a background thread.
+
+    :param sink: the log file, e.g.: "app.log"
+    """
+    if settings.log_mode != "production":
+        logger.add(sink=sink)
+        return
+    logger.remove()
+    for destination in (sys.stderr, sink):
+        logger.add(
+            sink=destination,
+            level=settings.log_level,
+            enqueue=True,
+            backtrace=False,
+            diagnose=False,
+        )
+
+
+class SampledAccessLog:
+    """
+    ASGI middleware logging a sample of the requests with their status and duration.
+
+    Replaces the per-operation lines on production: one line per sampled request
+    tells which route was hit and how long it took, at a fraction of the cost.
+    """
+
+    def __init__(self, app, sample_rate: float = 0.01, logger: Logger = logger):
+        """
+        Initializes a SampledAccessLog middleware.
+
+        :param app: the ASGI app being wrapped.
+        :param sample_rate: the fraction of the requests that is logged, e.g.: 0.01
+        """
+        self.app = app
+        self.sample_rate = sample_rate
+        self.logger = logger
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+        start = perf_counter()
+        status = 500
+
+        async def send_and_record_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record_status)
+        finally:
+            self.logger.info(
+                "{} {} {} {:.2f}ms",
+                scope["method"],
+                scope["path"],
+                status,
+                (perf_counter() - start) * 1000,
+            )
@@ -0,0 +1,151 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, Set, Tuple
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.dynamodb_adapter import ClickStatsTable
+from shortame.adapters.redis_adapter import ClickStatsCache
+
+
+class ClickAggregator:
+    """
+    Counts the clicks and visitors of each short url in memory, writing them behind.
+
+    Recording a click only touches two in-process dicts, so redirects never wait on
+    analytics. Every flush sends what was counted since the last one: clicks and
+    visitors to Redis in a single pipeline, clicks to the table with one ADD per url.
+    Counts are best effort: clicks recorded since the last flush are lost if the
+    worker dies, and a flush that fails is dropped instead of retried.
+    """
+
+    def __init__(
+        self,
+        cache: ClickStatsCache,
+        table: ClickStatsTable | None = None,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a ClickAggregator object.
+
+        :param cache: where click counts and unique visitor estimates are kept.
+        :param table: optional durable copy of the click counts, the cache's count may be
+            behind it (e.g.: recreated by a flush after a Redis restart), the highest is returned.
+        """
+        self.cache = cache
+        self.table = table
+        self.logger = logger
+        self._clicks: Dict[str, int] = defaultdict(int)
+        self._visitors: Dict[str, Set[str]] = defaultdict(set)
+
+    def record(self, short_url: str, visitor: str) -> None:
+        """
+        Counts a click on a short url, to be written on the next flush.
+
+        :param visitor: identifies who clicked, e.g.: "<client ip>|<user agent>"
+        """
+        self._clicks[short_url] += 1
+        self._visitors[short_url].add(visitor)
+
+    def pending(self) -> int:
+        """Returns how many short urls have clicks waiting to be flushed."""
+        return len(self._clicks)
+
+    def _swap(self) -> Tuple[Dict[str, int], Dict[str, Set[str]]]:
+        clicks, visitors = self._clicks, self._visitors
+        self._clicks, self._visitors = defaultdict(int), defaultdict(set)
+        return clicks, visitors
+
+    def flush(self) -> int:
+        """
+        Writes the clicks counted since the last flush, each sink on its own.
+
+        :return flushed: how many short urls had clicks written
+        """
+        clicks, visitors = self._swap()
+        if not clicks:
+            return 0
+        try:
+            self.cache.add_clicks(clicks, visitors)
+        except Exception:
+            self.logger.opt(exception=True).error(
+                "Error while flushing clicks of {} short urls to the cache", len(clicks)
+            )
+        if self.table is not None:
+            try:
+                failed = self.table.add_clicks(clicks)
+            except Exception:
+                self.logger.opt(exception=True).error(
+                    "Error while flushing clicks of {} short urls to the table", len(clicks)
+                )
+            else:
+                if failed:
+                    self.logger.error("Clicks of {} short urls couldn't be flushed to the table", len(failed))
+        self.logger.debug("Flushed clicks of {} short urls", len(clicks))
+        return len(clicks)
+
+    def get_stats(self, short_url: str) -> Dict[str, int | str]:
+        """
+        Returns the clicks and unique visitors of a short url, as of the last flush.
+
+        Unique visitors are a HyperLogLog estimate, within about 1% of the real count.
+        """
+        clicks, unique_visitors = self.cache.get_stats(short_url)
+        table_clicks = self.table.get_clicks(short_url) if self.table is not None else 0
+        return self._stats(short_url, clicks, table_clicks, unique_visitors)
+
+    @staticmethod
+    def _stats(short_url: str, clicks: int | None, table_clicks: int, unique_visitors: int) -> Dict[str, int | str]:
+        # both get the same clicks, a lower cache count was reset since
+        clicks = max(clicks or 0, table_clicks)
+        return {"short_url": short_url, "clicks": clicks, "unique_visitors": unique_visitors}
+
+
+class AsyncClickAggregator(ClickAggregator):
+    """Non-blocking version of ClickAggregator, flushed by a task alongside the app"""
+
+    async def flush(self) -> int:
+        clicks, visitors = self._swap()
+        if not clicks:
+            return 0
+        try:
+            await self.cache.add_clicks(clicks, visitors)
+        except Exception:
+            self.logger.opt(exception=True).error(
+                "Error while flushing clicks of {} short urls to the cache", len(clicks)
+            )
+        if self.table is not None:
+            try:
+                failed = await self.table.add_clicks(clicks)
+            except Exception:
+                self.logger.opt(exception=True).error(
+                    "Error while flushing clicks of {} short urls to the table", len(clicks)
+                )
+            else:
+                if failed:
+                    self.logger.error("Clicks of {} short urls couldn't be flushed to the table", len(failed))
+        self.logger.debug("Flushed clicks of {} short urls", len(clicks))
+        return len(clicks)
+
+    async def run(self, interval: float) -> None:
+        """
+        Flushes the clicks every interval seconds until cancelled, then one last time.
+
+        :param interval: seconds between flushes, e.g.: 5
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    async def get_stats(self, short_url: str) -> Dict[str, int | str]:
+        if self.table is None:
+            (clicks, unique_visitors), table_clicks = await self.cache.get_stats(short_url), 0
+        else:
+            (clicks, unique_visitors), table_clicks = await asyncio.gather(
+                self.cache.get_stats(short_url), self.table.get_clicks(short_url)
+            )
+        return self._stats(short_url, clicks, table_clicks, unique_visitors)
@@ -0,0 +1,320 @@
+import csv
+import json
+from itertools import islice
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, Iterable, Iterator, List, TextIO
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.bloom_filter_adapter import AbstractBloomFilter
+from shortame.adapters.dynamodb_adapter import AbstractDynamoDBUrlTable
+from shortame.adapters.redis_adapter import AbstractCacheQueue, ShortUrlQueue
+from shortame.domain.model import Url, encode_long_url, validate_url
+
+URL_FIELDS = ["short_url", "long_url", "redirect_status", "cache_max_age"]
+
+
+class InvalidUrlRow:
+    """A row of an import file which isn't a valid url, counted as failed by UrlImporter."""
+
+    def __init__(self, row: int, error: str):
+        self.row = row
+        self.error = error
+
+
+def _rows(lines: TextIO, format: str) -> Iterator[Dict | ValueError]:
+    if format == "csv":
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+
+
+def _cell(row: Dict, name: str) -> str | int | None:
+    # empty cells mean no override
+    return row.get(name) if row.get(name) != "" else None
+
+
+def _number(row: Dict, name: str) -> int | None:
+    # CSV cells are strings, JSONL numbers are already ints
+    value = _cell(row, name)
+    return int(value) if isinstance(value, str) else value
+
+
+def read_urls(lines: TextIO, format: str) -> Iterator[Url | InvalidUrlRow]:
+    """
+    Streams urls from a file, a line at a time, validated like the API does.
+
+    :param format: "csv" (with a short_url,long_url header) or "jsonl" (an object per line),
+        redirect_status and cache_max_age are optional (empty cells mean no override)
+    :return urls: the urls, and an InvalidUrlRow for each row which isn't a valid url
+        (e.g.: a long url which isn't http(s), a redirect status other than 301, 302, 307 or 308)
+    """
+    for number, row in enumerate(_rows(lines, format), start=1):
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            yield validate_url(
+                _cell(row, "short_url"),
+                _cell(row, "long_url"),
+                redirect_status=_number(row, "redirect_status"),
+                cache_max_age=_number(row, "cache_max_age"),
+            )
+        except (ValueError, AttributeError) as e:
+            yield InvalidUrlRow(number, str(e))
+
+
+class UrlWriter:
+    """Writes urls to a CSV or JSONL file, from several threads."""
+
+    def __init__(self, lines: TextIO, format: str):
+        self.lines = lines
+        self.format = format
+        self._lock = Lock()
+        self._csv = (
+            csv.DictWriter(lines, fieldnames=URL_FIELDS, restval="", extrasaction="ignore") if format == "csv" else None
+        )
+        if self._csv is not None:
+            self._csv.writeheader()
+
+    def write(self, urls: List[Dict[str, str | int]]) -> None:
+        with self._lock:
+            if self._csv is not None:
+                self._csv.writerows(urls)
+            else:
+                self.lines.writelines(
+                    json.dumps({name: url[name] for name in URL_FIELDS if name in url}) + "\n" for url in urls
+                )
+
+
+class Progress:
+    """Counts the urls processed by several threads, logging the throughput every interval seconds."""
+
+    def __init__(self, action: str, interval: float = 5, logger: Logger = logger):
+        self.action = action
+        self.interval = interval
+        self.logger = logger
+        self.done = 0
+        self.failed = 0
+        self.started = monotonic()
+        self._reported = self.started
+        self._lock = Lock()
+
+    def add(self, done: int, failed: int = 0) -> None:
+        with self._lock:
+            self.done += done
+            self.failed += failed
+            if monotonic() - self._reported < self.interval:
+                return
+            self._reported = monotonic()
+        self.report()
+
+    def elapsed(self) -> float:
+        return monotonic() - self.started
+
+    def report(self) -> None:
+        self.logger.info(
+            "{} {} urls in {:.1f}s ({:.0f} urls/s), {} failed",
+            self.action,
+            self.done,
+            self.elapsed(),
+            self.done / max(self.elapsed(), 1e-9),
+            self.failed,
+        )
+
+
+class UrlImporter:
+    """
+    Writes urls to the table in bulk, e.g.: to migrate or backfill it.
+
+    The input is streamed into a bounded queue of batches, so memory stays constant
+    whatever its size, and each worker (with a table of its own) writes batches with
+    BatchWriteItem, retrying unprocessed items with backoff. Imported short urls are
+    removed from the queue of available short urls, so they're never issued again,
+    and the queue is checked against the table once done, for the short urls the key
+    generator enqueued meanwhile. They're also added to the bloom filter, and cached
+    if a cache is given. Short urls dequeued by the app while importing may still be
+    issued again, import before the app is open to traffic.
+    """
+
+    def __init__(
+        self,
+        tables: List[AbstractDynamoDBUrlTable],
+        queue: ShortUrlQueue | None = None,
+        cache: AbstractCacheQueue | None = None,
+        bloom_filter: AbstractBloomFilter | None = None,
+        batch_size: int = 100,
+        progress_interval: float = 5,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes an UrlImporter object.
+
+        :param tables: a table per worker, the workers write concurrently.
+        :param queue: the queue of available short urls, imported ones are removed from it.
+        :param cache: if given, imported urls are cached (e.g.: to pre-warm it).
+        :param batch_size: how many urls each worker writes at once, e.g.: 100
+        :param progress_interval: seconds between progress logs, e.g.: 5
+        """
+        self.tables = tables
+        self.queue = queue
+        self.cache = cache
+        self.bloom_filter = bloom_filter
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.logger = logger
+        self._removed = 0
+        self._lock = Lock()
+
+    def _batches(self, urls: Iterable[Url | InvalidUrlRow], progress: Progress) -> Iterator[List[Url]]:
+        urls = iter(urls)
+        while rows := list(islice(urls, self.batch_size)):
+            batch = [url for url in rows if not self._is_invalid(url, progress)]
+            if batch:
+                # BatchWriteItem rejects a batch with the same key twice
+                yield list({url.short_url: url for url in batch}.values())
+
+    def _is_invalid(self, url: Url | InvalidUrlRow, progress: Progress) -> bool:
+        if not isinstance(url, InvalidUrlRow):
+            return False
+        self.logger.warning("Skipping row {} of the input, it's not a valid url: {}", url.row, url.error)
+        progress.add(0, failed=1)
+        return True
+
+    def run(self, urls: Iterable[Url | InvalidUrlRow]) -> Dict[str, float]:
+        """
+        Imports urls until the input is exhausted.
+
+        :param urls: e.g.: from read_urls, its invalid rows are counted as failed.
+        :return report: how many urls were imported, failed and removed from the queue, and the seconds taken
+        """
+        queued = set(self.queue.peek_short_url_keys()) if self.queue is not None else set()
+        batches = Queue(maxsize=2 * len(self.tables))
+        progress = Progress("Imported", self.progress_interval, self.logger)
+        workers = [Thread(target=self._work, args=(table, batches, queued, progress)) for table in self.tables]
+        for worker in workers:
+            worker.start()
+        try:
+            for batch in self._batches(urls, progress):
+                batches.put(batch)
+        finally:
+            for _ in workers:
+                batches.put(None)
+            for worker in workers:
+                worker.join()
+        self._remove_from_queue(self._issued_short_urls())
+        progress.report()
+        with self._lock:
+            removed, self._removed = self._removed, 0
+        return {
+            "imported": progress.done,
+            "failed": progress.failed,
+            "removed_from_queue": removed,
+            "seconds": progress.elapsed(),
+        }
+
+    def _work(self, table: AbstractDynamoDBUrlTable, batches: Queue, queued: set, progress: Progress) -> None:
+        while (batch := batches.get()) is not None:
+            try:
+                table.add_urls(batch)
+            except Exception:
+                self.logger.opt(exception=True).error(
+                    "Error while importing {} urls, from '{}'", len(batch), batch[0].short_url
+                )
+                progress.add(0, failed=len(batch))
+                continue
+            progress.add(len(batch))
+            try:
+                self._after_import(batch, queued)
+            except Exception:
+                # short urls left on the queue are still removed by the final check
+                self.logger.opt(exception=True).error(
+                    "Error while updating the queue, bloom filter or cache for {} imported urls", len(batch)
+                )
+
+    def _after_import(self, batch: List[Url], queued: set) -> None:
+        short_urls = [url.short_url for url in batch]
+        self._remove_from_queue([short_url for short_url in short_urls if short_url in queued])
+        if self.bloom_filter is not None:
+            self.bloom_filter.add_many(short_urls)
+        if self.cache is not None:
+            self.cache.add_many([Url(short_url=url.short_url, long_url=encode_long_url(url)) for url in batch])
+
+    def _issued_short_urls(self) -> List[str]:
+        """Returns the short urls on the queue which are already on the table."""
+        if self.queue is None:
+            return []
+        urls = self.tables[0].batch_get_urls(self.queue.peek_short_url_keys(), projection="short_url")
+        return [url["short_url"] for url in urls]
+
+    def _remove_from_queue(self, short_urls: List[str]) -> None:
+        if not short_urls:
+            return
+        removed = self.queue.remove_short_url_keys(short_urls)
+        with self._lock:
+            self._removed += removed
+        self.logger.info("Removed {} imported short urls from queue {}", removed, self.queue.queue_name)
+
+
+class UrlExporter:
+    """
+    Reads every url on the table with a parallel segmented Scan.
+
+    The table is split into a segment per worker (each with a table of its own),
+    and urls are handed to the writer a page at a time.
+    """
+
+    def __init__(
+        self,
+        tables: List[AbstractDynamoDBUrlTable],
+        page_size: int = 1000,
+        progress_interval: float = 5,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes an UrlExporter object.
+
+        :param tables: a table per segment, the segments are scanned concurrently.
+        :param page_size: how many urls are handed to the writer at once, e.g.: 1000
+        :param progress_interval: seconds between progress logs, e.g.: 5
+        """
+        self.tables = tables
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.logger = logger
+
+    def run(self, write: Callable[[List[Dict[str, str]]], None]) -> Dict[str, float]:
+        """
+        Exports every url on the table.
+
+        :param write: called with each page of urls, from several threads (e.g.: UrlWriter.write)
+        :return report: how many urls were exported, how many segments failed and the seconds taken
+        """
+        progress = Progress("Exported", self.progress_interval, self.logger)
+        workers = [
+            Thread(target=self._scan, args=(table, segment, write, progress))
+            for segment, table in enumerate(self.tables)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        progress.report()
+        return {"exported": progress.done, "failed_segments": progress.failed, "seconds": progress.elapsed()}
+
+    def _scan(self, table: AbstractDynamoDBUrlTable, segment: int, write: Callable, progress: Progress) -> None:
+        urls = table.scan_urls(segment=segment, total_segments=len(self.tables))
+        try:
+            while page := list(islice(urls, self.page_size)):
+                write(page)
+                progress.add(len(page))
+        except Exception:
+            self.logger.opt(exception=True).error("Error while exporting segment {} of the table", segment)
+            progress.add(0, failed=1)
@@ -0,0 +1,104 @@
+import asyncio
+from time import monotonic, sleep
+from typing import List
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.dynamodb_adapter import AbstractDynamoDBUrlTable
+from shortame.adapters.redis_adapter import AbstractCacheQueue, HotKeyTracker
+from shortame.domain.model import Url, encode_long_url, url_from_item
+
+
+class CacheWarmer:
+    """
+    Loads the most requested short urls from the table into the cache.
+
+    Meant to run after a Redis restart or a deploy, so the hottest short urls don't
+    all fall through to the table at once. Urls are fetched with BatchGetItem and
+    cached with pipelined SETs, batch by batch, at most rate_limit urls per second.
+    """
+
+    def __init__(
+        self,
+        tracker: HotKeyTracker,
+        table: AbstractDynamoDBUrlTable,
+        cache: AbstractCacheQueue,
+        batch_size: int = 100,
+        rate_limit: float = 1000,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a CacheWarmer object.
+
+        :param tracker: where the most requested short urls are kept.
+        :param batch_size: how many urls are fetched and cached at once, up to 100
+        :param rate_limit: how many urls are loaded per second at most, e.g.: 1000
+        """
+        self.tracker = tracker
+        self.table = table
+        self.cache = cache
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.logger = logger
+
+    def warm_up(self, count: int, lock_ttl: float = 0) -> int:
+        """
+        Loads up to count of the most requested short urls into the cache.
+
+        :param lock_ttl: if set, only the first worker to call it within lock_ttl
+            seconds warms the cache up, the others return right away.
+        :return warmed: how many urls were cached
+        """
+        if lock_ttl and not self.tracker.acquire_warm_up_lock(lock_ttl):
+            return 0
+        short_urls = self.tracker.top(count)
+        warmed = 0
+        for start in range(0, len(short_urls), self.batch_size):
+            started = monotonic()
+            warmed += self._warm_up_batch(short_urls[start : start + self.batch_size])
+            sleep(self._pause(self.batch_size, started))
+        self.logger.info("Warmed the cache up with {} of {} hot short urls", warmed, len(short_urls))
+        return warmed
+
+    def _warm_up_batch(self, short_urls: List[str]) -> int:
+        urls = self._to_urls(self.table.batch_get_urls(short_urls))
+        if urls:
+            self.cache.add_many(urls)
+        return len(urls)
+
+    def _to_urls(self, items) -> List[Url]:
+        return [Url(short_url=item["short_url"], long_url=encode_long_url(url_from_item(item))) for item in items]
+
+    def _pause(self, batch_size: int, started: float) -> float:
+        return max(0.0, batch_size / self.rate_limit - (monotonic() - started))
+
+
+class AsyncCacheWarmer(CacheWarmer):
+    """Non-blocking version of CacheWarmer, meant to run on a task alongside the app"""
+
+    async def warm_up(self, count: int, lock_ttl: float = 0) -> int:
+        if lock_ttl and not await self.tracker.acquire_warm_up_lock(lock_ttl):
+            return 0
+        short_urls = await self.tracker.top(count)
+        warmed = 0
+        for start in range(0, len(short_urls), self.batch_size):
+            started = monotonic()
+            warmed += await self._warm_up_batch(short_urls[start : start + self.batch_size])
+            await asyncio.sleep(self._pause(self.batch_size, started))
+        self.logger.info("Warmed the cache up with {} of {} hot short urls", warmed, len(short_urls))
+        return warmed
+
+    async def warm_up_quietly(self, count: int, lock_ttl: float = 0) -> int:
+        """Same as warm_up, but logs errors instead of raising them, for background tasks."""
+        try:
+            return await self.warm_up(count, lock_ttl=lock_ttl)
+        except Exception:
+            self.logger.opt(exception=True).error("Error while warming the cache up")
+            return 0
+
+    async def _warm_up_batch(self, short_urls: List[str]) -> int:
+        urls = self._to_urls(await self.table.batch_get_urls(short_urls))
+        if urls:
+            await self.cache.add_many(urls)
+        return len(urls)
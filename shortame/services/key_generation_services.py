@@ -1,13 +1,25 @@
+import asyncio
 from abc import ABC, abstractmethod, abstractstaticmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b
 from secrets import choice
 from string import ascii_letters, digits
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, List
 
 from loguru import logger
 from loguru._logger import Logger
 
+from shortame.adapters.bloom_filter_adapter import AbstractBloomFilter
 from shortame.adapters.dynamodb_adapter import (AbstractDynamoDBUrlTable,
                                                 ShortUrlNotFoundOnTable, UrlTable)
-from shortame.adapters.redis_adapter import AbstractUrlQueue, ShortUrlQueue
+from shortame.adapters.redis_adapter import (AbstractUrlQueue, EmptyQueueException,
+                                             GeneratorLease, IdRangeCounter,
+                                             ShortUrlQueue)
+
+BASE62_ALPHABET = ascii_letters + digits
 
 
 class AbstractShortUrlGenerator(ABC):
@@ -17,6 +29,10 @@ class AbstractShortUrlGenerator(ABC):
     def generate_and_enque():
         pass
 
+    @abstractmethod
+    def generate_and_enqueue_batch(self):
+        pass
+
     @abstractmethod
     def exists_in_table(self):
         pass
@@ -29,11 +45,23 @@ class AbstractShortUrlGenerator(ABC):
 class ShortUrlGenerator(AbstractShortUrlGenerator):
     """Encapsulates the logic for creating and enqueing short urls"""
 
-    def __init__(self, queue: AbstractUrlQueue, table: AbstractDynamoDBUrlTable, short_url_size: int = 7, logger: Logger = logger):
+    def __init__(
+        self,
+        queue: AbstractUrlQueue,
+        table: AbstractDynamoDBUrlTable,
+        short_url_size: int = 7,
+        logger: Logger = logger,
+        bloom_filter: AbstractBloomFilter | None = None,
+    ):
+        """
+        :param bloom_filter: optional filter of every issued short url, candidates it has
+            never seen are known to be free without reading the table.
+        """
         self.queue = queue
         self.table = table
         self.short_url_size = short_url_size
         self.logger = logger
+        self.bloom_filter = bloom_filter
 
     def generate_and_enque(self, short_url: str = '') -> bool:
         """
@@ -42,7 +70,7 @@ class ShortUrlGenerator(AbstractShortUrlGenerator):
         :param short_url: if empty, a new short_url will be generated
         :param size: the size of the short url to be generated
         """
-        self.logger.info(f"Generating a new short url with size {self.short_url_size}")
+        self.logger.debug("Generating a new short url with size {}", self.short_url_size)
         if not short_url:
             short_url = self.generate(size=self.short_url_size)
         if not self.exists_in_table(short_url=short_url):
@@ -50,6 +78,34 @@ class ShortUrlGenerator(AbstractShortUrlGenerator):
             return True
         return False
 
+    def generate_and_enqueue_batch(self, size: int) -> int:
+        """
+        Generate a batch of new short urls and enqueue the ones not present in the database.
+
+        Candidates are checked with BatchGetItem and the survivors are pushed with a
+        single LPUSH, so a whole batch costs a handful of round-trips instead of two per key.
+
+        :param size: how many candidates to generate, e.g.: 500
+        :return enqueued: how many short urls were actually enqueued
+        """
+        self.logger.info("Generating a batch of {} short urls with size {}", size, self.short_url_size)
+        candidates = {self.generate(size=self.short_url_size) for _ in range(size)}
+        to_check = candidates
+        if self.bloom_filter is not None:
+            to_check = [
+                short_url
+                for short_url, seen in zip(candidates, self.bloom_filter.might_contain_many(candidates))
+                if seen
+            ]
+        taken = {
+            url["short_url"]
+            for url in self.table.batch_get_urls(to_check, projection="short_url")
+        }
+        survivors = [short_url for short_url in candidates if short_url not in taken]
+        self.queue.enqueue_short_url_keys(short_urls=survivors)
+        self.logger.info("Enqueued {} short urls, {} were already taken", len(survivors), len(taken))
+        return len(survivors)
+
     def exists_in_table(self, short_url: str) -> bool:
         """
         Verifies is a given short url is not present in the database
@@ -57,18 +113,19 @@ class ShortUrlGenerator(AbstractShortUrlGenerator):
         :param short_url: the short url to be verified, e.g.: xyz1234
         :return exists: states if the short url is present or not
         """
-        self.logger.info(
-            f"Verifying the existence of key {short_url} on table {self.table.table_name}"
-        )
+        self.logger.debug("Verifying the existence of key {} on table {}", short_url, self.table.table_name)
+        if self.bloom_filter is not None and not self.bloom_filter.might_contain(short_url):
+            self.logger.debug("Short url '{}' was never issued, good to go", short_url)
+            return False
         try:
             self.table.get_url(short_url=short_url)
         except ShortUrlNotFoundOnTable:
-            self.logger.info(f"Short url '{short_url}' is good to go")
+            self.logger.debug("Short url '{}' is good to go", short_url)
             return False
         except Exception as e:
             raise e
         else:
-            self.logger.info(f"Short url '{short_url}' is already taken")
+            self.logger.debug("Short url '{}' is already taken", short_url)
             return True
 
     @staticmethod
@@ -80,5 +137,281 @@ class ShortUrlGenerator(AbstractShortUrlGenerator):
         :return short_url: the new url, e.g.: xyz1234
 
         """
-        short_url = "".join((choice(ascii_letters + digits) for i in range(size)))
+        short_url = "".join((choice(BASE62_ALPHABET) for i in range(size)))
         return short_url
+
+
+class KeyGeneratorService:
+    """
+    Keeps the short url queue between a low and a high watermark.
+
+    Once the queue goes down to the low watermark it's refilled up to the high one by
+    concurrent workers, each with its own generator. Between refills the service
+    blocks until the app signals low stock (or idle_timeout elapses). Only the replica
+    holding the lease produces keys, the others stand by.
+    """
+
+    def __init__(
+        self,
+        generators: List[ShortUrlGenerator],
+        lease: GeneratorLease,
+        low_watermark: int = 1000,
+        high_watermark: int = 5000,
+        batch_size: int = 500,
+        idle_timeout: float = 5,
+        logger: Logger = logger,
+    ):
+        """
+        :param generators: one generator per concurrent worker, sharing the same queue
+        :param lease: decides which replica is allowed to produce keys
+        :param low_watermark: queue size at or below which a refill starts, e.g.: 1000
+        :param high_watermark: queue size a refill aims for, e.g.: 5000
+        :param batch_size: how many keys a worker generates at once, e.g.: 500
+        :param idle_timeout: how many seconds to wait for a signal between checks, e.g.: 5
+        """
+        self.generators = generators
+        self.queue = generators[0].queue
+        self.lease = lease
+        self.low_watermark = low_watermark
+        self.high_watermark = high_watermark
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=len(generators))
+        self.queue_size = 0
+        self.generated = 0
+        self.refills = 0
+        self.refill_rate = 0.0
+
+    def run(self) -> None:
+        while True:
+            if not self.lease.acquire():
+                self.logger.info("Lease is held by another replica, standing by for {}s", self.idle_timeout)
+                sleep(self.idle_timeout)
+                continue
+            if self.refill() == 0:
+                self.queue.wait_for_low_stock(timeout=self.idle_timeout)
+
+    def refill(self) -> int:
+        """
+        Refills the queue up to the high watermark if it's at or below the low one.
+
+        :return enqueued: how many short urls were enqueued
+        """
+        self.queue_size = self.queue.current_size()
+        if self.queue_size > self.low_watermark:
+            self.publish_stats()
+            return 0
+        deficit = self.high_watermark - self.queue_size
+        workers = len(self.generators)
+        shares = [deficit // workers + (1 if i < deficit % workers else 0) for i in range(workers)]
+        self.logger.info("Queue size is {}, generating {} short urls", self.queue_size, deficit)
+        start = monotonic()
+        enqueued = sum(self.executor.map(self._produce, self.generators, shares))
+        self.refill_rate = enqueued / max(monotonic() - start, 1e-6)
+        self.generated += enqueued
+        self.refills += 1
+        self.queue_size += enqueued
+        self.publish_stats()
+        self.logger.info("Enqueued {} short urls at {:.0f} keys/s", enqueued, self.refill_rate)
+        return enqueued
+
+    def _produce(self, generator: ShortUrlGenerator, count: int) -> int:
+        enqueued = 0
+        while count > 0:
+            size = min(count, self.batch_size)
+            enqueued += generator.generate_and_enqueue_batch(size=size)
+            count -= size
+        return enqueued
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queue_size": self.queue_size,
+            "generated_total": self.generated,
+            "refills_total": self.refills,
+            "refill_rate": self.refill_rate,
+            "workers": len(self.generators),
+        }
+
+    def publish_stats(self) -> None:
+        try:
+            self.queue.publish_stats(self.stats())
+        except Exception:
+            self.logger.opt(exception=True).error("Error while publishing the key generator stats")
+
+
+class FeistelKeyPermutation:
+    """
+    Keyed bijection between the ids [0, 62**size) and short urls of the given size.
+
+    Ids are shuffled with a balanced Feistel network (keyed with blake2b) plus cycle
+    walking to stay within the domain, then encoded in base62. Consecutive ids give
+    unrelated short urls, and distinct ids always give distinct short urls.
+    """
+
+    def __init__(self, secret: str, size: int = 7, rounds: int = 4):
+        """
+        :param secret: the permutation key, whoever knows it can predict short urls
+        :param size: the size of the short urls, e.g.: 7
+        :param rounds: how many Feistel rounds are applied, at least 4 is recommended
+        :raises ValueError: if the secret is empty.
+        """
+        if not secret:
+            raise ValueError("The key permutation secret must not be empty, short urls would be predictable")
+        self.secret = blake2b(secret.encode("utf-8"), digest_size=32).digest()
+        self.size = size
+        self.rounds = rounds
+        self.domain_size = len(BASE62_ALPHABET) ** size
+        self.half_bits = ((self.domain_size - 1).bit_length() + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+
+    def _round(self, index: int, half: int) -> int:
+        digest = blake2b(
+            half.to_bytes(8, "little") + bytes([index]), key=self.secret, digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "little") & self.half_mask
+
+    def _encrypt(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.half_mask
+        for index in range(self.rounds):
+            left, right = right, left ^ self._round(index, right)
+        return (left << self.half_bits) | right
+
+    def permute(self, key_id: int) -> int:
+        if not 0 <= key_id < self.domain_size:
+            raise ValueError(f"Id {key_id} is out of the key space of size {self.size}")
+        permuted = self._encrypt(key_id)
+        while permuted >= self.domain_size:
+            permuted = self._encrypt(permuted)
+        return permuted
+
+    def encode(self, key_id: int) -> str:
+        """
+        Maps an id to its short url.
+
+        :param key_id: the id to be mapped, e.g.: 42
+        :return short_url: the short url, e.g.: xyz1234
+        """
+        value = self.permute(key_id)
+        chars = []
+        for _ in range(self.size):
+            value, remainder = divmod(value, len(BASE62_ALPHABET))
+            chars.append(BASE62_ALPHABET[remainder])
+        return "".join(reversed(chars))
+
+
+class LeasedRangeKeyQueue(AbstractUrlQueue):
+    """
+    Key strategy alternative to the ShortUrlQueue filled by the key generator.
+
+    Each worker leases a range of ids from a Redis counter and maps them to short urls
+    through a FeistelKeyPermutation, so keys are unique without any key generator
+    process. The url table writes are unconditional, so on a table already holding
+    short urls of the random strategy with the same size, a leased key could overwrite
+    one of them: given the table, the keys of each lease are checked against it (one
+    BatchGetItem per 100 keys) and the ones already there are skipped.
+    """
+
+    def __init__(
+        self,
+        counter: IdRangeCounter,
+        permutation: FeistelKeyPermutation,
+        lease_size: int = 1000,
+        table: AbstractDynamoDBUrlTable | None = None,
+        logger: Logger = logger,
+    ):
+        """
+        :param counter: where the id ranges are leased from.
+        :param permutation: maps the leased ids to short urls.
+        :param lease_size: how many ids are leased at once, e.g.: 1000
+        :param table: the url table leased keys are checked against, None to not check them
+            (only sound on a table never written by the random strategy).
+        """
+        self.counter = counter
+        self.permutation = permutation
+        self.lease_size = lease_size
+        self.table = table
+        self.logger = logger
+        self.queue_name = counter.counter_name
+        self._keys = deque()
+        self._returned: List[str] = []
+        self._lock = Lock()
+
+    def _take_key(self) -> str | None:
+        with self._lock:
+            return self._keys.popleft() if self._keys else None
+
+    def _encode_lease(self, start: int, end: int) -> List[str]:
+        if end > self.permutation.domain_size:
+            raise EmptyQueueException(f"The key space of counter {self.queue_name} is exhausted")
+        return [self.permutation.encode(key_id) for key_id in range(start, end)]
+
+    def _use_keys(self, keys: List[str], existing: List[Dict[str, str]]) -> None:
+        """Keeps the leased keys, but the ones already on the table."""
+        taken = {url["short_url"] for url in existing}
+        if taken:
+            self.logger.warning("Skipping {} leased short urls already on the url table", len(taken))
+        with self._lock:
+            self._keys.extend(key for key in keys if key not in taken)
+
+    def deque_short_url_key(self) -> str:
+        if self._returned:
+            return self._returned.pop()
+        key = self._take_key()
+        while key is None:
+            keys = self._encode_lease(*self.counter.lease(self.lease_size))
+            existing = self.table.batch_get_urls(keys, projection="short_url") if self.table is not None else []
+            self._use_keys(keys, existing)
+            key = self._take_key()
+        return key
+
+    def deque_short_url_keys(self, count: int) -> List[str]:
+        return [self.deque_short_url_key() for _ in range(count)]
+
+    def enqueue_short_url_key(self, short_url: str) -> int:
+        """Keeps a short url given back, it's handed out again before new ids."""
+        self._returned.append(short_url)
+        return self.current_size()
+
+    def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        self._returned.extend(short_urls)
+        return self.current_size()
+
+    def current_size(self) -> int:
+        """Returns how many short urls are left on the current lease."""
+        return len(self._returned) + len(self._keys)
+
+
+class AsyncLeasedRangeKeyQueue(LeasedRangeKeyQueue):
+    """Non-blocking version of LeasedRangeKeyQueue, to use with an AsyncIdRangeCounter and an async table"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lease_lock = asyncio.Lock()
+
+    async def deque_short_url_key(self) -> str:
+        if self._returned:
+            return self._returned.pop()
+        key = self._take_key()
+        while key is None:
+            async with self._lease_lock:
+                if not self._keys:
+                    keys = self._encode_lease(*await self.counter.lease(self.lease_size))
+                    existing = []
+                    if self.table is not None:
+                        existing = await self.table.batch_get_urls(keys, projection="short_url")
+                    self._use_keys(keys, existing)
+            key = self._take_key()
+        return key
+
+    async def deque_short_url_keys(self, count: int) -> List[str]:
+        return [await self.deque_short_url_key() for _ in range(count)]
+
+    async def enqueue_short_url_key(self, short_url: str) -> int:
+        return super().enqueue_short_url_key(short_url)
+
+    async def enqueue_short_url_keys(self, short_urls: List[str]) -> int:
+        return super().enqueue_short_url_keys(short_urls)
+
+    async def current_size(self) -> int:
+        return super().current_size()
@@ -0,0 +1,375 @@
+import asyncio
+import inspect
+import json
+import os
+from bisect import bisect_left
+from functools import partial, wraps
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Tuple
+
+from botocore.exceptions import ClientError
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.redis_adapter import ShortUrlMarkedAsMissing, ShortUrlNotFoundOnCache
+
+# upper bounds in seconds, from a local cache hit up to a slow DynamoDB call
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+THROTTLING_ERRORS = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    """
+    Monotonic counter.
+
+    Increments take no lock: under heavy thread contention a few updates may be
+    lost, which is fine for metrics and keeps recording cheap on the hot path.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down, e.g.: the key queue depth."""
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """Histogram with fixed buckets, recording is a bisect plus two increments."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last slot counts the observations above the highest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[int]:
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class MetricsRegistry:
+    """
+    Keeps every metric by name and labels and renders them in the Prometheus text format.
+
+    The registry is per process: with several workers (WEB_CONCURRENCY) each scrape
+    would only see the metrics of the worker answering it, see MultiProcessRegistry.
+    """
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, Dict[Labels, Any]]] = {}
+
+    def counter(self, name: str, documentation: str, **labels: str) -> Counter:
+        return self._get(name, "counter", documentation, labels, Counter)
+
+    def gauge(self, name: str, documentation: str, **labels: str) -> Gauge:
+        return self._get(name, "gauge", documentation, labels, Gauge)
+
+    def histogram(self, name: str, documentation: str, **labels: str) -> Histogram:
+        return self._get(name, "histogram", documentation, labels, Histogram)
+
+    def _get(self, name: str, kind: str, documentation: str, labels: Dict[str, str], factory: Callable) -> Any:
+        family = self._families.setdefault(name, (kind, documentation, {}))
+        if family[0] != kind:
+            raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+        key = tuple(sorted(labels.items()))
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = factory()
+        return metric
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns every metric as plain data (JSON serializable), to be merged by another process."""
+        return {
+            name: [
+                kind,
+                documentation,
+                [[list(labels), _value(kind, metric)] for labels, metric in list(metrics.items())],
+            ]
+            for name, (kind, documentation, metrics) in list(self._families.items())
+        }
+
+    def merge(self, snapshot: Dict[str, Any], worker: str | None = None) -> None:
+        """
+        Adds the counters and histograms of a snapshot to this registry, and copies its gauges.
+
+        :param worker: labels the gauges of the snapshot (which can't be summed), they're left out if None.
+        """
+        for name, (kind, documentation, metrics) in snapshot.items():
+            for labels, value in metrics:
+                labels = dict(labels)
+                if kind == "gauge":
+                    if worker is not None:
+                        self.gauge(name, documentation, worker=worker, **labels).set(value)
+                elif kind == "counter":
+                    self.counter(name, documentation, **labels).inc(value)
+                else:
+                    buckets, counts, total = value
+                    histogram = self._get(name, kind, documentation, labels, partial(Histogram, tuple(buckets)))
+                    histogram.counts = [count + other for count, other in zip(histogram.counts, counts)]
+                    histogram.sum += total
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, documentation, metrics) in sorted(self._families.items()):
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in list(metrics.items()):
+                if kind == "histogram":
+                    bounds = [str(bound) for bound in metric.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, metric.cumulative_counts()):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {sum(metric.counts)}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _value(kind: str, metric: Any) -> Any:
+    if kind == "histogram":
+        return [list(metric.buckets), list(metric.counts), metric.sum]
+    return metric.value
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = MetricsRegistry()
+
+
+class MultiProcessRegistry:
+    """
+    Renders the metrics of every worker of a host, whichever worker answers the scrape.
+
+    Each worker writes a snapshot of its registry to a file of the directory, named by
+    its pid, every interval seconds (see run) and when scraped. A scrape renders the
+    sum of the counters and histograms of every file, including the ones of workers
+    gone so that totals never go backwards, and the gauges of the live workers with a
+    worker label. The other workers' metrics are up to interval seconds old. The
+    directory must be emptied before the workers start (e.g.: on /dev/shm, a new
+    container starts with it empty).
+    """
+
+    def __init__(self, directory: str, registry: MetricsRegistry = registry, logger: Logger = logger):
+        """
+        Initializes a MultiProcessRegistry object.
+
+        :param directory: where the workers write their snapshots, shared by all of them.
+        :param registry: the registry of this worker.
+        """
+        self.directory = directory
+        self.registry = registry
+        self.logger = logger
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self) -> None:
+        """Writes the snapshot of this worker, atomically."""
+        pid = os.getpid()
+        temporary = os.path.join(self.directory, f".{pid}.json.tmp")
+        with open(temporary, "w") as snapshot:
+            json.dump(self.registry.snapshot(), snapshot)
+        os.replace(temporary, os.path.join(self.directory, f"{pid}.json"))
+
+    def _snapshots(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for name in os.listdir(self.directory):
+            if name.startswith(".") or not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as snapshot:
+                    yield int(name.removesuffix(".json")), json.load(snapshot)
+            except (OSError, ValueError):
+                # removed meanwhile, or not a snapshot
+                continue
+
+    def render(self) -> str:
+        """Renders the metrics of every worker in the Prometheus text format."""
+        self.write()
+        merged = MetricsRegistry()
+        for pid, snapshot in self._snapshots():
+            merged.merge(snapshot, worker=str(pid) if _is_alive(pid) else None)
+        return merged.render()
+
+    async def run(self, interval: float, update: Callable[[], Awaitable[None]] | None = None) -> None:
+        """
+        Writes the snapshot of this worker every interval seconds until cancelled, then one last time.
+
+        :param interval: seconds between writes, e.g.: 5
+        :param update: sets the gauges of this worker before each write.
+        """
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    if update is not None:
+                        await update()
+                    self.write()
+                except Exception:
+                    self.logger.opt(exception=True).error("Error while writing the metrics of worker {}", os.getpid())
+        finally:
+            self.write()
+
+
+class Instrumented:
+    """
+    Proxy recording the latency and errors of every public method of the wrapped object.
+
+    Works for both sync and async objects, attributes that aren't methods are read
+    straight from the wrapped object. The wrapper of each method is built on first
+    use and then cached on the proxy, so later calls skip the attribute lookup.
+    """
+
+    def __init__(self, target: Any, component: str, registry: MetricsRegistry = registry):
+        """
+        Initializes an Instrumented proxy.
+
+        :param target: the adapter or service to instrument, e.g.: a CacheQueue
+        :param component: how the target is labelled on the metrics, e.g.: "cache"
+        """
+        self._target = target
+        self._component = component
+        self._registry = registry
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._target, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+        wrapped = self._wrap(name, attribute)
+        setattr(self, name, wrapped)
+        return wrapped
+
+    def _wrap(self, operation: str, method: Callable) -> Callable:
+        duration = self._registry.histogram(
+            "shortame_operation_duration_seconds",
+            "Latency of adapter and service operations",
+            component=self._component,
+            operation=operation,
+        )
+
+        if inspect.iscoroutinefunction(method):
+
+            @wraps(method)
+            async def timed(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    result = await method(*args, **kwargs)
+                except Exception as e:
+                    self._on_error(operation, e)
+                    raise e
+                finally:
+                    duration.observe(perf_counter() - start)
+                self._on_result(operation, result)
+                return result
+
+        else:
+
+            @wraps(method)
+            def timed(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    result = method(*args, **kwargs)
+                except Exception as e:
+                    self._on_error(operation, e)
+                    raise e
+                finally:
+                    duration.observe(perf_counter() - start)
+                self._on_result(operation, result)
+                return result
+
+        return timed
+
+    def _on_result(self, operation: str, result: Any) -> None:
+        pass
+
+    def _on_error(self, operation: str, error: Exception) -> None:
+        if isinstance(error, ClientError):
+            error_name = error.response.get("Error", {}).get("Code", "ClientError")
+        else:
+            error_name = type(error).__name__
+        self._registry.counter(
+            "shortame_operation_errors_total",
+            "Errors raised by adapter and service operations",
+            component=self._component,
+            operation=operation,
+            error=error_name,
+        ).inc()
+        if error_name in THROTTLING_ERRORS:
+            self._registry.counter(
+                "shortame_dynamodb_throttles_total",
+                "Requests throttled by DynamoDB",
+                component=self._component,
+            ).inc()
+
+
+class InstrumentedCache(Instrumented):
+    """Instrumented proxy for CacheQueue and LocalCacheQueue, also counting hits and misses."""
+
+    def __init__(self, target: Any, component: str, registry: MetricsRegistry = registry):
+        super().__init__(target=target, component=component, registry=registry)
+        self._results = {
+            result: registry.counter(
+                "shortame_cache_requests_total",
+                "Cache lookups by result",
+                cache=component,
+                result=result,
+            )
+            for result in ("hit", "miss", "negative_hit")
+        }
+
+    def _on_result(self, operation: str, result: Any) -> None:
+        if operation == "get":
+            self._results["hit"].inc()
+
+    def _on_error(self, operation: str, error: Exception) -> None:
+        if operation == "get" and isinstance(error, ShortUrlMarkedAsMissing):
+            self._results["negative_hit"].inc()
+        elif operation == "get" and isinstance(error, ShortUrlNotFoundOnCache):
+            self._results["miss"].inc()
+        else:
+            super()._on_error(operation, error)
+
+
+class InstrumentedUrlShortener(Instrumented):
+    """Instrumented proxy for UrlShortener, also counting the shortened urls."""
+
+    def __init__(self, target: Any, component: str = "url_shortener", registry: MetricsRegistry = registry):
+        super().__init__(target=target, component=component, registry=registry)
+        self._shortened = registry.counter("shortame_shortened_urls_total", "Long urls shortened")
+
+    def _on_result(self, operation: str, result: Any) -> None:
+        if operation == "shorten_and_persist":
+            self._shortened.inc()
+        elif operation == "shorten_many":
+            self._shortened.inc(len(result))
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from email.utils import formatdate
+from functools import lru_cache
+from time import time
+from typing import List, Tuple
+from urllib.parse import quote
+
+from starlette.responses import Response
+
+from shortame.domain.model import MAX_CACHE_MAX_AGE, REDIRECT_STATUSES, RedirectUrl, Url
+
+# the characters Starlette's RedirectResponse leaves unquoted on the location
+LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;"
+PERMANENT_STATUSES = (301, 308)
+# max ages come from the users (overrides), only the most used ones keep their Expires formatted
+EXPIRES_CACHE_SIZE = 64
+
+
+class PreEncodedResponse(Response):
+    """Response sent with headers already encoded, skipping Starlette's header building."""
+
+    def __init__(self, status_code: int, raw_headers: List[Tuple[bytes, bytes]]):
+        self.status_code = status_code
+        self.raw_headers = raw_headers
+        self.body = b""
+        self.background = None
+
+
+class RedirectPolicy:
+    """
+    Builds the redirect of an url, with the default status and cache max age of the app
+    unless the url overrides them.
+
+    Redirects with a max age are cacheable (Cache-Control and Expires), so browsers and
+    CDNs may follow them without asking again: they never reach the app, and aren't
+    counted by the click analytics. Permanent redirects without one get 'no-store', as
+    browsers cache 301 and 308 indefinitely otherwise. The headers of the most requested
+    urls are kept encoded, only Expires is formatted again (once a second per max age).
+    """
+
+    def __init__(self, status: int = 307, cache_max_age: int = 0, max_size: int = 10000):
+        """
+        Initializes a RedirectPolicy object.
+
+        :param status: the default redirect status, one of 301, 302, 307 or 308
+        :param cache_max_age: how many seconds redirects may be cached by default, 0 to not cache them
+        :param max_size: how many urls have their headers kept encoded, e.g.: 10000
+        """
+        if status not in REDIRECT_STATUSES:
+            raise ValueError(f"Redirect status must be one of {REDIRECT_STATUSES}, not {status}")
+        if not 0 <= cache_max_age <= MAX_CACHE_MAX_AGE:
+            raise ValueError(f"Cache max age must be between 0 and {MAX_CACHE_MAX_AGE}, not {cache_max_age}")
+        self.status = status
+        self.cache_max_age = cache_max_age
+        self._headers = lru_cache(maxsize=max_size)(self._encode_headers)
+        self._expires: OrderedDict[int, Tuple[int, Tuple[bytes, bytes]]] = OrderedDict()
+
+    def _encode_headers(self, long_url: str, status: int, cache_max_age: int) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (b"location", quote(long_url, safe=LOCATION_SAFE).encode("latin-1")),
+            (b"content-length", b"0"),
+        ]
+        if cache_max_age > 0:
+            headers.append((b"cache-control", f"public, max-age={cache_max_age}".encode("latin-1")))
+        elif status in PERMANENT_STATUSES:
+            headers.append((b"cache-control", b"no-store"))
+        return headers
+
+    def _expires_header(self, cache_max_age: int) -> Tuple[bytes, bytes]:
+        now = int(time())
+        expires = self._expires.get(cache_max_age)
+        if expires is None or expires[0] != now:
+            expires = self._expires[cache_max_age] = (
+                now,
+                (b"expires", formatdate(now + cache_max_age, usegmt=True).encode("latin-1")),
+            )
+            if len(self._expires) > EXPIRES_CACHE_SIZE:
+                self._expires.popitem(last=False)
+        self._expires.move_to_end(cache_max_age)
+        return expires[1]
+
+    def response(self, url: Url) -> Response:
+        """Returns the redirect to the long url, with the overrides of the url if it's a RedirectUrl."""
+        status, cache_max_age = self.status, self.cache_max_age
+        if isinstance(url, RedirectUrl):
+            status = url.redirect_status if url.redirect_status is not None else status
+            cache_max_age = url.cache_max_age if url.cache_max_age is not None else cache_max_age
+        # urls stored or imported before max ages were bounded may still exceed it
+        cache_max_age = min(cache_max_age, MAX_CACHE_MAX_AGE)
+        # a copy, middlewares (e.g.: CORS) append to the headers of the response
+        headers = list(self._headers(url.long_url, status, cache_max_age))
+        if cache_max_age > 0:
+            headers.append(self._expires_header(cache_max_age))
+        return PreEncodedResponse(status, headers)
@@ -0,0 +1,78 @@
+import asyncio
+from threading import Event, Lock
+from typing import Any, Awaitable, Callable, Dict
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing the same key into a single execution.
+
+    The first caller (the leader) runs the function, every caller arriving while
+    it is in flight waits for it and gets the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, func: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise e
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight.
+
+    The shared call runs as its own task, so a cancelled caller (e.g.: a client
+    that went away) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # mark the exception as retrieved even when every caller went away
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
@@ -1,15 +1,27 @@
+import asyncio
 from abc import ABC, abstractmethod
+from time import monotonic, sleep
+from typing import List
 
 from loguru import logger
 from loguru._logger import Logger
 
+from shortame.adapters.bloom_filter_adapter import AbstractBloomFilter
 from shortame.adapters.dynamodb_adapter import (AbstractDynamoDBUrlTable,
+                                                LongUrlIndexTable,
+                                                LongUrlNotFoundOnIndex,
+                                                ShortUrlNotFoundOnTable,
                                                 UrlTable)
 from shortame.adapters.redis_adapter import (AbstractCacheQueue,
                                              AbstractUrlQueue, CacheQueue,
+                                             HotKeyTracker, LongUrlIndexCache,
+                                             PendingUrlStream,
+                                             ShortUrlMarkedAsMissing,
                                              ShortUrlNotFoundOnCache,
                                              ShortUrlQueue)
-from shortame.domain.model import Url
+from shortame.domain.model import (RedirectUrl, Url, build_url, decode_long_url,
+                                   encode_long_url, url_from_item)
+from shortame.services.single_flight import AsyncSingleFlight, SingleFlight
 
 
 class AbstractUrlShortener(ABC):
@@ -17,6 +29,10 @@ class AbstractUrlShortener(ABC):
     def shorten_and_persist(self):
         pass
 
+    @abstractmethod
+    def shorten_many(self):
+        pass
+
     @abstractmethod
     def _fetch_new_short_url(self):
         pass
@@ -40,53 +56,500 @@ class UrlShortener(AbstractUrlShortener):
         table: AbstractDynamoDBUrlTable,
         cache: AbstractCacheQueue,
         logger: Logger = logger,
+        local_cache: AbstractCacheQueue | None = None,
+        bloom_filter: AbstractBloomFilter | None = None,
+        negative_caching: bool = False,
+        refill_lock_ttl: float = 0,
+        dedup_table: LongUrlIndexTable | None = None,
+        dedup_cache: LongUrlIndexCache | None = None,
+        hot_key_tracker: HotKeyTracker | None = None,
+        pending_urls: PendingUrlStream | None = None,
+        serve_stale: bool = False,
     ):
+        """
+        :param local_cache: optional in-process cache checked before the (remote) cache.
+        :param bloom_filter: optional filter of every issued short url, used to reject
+            unknown short urls before reading the table. It must already hold every key
+            present on the table when enabled.
+        :param negative_caching: if True, short urls not found on the table are
+            remembered as missing on the caches for a short while.
+        :param refill_lock_ttl: if set, only the process holding a Redis lock reads a
+            missing short url from the table, the others wait up to this many seconds
+            for it to show up on the cache.
+        :param dedup_table: optional index of short urls by long url, when given a long
+            url shortened again gets its existing short url back.
+        :param dedup_cache: optional cache in front of dedup_table.
+        :param hot_key_tracker: optional tracker of the most requested short urls,
+            fed by a sample of the redirects and used to warm the cache up.
+        :param pending_urls: optional stream of urls to be written on the table, when
+            given new urls are only written on Redis (write-behind) and a UrlFlusher
+            writes them on the table later. They're read from it until then.
+        :param serve_stale: if True, a short url whose cache or table read failed (e.g.:
+            the table timed out, or its circuit is open) is served from the local cache
+            even if it expired there, as long as it's kept (see its stale_ttl).
+
+        Concurrent misses for the same short url within a process always share a
+        single table read and cache refill.
+        """
         self.queue = queue
         self.table = table
         self.cache = cache
         self.logger = logger
+        self.local_cache = local_cache
+        self.bloom_filter = bloom_filter
+        self.negative_caching = negative_caching
+        self.refill_lock_ttl = refill_lock_ttl
+        self.refill_poll_interval = 0.02
+        self.single_flight = SingleFlight()
+        self.dedup_table = dedup_table
+        self.dedup_cache = dedup_cache
+        self.hot_key_tracker = hot_key_tracker
+        self.pending_urls = pending_urls
+        self.serve_stale = serve_stale
 
-    def shorten_and_persist(self, long_url: str) -> Url:
+    def shorten_and_persist(
+        self, long_url: str, redirect_status: int | None = None, cache_max_age: int | None = None
+    ) -> Url:
+        """
+        Shortens and persists a long url.
+
+        :param redirect_status: optional override of the redirect status of the app, e.g.: 308
+        :param cache_max_age: optional override of how many seconds the redirect may be cached
+        :return url: a RedirectUrl if there's any override, long urls are only deduplicated otherwise
+        """
+        overridden = redirect_status is not None or cache_max_age is not None
+        if self.dedup_table is not None and not overridden:
+            existing_url = self._find_existing_url(long_url)
+            if existing_url is not None:
+                return existing_url
         try:
             short_url = self._fetch_new_short_url()
-            url = Url(short_url=short_url, long_url=long_url)
+            url = build_url(short_url, long_url, redirect_status, cache_max_age)
+            self._add_on_bloom_filter(url)
             self._persist_on_table(url)
         except Exception as e:
-            self.logger.error(
-                "Error while shortening and persisting url", exc_info=True
-            )
+            self.logger.opt(exception=True).error("Error while shortening and persisting url")
             raise e
         else:
             self._add_on_cache(url)
+            self._add_on_dedup_index(url)
             return url
 
+    def shorten_many(
+        self, long_urls: List[str], redirect_status: int | None = None, cache_max_age: int | None = None
+    ) -> List[Url]:
+        """
+        Shortens and persists several long urls at once.
+
+        Short urls are reserved with a single RPOP, persisted with BatchWriteItem
+        and cached with a single pipeline. Long urls are not deduplicated here.
+
+        :param long_urls: the urls to be shortened, e.g.: [https://example.com]
+        :param redirect_status: optional override of the redirect status, for all of them
+        :param cache_max_age: optional override of the cache max age, for all of them
+        :return urls: the Url objects, in the same order as long_urls
+        """
+        if not long_urls:
+            return []
+        try:
+            short_urls = self.queue.deque_short_url_keys(len(long_urls))
+            urls = [
+                build_url(short_url, long_url, redirect_status, cache_max_age)
+                for short_url, long_url in zip(short_urls, long_urls)
+            ]
+            if self.bloom_filter is not None:
+                self.bloom_filter.add_many(short_urls)
+            self._persist_many_on_table(urls)
+        except Exception as e:
+            self.logger.opt(exception=True).error(
+                "Error while shortening and persisting {} urls", len(long_urls)
+            )
+            raise e
+        else:
+            self._add_many_on_cache(urls)
+            return urls
+
+    def _add_many_on_cache(self, urls: List[Url]) -> None:
+        urls = [self._cached(url) for url in urls]
+        if self.local_cache is not None:
+            self.local_cache.add_many(urls)
+        return self.cache.add_many(urls)
+
+    def _find_existing_url(self, long_url: str) -> Url | None:
+        short_url = None
+        if self.dedup_cache is not None:
+            short_url = self.dedup_cache.get_short_url(long_url)
+        if short_url is None:
+            try:
+                short_url = self.dedup_table.get_short_url(long_url)
+            except LongUrlNotFoundOnIndex:
+                return None
+            if self.dedup_cache is not None:
+                self.dedup_cache.add(Url(short_url=short_url, long_url=long_url))
+        self.logger.debug("Long url was already shortened to '{}'", short_url)
+        return Url(short_url=short_url, long_url=long_url)
+
+    def _add_on_dedup_index(self, url: Url) -> None:
+        if self.dedup_table is None or isinstance(url, RedirectUrl):
+            return
+        if self.dedup_table.add(url) and self.dedup_cache is not None:
+            self.dedup_cache.add(url)
+
+    def _cached(self, url: Url) -> Url:
+        """The url as kept on caches and the pending stream, its overrides folded into its long url."""
+        if not isinstance(url, RedirectUrl):
+            return url
+        return Url(short_url=url.short_url, long_url=encode_long_url(url))
+
     def _persist_on_table(self, url: Url) -> bool:
+        if self.pending_urls is not None:
+            return self.pending_urls.add(self._cached(url))
         return self.table.add_url(url)
 
+    def _persist_many_on_table(self, urls: List[Url]) -> bool:
+        if self.pending_urls is not None:
+            return self.pending_urls.add_many([self._cached(url) for url in urls])
+        return self.table.add_urls(urls)
+
+    def _get_from_pending(self, short_url: str) -> str | None:
+        if self.pending_urls is None:
+            return None
+        return self.pending_urls.get(short_url)
+
     def _fetch_new_short_url(self) -> str:
         return self.queue.deque_short_url_key()
 
     def _add_on_cache(self, url: Url) -> None:
+        url = self._cached(url)
+        self._add_on_local_cache(url)
         return self.cache.add(url)
 
+    def _add_on_bloom_filter(self, url: Url) -> None:
+        if self.bloom_filter is not None:
+            self.bloom_filter.add(url.short_url)
+
+    def _add_on_local_cache(self, url: Url) -> None:
+        if self.local_cache is not None:
+            self.local_cache.add(url)
+
+    def _add_missing_on_local_cache(self, short_url: str) -> None:
+        if self.negative_caching and self.local_cache is not None:
+            self.local_cache.add_missing(short_url)
+
+    def _get_stale_from_local_cache(self, short_url: str, error: Exception) -> str:
+        """Returns the stale long url of a short url, else raises the error which prevented reading it."""
+        if not self.serve_stale or self.local_cache is None:
+            raise error
+        try:
+            long_url = self.local_cache.get_stale(short_url)
+        except ShortUrlNotFoundOnCache:
+            raise error
+        self.logger.warning("Serving a stale long url for '{}', it couldn't be read: {}", short_url, error)
+        return long_url
+
+    def _get_from_local_cache(self, short_url: str) -> str:
+        if self.local_cache is None:
+            raise ShortUrlNotFoundOnCache(f"Short url '{short_url}' not found on cache")
+        return self.local_cache.get(short_url)
+
+    def _not_found(self, short_url: str) -> ShortUrlNotFoundOnTable:
+        return ShortUrlNotFoundOnTable(
+            f"Short url '{short_url}' does not exist on {self.table.table_name} table"
+        )
+
+    def _record_request(self, short_url: str) -> None:
+        if self.hot_key_tracker is not None:
+            self.hot_key_tracker.record(short_url)
+
+    def get_url(self, short_url: str) -> Url:
+        """Returns the url of a short url, a RedirectUrl if it overrides the redirect policy."""
+        return decode_long_url(short_url, self._get_cached_long_url(short_url))
+
     def get_long_url(self, short_url: str) -> str:
+        return self.get_url(short_url).long_url
+
+    def _get_cached_long_url(self, short_url: str) -> str:
+        """Returns the long url of a short url as cached, with its overrides folded in (see encode_long_url)."""
+        self._record_request(short_url)
+        try:
+            return self._get_from_local_cache(short_url)
+        except ShortUrlMarkedAsMissing:
+            raise self._not_found(short_url) from None
+        except ShortUrlNotFoundOnCache:
+            pass
+        try:
+            long_url = self._get_from_cache_or_table(short_url)
+        except ShortUrlNotFoundOnTable as e:
+            raise e
+        except Exception as e:
+            # not cached again, so a stale url is never kept longer than stale_ttl
+            return self._get_stale_from_local_cache(short_url, e)
+        self._add_on_local_cache(Url(short_url=short_url, long_url=long_url))
+        return long_url
+
+    def _get_from_cache_or_table(self, short_url: str) -> str:
         try:
             long_url = self.cache.get(short_url)
+        except ShortUrlMarkedAsMissing:
+            self._add_missing_on_local_cache(short_url)
+            raise self._not_found(short_url) from None
         except ShortUrlNotFoundOnCache:
+            return self.single_flight.do(short_url, lambda: self._get_from_table(short_url))
+        except Exception as e:
+            self.logger.opt(exception=True).error(
+                "Error while retrieving corresponding long url from '{}' from cache", short_url
+            )
+            raise e
+        else:
+            return long_url
+
+    def _get_from_table(self, short_url: str) -> str:
+        if self.bloom_filter is not None and not self.bloom_filter.might_contain(short_url):
+            raise self._not_found(short_url)
+        if self.refill_lock_ttl and not self.cache.acquire_refill_lock(
+            short_url, self.refill_lock_ttl
+        ):
+            long_url = self._wait_for_refill(short_url)
+            if long_url is not None:
+                return long_url
+        try:
+            url = self.table.get_url(short_url)
+        except ShortUrlNotFoundOnTable as e:
+            long_url = self._get_from_pending(short_url)
+            if long_url is not None:
+                return self._refill_cache(Url(short_url=short_url, long_url=long_url))
+            if self.negative_caching:
+                self.cache.add_missing(short_url)
+                self._add_missing_on_local_cache(short_url)
+            raise e
+        except Exception as e:
+            self.logger.error(
+                f"Error while retrieving correspoding long url from '{short_url}' from table"
+            )
+            raise e
+        return self._refill_cache(url_from_item(url))
+
+    def _wait_for_refill(self, short_url: str) -> str | None:
+        """Polls the cache while another process refills it, returns None on timeout."""
+        deadline = monotonic() + self.refill_lock_ttl
+        while monotonic() < deadline:
+            sleep(self.refill_poll_interval)
             try:
-                url = self.table.get_url(short_url)
-                return url["long_url"]
-            except Exception as e:
-                self.logger.error(
-                    f"Error while retrieving correspoding long url from '{short_url}' from table"
-                )
-                raise e
+                return self.cache.get(short_url)
+            except ShortUrlMarkedAsMissing:
+                raise self._not_found(short_url) from None
+            except ShortUrlNotFoundOnCache:
+                continue
+        self.logger.info("Short url '{}' was not refilled in time, reading table", short_url)
+        return None
+
+    def _refill_cache(self, url: Url) -> str:
+        url = self._cached(url)
+        try:
+            self.cache.add(url)
+        except Exception:
+            self.logger.opt(exception=True).error("Error while refilling the cache with '{}'", url.short_url)
+        return url.long_url
+
+
+class AsyncUrlShortener(UrlShortener):
+    """
+    Non-blocking version of UrlShortener.
+
+    Expects the asynchronous adapters (AsyncShortUrlQueue, AsyncUrlTable,
+    AsyncCacheQueue and AsyncRedisBloomFilter), so no call stalls the event loop
+    of the app. The local cache is in-process and stays synchronous.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.single_flight = AsyncSingleFlight()
+
+    async def shorten_and_persist(
+        self, long_url: str, redirect_status: int | None = None, cache_max_age: int | None = None
+    ) -> Url:
+        overridden = redirect_status is not None or cache_max_age is not None
+        if self.dedup_table is not None and not overridden:
+            existing_url = await self._find_existing_url(long_url)
+            if existing_url is not None:
+                return existing_url
+        try:
+            short_url = await self._fetch_new_short_url()
+            url = build_url(short_url, long_url, redirect_status, cache_max_age)
+            await self._add_on_bloom_filter(url)
+            await self._persist_on_table(url)
+        except Exception as e:
+            self.logger.opt(exception=True).error("Error while shortening and persisting url")
+            raise e
+        else:
+            await self._add_on_cache(url)
+            await self._add_on_dedup_index(url)
+            return url
+
+    async def shorten_many(
+        self, long_urls: List[str], redirect_status: int | None = None, cache_max_age: int | None = None
+    ) -> List[Url]:
+        """Shortens and persists several long urls at once, see UrlShortener.shorten_many."""
+        if not long_urls:
+            return []
+        try:
+            short_urls = await self.queue.deque_short_url_keys(len(long_urls))
+            urls = [
+                build_url(short_url, long_url, redirect_status, cache_max_age)
+                for short_url, long_url in zip(short_urls, long_urls)
+            ]
+            if self.bloom_filter is not None:
+                await self.bloom_filter.add_many(short_urls)
+            await self._persist_many_on_table(urls)
+        except Exception as e:
+            self.logger.opt(exception=True).error(
+                "Error while shortening and persisting {} urls", len(long_urls)
+            )
+            raise e
+        else:
+            await self._add_many_on_cache(urls)
+            return urls
+
+    async def _add_many_on_cache(self, urls: List[Url]) -> None:
+        urls = [self._cached(url) for url in urls]
+        if self.local_cache is not None:
+            self.local_cache.add_many(urls)
+        return await self.cache.add_many(urls)
+
+    async def _find_existing_url(self, long_url: str) -> Url | None:
+        short_url = None
+        if self.dedup_cache is not None:
+            short_url = await self.dedup_cache.get_short_url(long_url)
+        if short_url is None:
+            try:
+                short_url = await self.dedup_table.get_short_url(long_url)
+            except LongUrlNotFoundOnIndex:
+                return None
+            if self.dedup_cache is not None:
+                await self.dedup_cache.add(Url(short_url=short_url, long_url=long_url))
+        self.logger.debug("Long url was already shortened to '{}'", short_url)
+        return Url(short_url=short_url, long_url=long_url)
+
+    async def _add_on_dedup_index(self, url: Url) -> None:
+        if self.dedup_table is None or isinstance(url, RedirectUrl):
+            return
+        if await self.dedup_table.add(url) and self.dedup_cache is not None:
+            await self.dedup_cache.add(url)
+
+    async def _persist_on_table(self, url: Url) -> bool:
+        if self.pending_urls is not None:
+            return await self.pending_urls.add(self._cached(url))
+        return await self.table.add_url(url)
+
+    async def _persist_many_on_table(self, urls: List[Url]) -> bool:
+        if self.pending_urls is not None:
+            return await self.pending_urls.add_many([self._cached(url) for url in urls])
+        return await self.table.add_urls(urls)
+
+    async def _get_from_pending(self, short_url: str) -> str | None:
+        if self.pending_urls is None:
+            return None
+        return await self.pending_urls.get(short_url)
+
+    async def _fetch_new_short_url(self) -> str:
+        return await self.queue.deque_short_url_key()
+
+    async def _add_on_cache(self, url: Url) -> None:
+        url = self._cached(url)
+        self._add_on_local_cache(url)
+        return await self.cache.add(url)
+
+    async def _add_on_bloom_filter(self, url: Url) -> None:
+        if self.bloom_filter is not None:
+            await self.bloom_filter.add(url.short_url)
+
+    async def get_url(self, short_url: str) -> Url:
+        return decode_long_url(short_url, await self._get_cached_long_url(short_url))
+
+    async def get_long_url(self, short_url: str) -> str:
+        return (await self.get_url(short_url)).long_url
+
+    async def _get_cached_long_url(self, short_url: str) -> str:
+        self._record_request(short_url)
+        try:
+            return self._get_from_local_cache(short_url)
+        except ShortUrlMarkedAsMissing:
+            raise self._not_found(short_url) from None
+        except ShortUrlNotFoundOnCache:
             pass
+        try:
+            long_url = await self._get_from_cache_or_table(short_url)
+        except ShortUrlNotFoundOnTable as e:
+            raise e
         except Exception as e:
-            self.logger.error(
-                f"Error while retrieving corresponding long url from '{short_url}' from cache",
-                exc_info=True,
+            return self._get_stale_from_local_cache(short_url, e)
+        self._add_on_local_cache(Url(short_url=short_url, long_url=long_url))
+        return long_url
+
+    async def _get_from_cache_or_table(self, short_url: str) -> str:
+        try:
+            long_url = await self.cache.get(short_url)
+        except ShortUrlMarkedAsMissing:
+            self._add_missing_on_local_cache(short_url)
+            raise self._not_found(short_url) from None
+        except ShortUrlNotFoundOnCache:
+            return await self.single_flight.do(
+                short_url, lambda: self._get_from_table(short_url)
+            )
+        except Exception as e:
+            self.logger.opt(exception=True).error(
+                "Error while retrieving corresponding long url from '{}' from cache", short_url
             )
             raise e
         else:
             return long_url
+
+    async def _get_from_table(self, short_url: str) -> str:
+        if self.bloom_filter is not None and not await self.bloom_filter.might_contain(
+            short_url
+        ):
+            raise self._not_found(short_url)
+        if self.refill_lock_ttl and not await self.cache.acquire_refill_lock(
+            short_url, self.refill_lock_ttl
+        ):
+            long_url = await self._wait_for_refill(short_url)
+            if long_url is not None:
+                return long_url
+        try:
+            url = await self.table.get_url(short_url)
+        except ShortUrlNotFoundOnTable as e:
+            long_url = await self._get_from_pending(short_url)
+            if long_url is not None:
+                return await self._refill_cache(Url(short_url=short_url, long_url=long_url))
+            if self.negative_caching:
+                await self.cache.add_missing(short_url)
+                self._add_missing_on_local_cache(short_url)
+            raise e
+        except Exception as e:
+            self.logger.error(
+                f"Error while retrieving correspoding long url from '{short_url}' from table"
+            )
+            raise e
+        return await self._refill_cache(url_from_item(url))
+
+    async def _wait_for_refill(self, short_url: str) -> str | None:
+        """Polls the cache while another process refills it, returns None on timeout."""
+        deadline = monotonic() + self.refill_lock_ttl
+        while monotonic() < deadline:
+            await asyncio.sleep(self.refill_poll_interval)
+            try:
+                return await self.cache.get(short_url)
+            except ShortUrlMarkedAsMissing:
+                raise self._not_found(short_url) from None
+            except ShortUrlNotFoundOnCache:
+                continue
+        self.logger.info("Short url '{}' was not refilled in time, reading table", short_url)
+        return None
+
+    async def _refill_cache(self, url: Url) -> str:
+        url = self._cached(url)
+        try:
+            await self.cache.add(url)
+        except Exception:
+            self.logger.opt(exception=True).error("Error while refilling the cache with '{}'", url.short_url)
+        return url.long_url
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import socket
+from typing import List, Tuple
+
+from loguru import logger
+from loguru._logger import Logger
+
+from shortame.adapters.dynamodb_adapter import AbstractDynamoDBUrlTable
+from shortame.adapters.redis_adapter import PendingUrlStream
+from shortame.domain.model import Url, decode_long_url
+
+
+def consumer_name() -> str:
+    """Names the flusher of the current process, e.g.: 'web-1-4242'"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class UrlFlusher:
+    """
+    Writes the urls shortened on write-behind mode from the pending stream to the table.
+
+    Urls are written with BatchWriteItem (retrying unprocessed items) and only
+    acknowledged once on the table. A batch that fails stays on the stream and is
+    read again after min_idle seconds, by this or any other flusher. Writing a url
+    twice puts the same item again, so urls read more than once are harmless.
+    """
+
+    def __init__(
+        self,
+        pending_urls: PendingUrlStream,
+        table: AbstractDynamoDBUrlTable,
+        consumer: str | None = None,
+        batch_size: int = 100,
+        min_idle: float = 60,
+        logger: Logger = logger,
+    ):
+        """
+        Initializes a UrlFlusher object.
+
+        :param consumer: the name of the flusher on the consumer group, defaults to consumer_name()
+        :param batch_size: how many urls are read and written at once, e.g.: 100
+        :param min_idle: seconds after which urls read but not acknowledged are read again
+        """
+        self.pending_urls = pending_urls
+        self.table = table
+        self.consumer = consumer or consumer_name()
+        self.batch_size = batch_size
+        self.min_idle = min_idle
+        self.logger = logger
+
+    def _unique_urls(self, entries: List[Tuple[bytes, Url]]) -> List[Url]:
+        # BatchWriteItem rejects a batch with the same key twice, and overrides are stored as attributes
+        return list({url.short_url: decode_long_url(url.short_url, url.long_url) for _, url in entries}.values())
+
+    def flush(self) -> int:
+        """
+        Writes a batch of pending urls on the table.
+
+        :return flushed: how many urls were written, 0 if there were none or the write failed
+        """
+        entries = self.pending_urls.read(self.consumer, self.batch_size, min_idle=self.min_idle)
+        if not entries:
+            return 0
+        try:
+            self.table.add_urls(self._unique_urls(entries))
+        except Exception:
+            self.logger.opt(exception=True).error(
+                "Error while flushing {} pending urls, they'll be retried", len(entries)
+            )
+            return 0
+        self.pending_urls.ack(entries)
+        self.logger.debug("Flushed {} pending urls to the table", len(entries))
+        return len(entries)
+
+    def flush_all(self) -> int:
+        """Writes pending urls on the table until none is left, returns how many were written."""
+        flushed = 0
+        while (batch := self.flush()) > 0:
+            flushed += batch
+        return flushed
+
+
+class AsyncUrlFlusher(UrlFlusher):
+    """Non-blocking version of UrlFlusher, run by a task alongside the app"""
+
+    async def flush(self) -> int:
+        entries = await self.pending_urls.read(self.consumer, self.batch_size, min_idle=self.min_idle)
+        if not entries:
+            return 0
+        try:
+            await self.table.add_urls(self._unique_urls(entries))
+        except Exception:
+            self.logger.opt(exception=True).error(
+                "Error while flushing {} pending urls, they'll be retried", len(entries)
+            )
+            return 0
+        await self.pending_urls.ack(entries)
+        self.logger.debug("Flushed {} pending urls to the table", len(entries))
+        return len(entries)
+
+    async def flush_all(self) -> int:
+        flushed = 0
+        while (batch := await self.flush()) > 0:
+            flushed += batch
+        return flushed
+
+    async def run(self, interval: float) -> None:
+        """
+        Flushes pending urls until cancelled, waiting interval seconds once none is left.
+
+        Urls still pending when cancelled stay on the stream for the other flushers.
+        """
+        while True:
+            try:
+                await self.flush_all()
+            except Exception:
+                self.logger.opt(exception=True).error("Error while reading pending urls")
+            await asyncio.sleep(interval)
@@ -3,10 +3,13 @@ from dataclasses import asdict
 import boto3
 import pytest
 from fakeredis import FakeStrictRedis
+from fakeredis.aioredis import FakeRedis as FakeAsyncRedis
 from moto import mock_dynamodb
 
-from shortame.adapters.dynamodb_adapter import UrlTable
-from shortame.adapters.redis_adapter import CacheQueue, ShortUrlQueue
+from shortame.adapters.dynamodb_adapter import (AsyncUrlTable, ClickStatsTable,
+                                                LongUrlIndexTable, UrlTable)
+from shortame.adapters.redis_adapter import (AsyncCacheQueue, AsyncShortUrlQueue,
+                                             CacheQueue, ShortUrlQueue)
 from shortame.domain.model import Url
 
 
@@ -34,6 +37,17 @@ def fake_dyn_resource():
         )
 
 
+@pytest.fixture
+def fake_dyn_client(fake_dyn_resource):
+    return boto3.client(
+        "dynamodb",
+        aws_access_key_id="fake_id",
+        aws_secret_access_key="fake_key",
+        aws_session_token="fake_session",
+        region_name="sa-east-1",
+    )
+
+
 @pytest.fixture
 def fake_table(fake_dyn_resource, sample_url):
     fake_dyn_table = fake_dyn_resource.create_table(
@@ -48,6 +62,34 @@ def fake_table(fake_dyn_resource, sample_url):
     fake_dyn_table.put_item(Item=asdict(sample_url))
 
 
+@pytest.fixture
+def fake_dedup_table(fake_dyn_resource, fake_dyn_client):
+    fake_dyn_table = fake_dyn_resource.create_table(
+        AttributeDefinitions=[
+            {"AttributeName": "long_url_hash", "AttributeType": "S"},
+        ],
+        TableName="url_dedup",
+        KeySchema=[{"AttributeName": "long_url_hash", "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    fake_dyn_table.wait_until_exists()
+    return LongUrlIndexTable(dyn_client=fake_dyn_client, table_name="url_dedup")
+
+
+@pytest.fixture
+def fake_click_stats_table(fake_dyn_resource, fake_dyn_client):
+    fake_dyn_table = fake_dyn_resource.create_table(
+        AttributeDefinitions=[
+            {"AttributeName": "short_url", "AttributeType": "S"},
+        ],
+        TableName="url_clicks",
+        KeySchema=[{"AttributeName": "short_url", "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    fake_dyn_table.wait_until_exists()
+    return ClickStatsTable(dyn_client=fake_dyn_client, table_name="url_clicks")
+
+
 @pytest.fixture
 def fake_redis_client():
     return FakeStrictRedis(version=7)
@@ -68,3 +110,25 @@ def fake_url_table(fake_dyn_resource, fake_table):
 @pytest.fixture
 def fake_cache(fake_redis_client):
     return CacheQueue(redis_client=fake_redis_client)
+
+
+@pytest.fixture
+def fake_async_redis_client():
+    return FakeAsyncRedis(version=7)
+
+
+@pytest.fixture
+def fake_async_short_url_queue(fake_async_redis_client, short_url_queue_name):
+    return AsyncShortUrlQueue(
+        redis_client=fake_async_redis_client, queue_name=short_url_queue_name
+    )
+
+
+@pytest.fixture
+def fake_async_url_table(fake_url_table):
+    return AsyncUrlTable(url_table=fake_url_table)
+
+
+@pytest.fixture
+def fake_async_cache(fake_async_redis_client):
+    return AsyncCacheQueue(redis_client=fake_async_redis_client)
@@ -0,0 +1,77 @@
+import asyncio
+
+from shortame.adapters.dynamodb_adapter import AsyncClickStatsTable
+from shortame.adapters.redis_adapter import AsyncClickStatsCache, ClickStatsCache
+from shortame.services.analytics_services import AsyncClickAggregator, ClickAggregator
+
+
+def test_click_aggregator_flushes_clicks_to_cache_and_table(
+    fake_redis_client, fake_click_stats_table, sample_url
+):
+    aggregator = ClickAggregator(cache=ClickStatsCache(redis_client=fake_redis_client), table=fake_click_stats_table)
+    for visitor in ["a", "b", "a"]:
+        aggregator.record(sample_url.short_url, visitor)
+
+    assert aggregator.flush() == 1
+    assert aggregator.pending() == 0
+    assert aggregator.flush() == 0
+    assert aggregator.get_stats(sample_url.short_url) == {
+        "short_url": sample_url.short_url,
+        "clicks": 3,
+        "unique_visitors": 2,
+    }
+    assert fake_click_stats_table.get_clicks(sample_url.short_url) == 3
+
+
+def test_click_aggregator_reads_clicks_from_table_when_not_cached(
+    fake_redis_client, fake_click_stats_table, sample_url
+):
+    fake_click_stats_table.add_clicks({sample_url.short_url: 7})
+    aggregator = ClickAggregator(cache=ClickStatsCache(redis_client=fake_redis_client), table=fake_click_stats_table)
+
+    assert aggregator.get_stats(sample_url.short_url)["clicks"] == 7
+
+
+def test_click_aggregator_reads_clicks_from_table_when_the_cache_was_reset(
+    fake_redis_client, fake_click_stats_table, sample_url
+):
+    aggregator = ClickAggregator(cache=ClickStatsCache(redis_client=fake_redis_client), table=fake_click_stats_table)
+    fake_click_stats_table.add_clicks({sample_url.short_url: 7})
+    # the cache lost the clicks, the next flush recreates a lower count
+    aggregator.record(sample_url.short_url, "a")
+    aggregator.flush()
+
+    assert fake_redis_client.get(f"clicks:{sample_url.short_url}") == b"1"
+    assert aggregator.get_stats(sample_url.short_url)["clicks"] == 8
+
+
+def test_click_aggregator_keeps_flushing_the_table_when_cache_fails(fake_click_stats_table, sample_url):
+    class BrokenCache:
+        def add_clicks(self, clicks, visitors):
+            raise ConnectionError("redis is down")
+
+    aggregator = ClickAggregator(cache=BrokenCache(), table=fake_click_stats_table)
+    aggregator.record(sample_url.short_url, "a")
+
+    assert aggregator.flush() == 1
+    assert fake_click_stats_table.get_clicks(sample_url.short_url) == 1
+
+
+def test_async_click_aggregator_flushes_once_cancelled(
+    fake_async_redis_client, fake_click_stats_table, sample_url
+):
+    aggregator = AsyncClickAggregator(
+        cache=AsyncClickStatsCache(redis_client=fake_async_redis_client),
+        table=AsyncClickStatsTable(stats_table=fake_click_stats_table),
+    )
+
+    async def scenario():
+        flushing = asyncio.ensure_future(aggregator.run(interval=60))
+        aggregator.record(sample_url.short_url, "a")
+        aggregator.record(sample_url.short_url, "b")
+        await asyncio.sleep(0)
+        flushing.cancel()
+        await asyncio.gather(flushing, return_exceptions=True)
+        return await aggregator.get_stats(sample_url.short_url)
+
+    assert asyncio.run(scenario()) == {"short_url": sample_url.short_url, "clicks": 2, "unique_visitors": 2}
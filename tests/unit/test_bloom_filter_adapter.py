@@ -0,0 +1,51 @@
+import asyncio
+
+from shortame.adapters.bloom_filter_adapter import (AsyncRedisBloomFilter,
+                                                    BloomFilter,
+                                                    RedisBloomFilter)
+
+
+def test_bloom_filter_sizing():
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+
+    assert bloom_filter.size == 9586
+    assert bloom_filter.hash_count == 7
+    assert len(bloom_filter._positions("abcd123")) == bloom_filter.hash_count
+
+
+def test_bloom_filter_can_add_and_check(sample_url):
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+
+    assert bloom_filter.might_contain(sample_url.short_url) is False
+
+    bloom_filter.add(sample_url.short_url)
+    bloom_filter.add_many([f"{i:07d}" for i in range(1000)])
+
+    assert bloom_filter.might_contain(sample_url.short_url) is True
+    assert all(bloom_filter.might_contain_many([f"{i:07d}" for i in range(1000)]))
+    false_positives = sum(bloom_filter.might_contain_many([f"x{i:06d}" for i in range(1000)]))
+    assert false_positives < 50
+
+
+def test_redis_bloom_filter_can_add_and_check(fake_redis_client, sample_url):
+    bloom_filter = RedisBloomFilter(redis_client=fake_redis_client, capacity=1000, error_rate=0.01)
+
+    assert bloom_filter.might_contain(sample_url.short_url) is False
+
+    bloom_filter.add(sample_url.short_url)
+
+    assert bloom_filter.might_contain_many([sample_url.short_url, "notexists"]) == [True, False]
+    assert fake_redis_client.exists(bloom_filter.filter_name)
+
+
+def test_async_redis_bloom_filter_can_add_and_check(fake_async_redis_client, sample_url):
+    bloom_filter = AsyncRedisBloomFilter(
+        redis_client=fake_async_redis_client, capacity=1000, error_rate=0.01
+    )
+
+    async def scenario():
+        assert await bloom_filter.might_contain(sample_url.short_url) is False
+        await bloom_filter.add(sample_url.short_url)
+        assert await bloom_filter.might_contain(sample_url.short_url) is True
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+import io
+import json
+
+import pytest
+
+from shortame.adapters.dynamodb_adapter import FastUrlTable
+from shortame.adapters.embedded_adapter import EmbeddedUrlTable
+from shortame.services.bulk_services import InvalidUrlRow, UrlExporter, UrlImporter, UrlWriter, read_urls
+from shortame.domain.model import Url, build_url, url_to_item
+
+
+@pytest.fixture
+def fake_fast_url_table(fake_dyn_client, fake_table):
+    # clients are thread-safe, unlike resources
+    return FastUrlTable(dyn_client=fake_dyn_client, verify_table=False)
+
+
+def test_read_urls_streams_csv_and_jsonl():
+    csv_lines = io.StringIO("short_url,long_url\nabc0001,https://www.example.com/1\n")
+    jsonl_lines = io.StringIO('{"short_url": "abc0002", "long_url": "https://www.example.com/2"}\n\n')
+
+    assert list(read_urls(csv_lines, "csv")) == [Url(short_url="abc0001", long_url="https://www.example.com/1")]
+    assert list(read_urls(jsonl_lines, "jsonl")) == [Url(short_url="abc0002", long_url="https://www.example.com/2")]
+
+
+def test_read_urls_validates_rows_like_the_api():
+    lines = io.StringIO(
+        "short_url,long_url,redirect_status,cache_max_age\n"
+        "abc0001,https://www.example.com/1,308,60\n"
+        'abc0002,"!308,60!https://www.example.com/2",,\n'
+        "abc0003,https://www.example.com/3,200,\n"
+        "abc0004,https://www.example.com/4,,99999999999\n"
+        "abc0005,https://www.example.com/5,301,soon\n"
+    )
+
+    urls = list(read_urls(lines, "csv"))
+
+    assert urls[0] == build_url("abc0001", "https://www.example.com/1", 308, 60)
+    assert [url.row for url in urls[1:]] == [2, 3, 4, 5]
+    assert all(isinstance(url, InvalidUrlRow) for url in urls[1:])
+    assert isinstance(next(read_urls(io.StringIO('{"short_url": "abc0001"\n'), "jsonl")), InvalidUrlRow)
+
+
+@pytest.mark.parametrize("format", ["csv", "jsonl"])
+def test_url_writer_keeps_redirect_overrides(format):
+    urls = [Url(short_url="abc0001", long_url="https://www.example.com/1"), build_url("abc0002", "https://x.io", 308)]
+    lines = io.StringIO()
+
+    UrlWriter(lines, format).write([url_to_item(url) for url in urls])
+
+    assert list(read_urls(io.StringIO(lines.getvalue()), format)) == urls
+
+
+def test_url_importer_imports_and_removes_issued_short_urls(fake_fast_url_table, fake_short_url_queue, fake_cache):
+    fake_short_url_queue.enqueue_short_url_keys(["new0003", "free001", "new0042"])
+    urls = [Url(short_url=f"new{i:04d}", long_url=f"https://www.example.com/{i}") for i in range(250)]
+    importer = UrlImporter(
+        tables=[fake_fast_url_table, fake_fast_url_table],
+        queue=fake_short_url_queue,
+        cache=fake_cache,
+        batch_size=30,
+    )
+
+    report = importer.run(iter(urls + urls[:5]))
+
+    assert report["imported"] == 255
+    assert report["failed"] == 0
+    assert report["removed_from_queue"] == 2
+    assert fake_short_url_queue.peek_short_url_keys() == ["free001"]
+    assert fake_fast_url_table.get_url("new0249")["long_url"] == "https://www.example.com/249"
+    assert fake_cache.get("new0100") == "https://www.example.com/100"
+
+
+def test_url_exporter_scans_every_segment(tmp_path):
+    # moto ignores Scan segments, the embedded table splits its index into them
+    table = EmbeddedUrlTable(path=str(tmp_path / "url_table"), initial_slots=64)
+    table.add_urls([Url(short_url=f"new{i:04d}", long_url=f"https://www.example.com/{i}") for i in range(20)])
+    lines = io.StringIO()
+
+    report = UrlExporter(tables=[table] * 4, page_size=3).run(UrlWriter(lines, "csv").write)
+
+    exported = list(read_urls(io.StringIO(lines.getvalue()), "csv"))
+    assert report["exported"] == 20
+    assert report["failed_segments"] == 0
+    assert sorted(url.short_url for url in exported) == [f"new{i:04d}" for i in range(20)]
+
+
+def test_url_exporter_scans_a_dynamodb_table(fake_fast_url_table, sample_url):
+    lines = io.StringIO()
+
+    report = UrlExporter(tables=[fake_fast_url_table]).run(UrlWriter(lines, "jsonl").write)
+
+    assert report["exported"] == 1
+    assert json.loads(lines.getvalue()) == {"short_url": sample_url.short_url, "long_url": sample_url.long_url}
+
+
+def test_url_importer_counts_failed_batches(fake_fast_url_table, fake_short_url_queue, monkeypatch):
+    urls = [Url(short_url="{bad}01", long_url="https://www.example.com/1")]
+    importer = UrlImporter(tables=[fake_fast_url_table], queue=fake_short_url_queue)
+
+    def add_urls(urls, **kwargs):
+        raise ConnectionError("Connection refused")
+
+    monkeypatch.setattr(fake_fast_url_table, "add_urls", add_urls)
+
+    report = importer.run(iter(urls))
+
+    assert report["imported"] == 0
+    assert report["failed"] == 1
+
+
+def test_url_importer_counts_invalid_rows_as_failed(fake_fast_url_table):
+    lines = io.StringIO(
+        '{"short_url": "new0001", "long_url": "https://www.example.com/1"}\n'
+        '{"short_url": "new0002", "long_url": "javascript:alert(1)"}\n'
+    )
+    importer = UrlImporter(tables=[fake_fast_url_table])
+
+    report = importer.run(read_urls(lines, "jsonl"))
+
+    assert report["imported"] == 1
+    assert report["failed"] == 1
+    assert fake_fast_url_table.batch_get_urls(["new0001", "new0002"], projection="short_url") == [
+        {"short_url": "new0001"}
+    ]
@@ -0,0 +1,51 @@
+import asyncio
+
+from shortame.adapters.redis_adapter import AsyncHotKeyTracker, HotKeyTracker
+from shortame.domain.model import Url
+from shortame.services.cache_services import AsyncCacheWarmer, CacheWarmer
+
+
+def test_cache_warmer_loads_hot_short_urls_into_the_cache(
+    fake_url_table, fake_cache, fake_redis_client, sample_url
+):
+    other_url = Url(short_url="xyz9876", long_url="https://www.example.com")
+    fake_url_table.add_url(other_url)
+    fake_redis_client.zadd("hot_urls", {sample_url.short_url: 5, other_url.short_url: 3, "missing": 1})
+    warmer = CacheWarmer(
+        tracker=HotKeyTracker(redis_client=fake_redis_client),
+        table=fake_url_table,
+        cache=fake_cache,
+        batch_size=2,
+    )
+
+    assert warmer.warm_up(10) == 2
+    assert fake_cache.get(sample_url.short_url) == sample_url.long_url
+    assert fake_cache.get(other_url.short_url) == other_url.long_url
+
+
+def test_cache_warmer_runs_once_per_lock(fake_url_table, fake_cache, fake_redis_client, sample_url):
+    fake_redis_client.zadd("hot_urls", {sample_url.short_url: 1})
+    warmer = CacheWarmer(
+        tracker=HotKeyTracker(redis_client=fake_redis_client), table=fake_url_table, cache=fake_cache
+    )
+
+    assert warmer.warm_up(10, lock_ttl=10) == 1
+    assert warmer.warm_up(10, lock_ttl=10) == 0
+
+
+def test_async_cache_warmer_loads_hot_short_urls_into_the_cache(
+    fake_async_url_table, fake_async_cache, fake_async_redis_client, sample_url
+):
+    warmer = AsyncCacheWarmer(
+        tracker=AsyncHotKeyTracker(redis_client=fake_async_redis_client, sample_rate=1),
+        table=fake_async_url_table,
+        cache=fake_async_cache,
+    )
+
+    async def scenario():
+        warmer.tracker.record(sample_url.short_url)
+        await asyncio.gather(*warmer.tracker._pending)
+        assert await warmer.warm_up_quietly(10) == 1
+        return await fake_async_cache.get(sample_url.short_url)
+
+    assert asyncio.run(scenario()) == sample_url.long_url
@@ -1,7 +1,8 @@
 import pytest
 from pydantic import ValidationError
 
-from shortame.domain.model import Url
+from shortame.domain.model import (RedirectUrl, Url, build_url, decode_long_url,
+                                   encode_long_url, url_to_item)
 
 
 def test_url_creational_params():
@@ -22,3 +23,13 @@ def test_url_creational_params():
         Url(short_url=short_url)
 
     assert "Field required [type=missing" in str(excinfo.value)
+
+
+def test_redirect_overrides_are_folded_into_the_long_url():
+    url = build_url("ABC123a", "https://example.com/!a", redirect_status=308)
+
+    assert isinstance(url, RedirectUrl)
+    assert encode_long_url(url) == "!308,!https://example.com/!a"
+    assert decode_long_url("ABC123a", encode_long_url(url)) == url
+    assert url_to_item(url) == {"short_url": "ABC123a", "long_url": "https://example.com/!a", "redirect_status": 308}
+    assert decode_long_url("ABC123a", "https://example.com") == Url(short_url="ABC123a", long_url="https://example.com")
@@ -1,9 +1,14 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import asdict
 
 import pytest
+from botocore.exceptions import EndpointConnectionError
 
-from shortame.adapters.dynamodb_adapter import (ShortUrlNotFoundOnTable,
-                                                UrlTable)
+from shortame.adapters.dynamodb_adapter import (FastUrlTable, LongUrlNotFoundOnIndex,
+                                                ShortUrlNotFoundOnTable,
+                                                ThreadLocalUrlTable, UrlTable)
+from shortame.domain.model import Url, build_url, url_from_item, url_to_item
 
 
 def test_url_table_loads_the_correct_table(fake_dyn_resource, fake_table):
@@ -18,6 +23,13 @@ def test_url_table_loads_the_correct_table(fake_dyn_resource, fake_table):
     assert not_ok_url_table.table_name != fake_dyn_resource.Table("url").table_name
 
 
+def test_url_table_can_skip_loading_the_table(fake_dyn_resource, fake_table, sample_url):
+    url_table = UrlTable(dyn_resource=fake_dyn_resource, table_name="url", verify_table=False)
+
+    assert url_table.table.table_name == "url"
+    assert url_table.get_url(sample_url.short_url) == asdict(sample_url)
+
+
 def test_url_table_can_add_url(fake_dyn_resource, fake_table, sample_url):
     table_name = "url"
 
@@ -55,3 +67,146 @@ def test_url_table_can_get_url(fake_dyn_resource, fake_table, sample_url):
         str(excinfo.value)
         == f"Short url '{not_ok_short_url}' does not exist on {table_name} table"
     )
+
+
+def test_async_url_table_can_add_and_get_url(fake_async_url_table, sample_url):
+    new_url = Url(short_url="1234xyz", long_url="https://www.example.com")
+
+    async def scenario():
+        assert await fake_async_url_table.add_url(new_url) is True
+        assert await fake_async_url_table.get_url(new_url.short_url) == asdict(new_url)
+        assert await fake_async_url_table.get_url(sample_url.short_url) == asdict(
+            sample_url
+        )
+
+        with pytest.raises(ShortUrlNotFoundOnTable):
+            await fake_async_url_table.get_url("notexists")
+
+    asyncio.run(scenario())
+
+
+def test_url_table_can_batch_get_urls(fake_url_table, sample_url):
+    new_urls = [
+        Url(short_url=f"{i:07d}", long_url="https://www.example.com")
+        for i in range(150)
+    ]
+    for new_url in new_urls:
+        fake_url_table.add_url(new_url)
+
+    short_urls = [url.short_url for url in new_urls] + ["notexists"]
+    from_db = fake_url_table.batch_get_urls(short_urls)
+
+    assert len(from_db) == 150
+    assert {url["short_url"] for url in from_db} == {url.short_url for url in new_urls}
+
+    projected = fake_url_table.batch_get_urls(
+        [sample_url.short_url], projection="short_url"
+    )
+
+    assert projected == [{"short_url": sample_url.short_url}]
+
+
+def test_url_table_can_add_urls(fake_url_table):
+    new_urls = [
+        Url(short_url=f"{i:07d}", long_url="https://www.example.com")
+        for i in range(60)
+    ]
+
+    assert fake_url_table.add_urls(new_urls) is True
+    assert len(fake_url_table.batch_get_urls([url.short_url for url in new_urls])) == 60
+
+
+def test_long_url_index_table_can_add_and_get(fake_dedup_table, sample_url):
+    with pytest.raises(LongUrlNotFoundOnIndex):
+        fake_dedup_table.get_short_url(sample_url.long_url)
+
+    assert fake_dedup_table.add(sample_url) is True
+    assert fake_dedup_table.get_short_url(sample_url.long_url) == sample_url.short_url
+
+    other_url = Url(short_url="1234xyz", long_url=sample_url.long_url)
+
+    assert fake_dedup_table.add(other_url) is False
+    assert fake_dedup_table.get_short_url(sample_url.long_url) == sample_url.short_url
+
+
+def test_fast_url_table_can_add_and_get_url(fake_dyn_resource, fake_dyn_client, fake_table, sample_url):
+    url_table = FastUrlTable(dyn_client=fake_dyn_client, table_name="url")
+    new_url = Url(short_url="1234xyz", long_url="https://www.example.com")
+
+    assert url_table.add_url(new_url) is True
+    assert url_table.get_url(new_url.short_url) == asdict(new_url)
+    assert url_table.get_url(sample_url.short_url) == asdict(sample_url)
+    assert fake_dyn_resource.Table("url").get_item(Key={"short_url": "1234xyz"})["Item"] == asdict(new_url)
+    with pytest.raises(ShortUrlNotFoundOnTable):
+        url_table.get_url("notexists")
+    assert FastUrlTable(dyn_client=fake_dyn_client, table_name="wrong_table").table is None
+
+
+def test_fast_url_table_can_batch_add_and_get_urls(fake_dyn_client, fake_table, sample_url):
+    url_table = FastUrlTable(dyn_client=fake_dyn_client, table_name="url", verify_table=False)
+    new_urls = [Url(short_url=f"fast{i:03d}", long_url=f"https://example.com/{i}") for i in range(30)]
+
+    assert url_table.add_urls(new_urls) is True
+    found = url_table.batch_get_urls([url.short_url for url in new_urls] + ["missing"])
+    short_urls = url_table.batch_get_urls([sample_url.short_url, "fast000"], projection="short_url")
+
+    assert sorted(found, key=lambda url: url["short_url"]) == [asdict(url) for url in new_urls]
+    assert sorted(short_urls, key=lambda url: url["short_url"]) == [
+        {"short_url": sample_url.short_url},
+        {"short_url": "fast000"},
+    ]
+
+
+def test_fast_url_table_stores_redirect_overrides(fake_dyn_resource, fake_dyn_client, fake_table):
+    url_table = FastUrlTable(dyn_client=fake_dyn_client, table_name="url", verify_table=False)
+    url = build_url("redir01", "https://www.example.com", redirect_status=301, cache_max_age=3600)
+
+    url_table.add_urls([url])
+
+    assert url_table.get_url(url.short_url) == url_to_item(url)
+    assert url_from_item(url_table.batch_get_urls([url.short_url])[0]) == url
+    assert fake_dyn_resource.Table("url").get_item(Key={"short_url": "redir01"})["Item"]["cache_max_age"] == 3600
+
+
+def test_thread_local_url_table_builds_a_table_per_thread(fake_dyn_resource, fake_table, sample_url):
+    tables = []
+
+    def create_table():
+        tables.append(UrlTable(dyn_resource=fake_dyn_resource, verify_table=False))
+        return tables[-1]
+
+    url_table = ThreadLocalUrlTable(create_table)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        urls = list(executor.map(url_table.get_url, [sample_url.short_url] * 2))
+
+    assert urls == [asdict(sample_url)] * 2
+    assert url_table.table_name == "url"
+    # the one of the main thread, plus one per executor thread
+    assert 2 <= len({id(table) for table in tables}) == len(tables) <= 3
+
+
+def test_click_stats_table_keeps_adding_clicks_past_a_failing_url(fake_dyn_resource, fake_click_stats_table):
+    # ADD fails on a string attribute
+    fake_dyn_resource.Table("url_clicks").put_item(Item={"short_url": "broken1", "clicks": "many"})
+    clicks = {f"new{i:04d}": i + 1 for i in range(20)}
+
+    failed = fake_click_stats_table.add_clicks({"broken1": 1, **clicks})
+
+    assert failed == {"broken1": 1}
+    assert {short_url: fake_click_stats_table.get_clicks(short_url) for short_url in clicks} == clicks
+
+
+def test_click_stats_table_keeps_adding_clicks_past_a_connection_error(fake_click_stats_table, monkeypatch):
+    update_item = fake_click_stats_table.dyn_client.update_item
+
+    def flaky_update_item(**kwargs):
+        if kwargs["Key"]["short_url"]["S"] == "broken1":
+            raise EndpointConnectionError(endpoint_url="https://dynamodb.sa-east-1.amazonaws.com")
+        return update_item(**kwargs)
+
+    monkeypatch.setattr(fake_click_stats_table.dyn_client, "update_item", flaky_update_item)
+
+    failed = fake_click_stats_table.add_clicks({"broken1": 1, "new0001": 2})
+
+    assert failed == {"broken1": 1}
+    assert fake_click_stats_table.get_clicks("new0001") == 2
@@ -0,0 +1,192 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from shortame.adapters.dynamodb_adapter import ShortUrlNotFoundOnTable
+from shortame.adapters.embedded_adapter import (INDEX_HEADER, INDEX_MAGIC, INDEX_VERSION,
+                                                AsyncEmbeddedUrlTable, EmbeddedUrlTable)
+from shortame.domain.model import Url
+
+
+@pytest.fixture
+def embedded_table_path(tmp_path):
+    return str(tmp_path / "url_table")
+
+
+def sample_urls(count: int, prefix: str = "new") -> list:
+    return [Url(short_url=f"{prefix}{i:04d}", long_url=f"https://www.example.com/{i}") for i in range(count)]
+
+
+def fill_embedded_table(path: str, count: int) -> None:
+    table = EmbeddedUrlTable(path=path, initial_slots=1024)
+    table.add_urls(sample_urls(count, prefix="oth"))
+    table.close()
+
+
+def test_embedded_url_table_can_add_and_get(embedded_table_path, sample_url):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+
+    assert table.add_url(sample_url)
+    assert table.add_urls(sample_urls(10))
+
+    assert table.get_url(sample_url.short_url) == {"short_url": sample_url.short_url, "long_url": sample_url.long_url}
+    with pytest.raises(ShortUrlNotFoundOnTable):
+        table.get_url("xyz9876")
+    assert table.batch_get_urls(["new0003", "xyz9876", "new0003"], projection="short_url") == [
+        {"short_url": "new0003"}
+    ]
+    assert table.stats()["keys"] == 11
+
+
+def test_embedded_url_table_overwrites_and_compacts(embedded_table_path):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64, compaction_min_records=10)
+    table.add_urls(sample_urls(10))
+    table.add_url(Url(short_url="new0001", long_url="https://www.example.com/updated"))
+
+    table.compact()
+
+    assert table.get_url("new0001")["long_url"] == "https://www.example.com/updated"
+    assert {name: table.stats()[name] for name in ("generation", "keys", "records")} == {
+        "generation": 1,
+        "keys": 10,
+        "records": 10,
+    }
+    assert sorted(os.listdir(embedded_table_path)) == ["CURRENT", "LOCK", "index.1", "log.1"]
+
+
+def test_embedded_url_table_grows_its_index(embedded_table_path):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+
+    for start in range(0, 200, 20):
+        table.add_urls(sample_urls(200)[start : start + 20])
+    table.close()
+
+    reopened = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    assert reopened.stats()["slots"] >= 256
+    assert len(reopened.batch_get_urls(url.short_url for url in sample_urls(200))) == 200
+
+
+def test_embedded_url_table_replays_and_truncates_a_torn_log(embedded_table_path):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    table.add_urls(sample_urls(5))
+    table.close()
+    # a crash after appending a record but before indexing it, followed by a half written one
+    with open(os.path.join(embedded_table_path, "index.0"), "r+b") as index:
+        index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, 64, 0, 0, 0) + bytes(64 * 16))
+    log_path = os.path.join(embedded_table_path, "log.0")
+    log_size = os.path.getsize(log_path)
+    with open(log_path, "ab") as log:
+        log.write(b"\x01\x02\x03\x04\x07\x00")
+
+    recovered = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+
+    assert recovered.get_url("new0004")["long_url"] == "https://www.example.com/4"
+    assert os.path.getsize(log_path) == log_size
+    assert recovered.stats()["keys"] == 5
+
+
+def test_embedded_url_table_is_shared_between_processes(embedded_table_path):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=1024)
+    table.add_urls(sample_urls(10))
+
+    worker = multiprocessing.get_context("fork").Process(target=fill_embedded_table, args=(embedded_table_path, 100))
+    worker.start()
+    worker.join()
+
+    assert table.get_url("oth0042")["long_url"] == "https://www.example.com/42"
+    assert table.stats()["keys"] == 110
+
+
+def test_async_embedded_url_table_can_add_and_get(embedded_table_path, sample_url):
+    table = AsyncEmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+
+    async def scenario():
+        await table.add_url(sample_url)
+        return await table.get_url(sample_url.short_url), await table.batch_get_urls([sample_url.short_url])
+
+    url, urls = asyncio.run(scenario())
+
+    assert url["long_url"] == sample_url.long_url
+    assert urls == [url]
+
+
+def test_embedded_url_table_appends_after_a_torn_tail_left_by_another_writer(embedded_table_path, sample_url):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    other = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    table.add_url(sample_url)
+    # the other writer died mid-append
+    with open(os.path.join(embedded_table_path, "log.0"), "ab") as log:
+        log.write(b"\x01\x02\x03\x04\x07\x00")
+
+    table.add_url(Url(short_url="bbbbbbb", long_url="https://www.example.com/b"))
+
+    assert other.get_url("bbbbbbb")["long_url"] == "https://www.example.com/b"
+    table.close()
+    other.close()
+    reopened = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    assert reopened.get_url("bbbbbbb")["long_url"] == "https://www.example.com/b"
+    assert reopened.get_url(sample_url.short_url)["long_url"] == sample_url.long_url
+
+
+def test_embedded_url_table_closes_retired_generations(embedded_table_path):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64, compaction_min_records=10)
+    table.add_urls(sample_urls(10))
+    scan = table.scan_urls()
+    next(scan)
+
+    table.compact()
+    table.compact()
+
+    # the first generation is still being scanned
+    assert [files.generation for files in table._retired_files] == [0]
+    assert len(list(scan)) == 9
+    assert table._retired_files == []
+    assert table.get_url("new0003")["long_url"] == "https://www.example.com/3"
+
+
+def test_async_embedded_url_table_appends_off_the_event_loop(embedded_table_path, sample_url, monkeypatch):
+    table = AsyncEmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    append, threads = table._append, []
+
+    def _append(urls):
+        threads.append(threading.current_thread())
+        append(urls)
+
+    monkeypatch.setattr(table, "_append", _append)
+
+    asyncio.run(table.add_urls([sample_url]))
+
+    assert threads and threads[0] is not threading.main_thread()
+    assert asyncio.run(table.get_url(sample_url.short_url))["long_url"] == sample_url.long_url
+
+
+def test_embedded_url_table_follows_current_past_a_removed_generation(embedded_table_path, monkeypatch):
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    other = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    table.add_urls(sample_urls(10))
+    table.compact()
+    table.compact()
+    # the other table read CURRENT right before the second compaction removed the generation it named
+    generations = iter([1])
+    current_generation = other._current_generation
+    monkeypatch.setattr(other, "_current_generation", lambda: next(generations, None) or current_generation())
+
+    assert other.get_url("new0003")["long_url"] == "https://www.example.com/3"
+    assert other.stats()["generation"] == 2
+    assert not os.path.exists(os.path.join(embedded_table_path, "log.1"))
+
+
+def test_embedded_url_table_compacts_through_short_writes(embedded_table_path, monkeypatch):
+    monkeypatch.setattr("shortame.adapters.embedded_adapter.COMPACTION_WRITE_SIZE", 100)
+    table = EmbeddedUrlTable(path=embedded_table_path, initial_slots=64)
+    table.add_urls(sample_urls(20))
+    write = os.write
+    monkeypatch.setattr(os, "write", lambda fd, data: write(fd, data[:7]))
+
+    table.compact()
+
+    assert table.stats()["keys"] == 20
+    assert all(table.get_url(url.short_url)["long_url"] == url.long_url for url in sample_urls(20))
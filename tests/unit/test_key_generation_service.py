@@ -1,5 +1,15 @@
+import asyncio
+
+import pytest
+
+from shortame.adapters.bloom_filter_adapter import BloomFilter
+from shortame.adapters.redis_adapter import AsyncIdRangeCounter, GeneratorLease, IdRangeCounter
 from shortame.domain.model import Url
-from shortame.services.key_generation_services import ShortUrlGenerator
+from shortame.services.key_generation_services import (AsyncLeasedRangeKeyQueue,
+                                                       FeistelKeyPermutation,
+                                                       KeyGeneratorService,
+                                                       LeasedRangeKeyQueue,
+                                                       ShortUrlGenerator)
 
 
 def test_short_url_generator_can_enque(
@@ -47,3 +57,141 @@ def test_short_url_generator_generate(fake_short_url_queue, fake_table):
 
     assert type(short_url_1) is str
     assert len(short_url_1) == fake_short_url_generator.short_url_size
+
+
+def test_short_url_generator_generate_and_enqueue_batch(
+    fake_short_url_queue, fake_url_table, monkeypatch
+):
+    fake_short_url_generator = ShortUrlGenerator(
+        queue=fake_short_url_queue, table=fake_url_table
+    )
+
+    taken = Url(short_url="taken12", long_url="https://example.com")
+    fake_url_table.add_url(taken)
+    candidates = iter([taken.short_url, "free123", "free456", "free123"])
+    monkeypatch.setattr(
+        fake_short_url_generator, "generate", lambda size: next(candidates)
+    )
+
+    assert fake_short_url_generator.generate_and_enqueue_batch(size=4) == 2
+    assert fake_short_url_queue.current_size() == 2
+    assert {
+        fake_short_url_queue.deque_short_url_key(),
+        fake_short_url_queue.deque_short_url_key(),
+    } == {"free123", "free456"}
+
+
+def test_short_url_generator_skips_table_for_unissued_keys(
+    fake_short_url_queue, fake_url_table, sample_url, monkeypatch
+):
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.001)
+    bloom_filter.add(sample_url.short_url)
+    fake_short_url_generator = ShortUrlGenerator(
+        queue=fake_short_url_queue, table=fake_url_table, bloom_filter=bloom_filter
+    )
+
+    assert fake_short_url_generator.exists_in_table(short_url=sample_url.short_url) is True
+
+    monkeypatch.setattr(fake_url_table, "get_url", None)
+
+    assert fake_short_url_generator.exists_in_table(short_url="free123") is False
+
+
+def test_feistel_key_permutation_is_a_bijection():
+    permutation = FeistelKeyPermutation(secret="secret", size=2)
+
+    short_urls = [permutation.encode(key_id) for key_id in range(permutation.domain_size)]
+
+    assert len(set(short_urls)) == permutation.domain_size == 62**2
+    assert all(len(short_url) == 2 for short_url in short_urls)
+    assert short_urls[:3] != sorted(short_urls[:3])
+    assert FeistelKeyPermutation(secret="secret", size=2).encode(42) == short_urls[42]
+    assert FeistelKeyPermutation(secret="other", size=2).encode(42) != short_urls[42]
+
+    with pytest.raises(ValueError):
+        permutation.encode(permutation.domain_size)
+
+
+def test_leased_range_key_queue_hands_out_disjoint_keys(fake_redis_client):
+    counter = IdRangeCounter(redis_client=fake_redis_client)
+    permutation = FeistelKeyPermutation(secret="secret")
+    queue_a = LeasedRangeKeyQueue(counter=counter, permutation=permutation, lease_size=10)
+    queue_b = LeasedRangeKeyQueue(counter=counter, permutation=permutation, lease_size=10)
+
+    keys = queue_a.deque_short_url_keys(15) + queue_b.deque_short_url_keys(15)
+
+    assert len(set(keys)) == 30
+    assert all(len(key) == 7 for key in keys)
+    assert queue_a.current_size() == 5
+    assert int(fake_redis_client.get(counter.counter_name)) == 40
+
+    queue_a.enqueue_short_url_key(keys[0])
+
+    assert queue_a.deque_short_url_key() == keys[0]
+
+
+def test_key_generator_service_refills_between_watermarks(
+    fake_short_url_queue, fake_url_table, fake_redis_client
+):
+    generators = [
+        ShortUrlGenerator(queue=fake_short_url_queue, table=fake_url_table)
+        for _ in range(3)
+    ]
+    service = KeyGeneratorService(
+        generators=generators,
+        lease=GeneratorLease(owner="test", redis_client=fake_redis_client),
+        low_watermark=10,
+        high_watermark=50,
+        batch_size=7,
+    )
+
+    assert service.refill() == 50
+    assert fake_short_url_queue.current_size() == 50
+    assert service.refill() == 0
+
+    fake_short_url_queue.deque_short_url_keys(45)
+
+    assert service.refill() == 45
+    assert fake_short_url_queue.read_stats() == {
+        "queue_size": 50.0,
+        "generated_total": 95.0,
+        "refills_total": 2.0,
+        "refill_rate": service.refill_rate,
+        "workers": 3.0,
+    }
+
+
+def test_leased_range_key_queue_skips_keys_already_on_the_table(fake_redis_client, fake_url_table):
+    counter = IdRangeCounter(redis_client=fake_redis_client)
+    permutation = FeistelKeyPermutation(secret="secret")
+    fake_url_table.add_url(Url(short_url=permutation.encode(3), long_url="https://www.example.com"))
+    queue = LeasedRangeKeyQueue(counter=counter, permutation=permutation, lease_size=10, table=fake_url_table)
+
+    keys = queue.deque_short_url_keys(9)
+
+    assert keys == [permutation.encode(key_id) for key_id in range(10) if key_id != 3]
+    assert queue.current_size() == 0
+
+
+def test_async_leased_range_key_queue_skips_keys_already_on_the_table(
+    fake_async_redis_client, fake_url_table, fake_async_url_table
+):
+    permutation = FeistelKeyPermutation(secret="secret")
+    fake_url_table.add_url(Url(short_url=permutation.encode(0), long_url="https://www.example.com"))
+    queue = AsyncLeasedRangeKeyQueue(
+        counter=AsyncIdRangeCounter(redis_client=fake_async_redis_client),
+        permutation=permutation,
+        lease_size=10,
+        table=fake_async_url_table,
+    )
+
+    keys = asyncio.run(queue.deque_short_url_keys(10))
+
+    assert permutation.encode(0) not in keys
+    assert keys[:9] == [permutation.encode(key_id) for key_id in range(1, 10)]
+    assert len(set(keys)) == 10
+
+
+def test_feistel_key_permutation_rejects_an_empty_secret():
+    with pytest.raises(ValueError):
+        FeistelKeyPermutation(secret="")
@@ -0,0 +1,47 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from loguru import logger
+
+from shortame.logs import SampledAccessLog
+
+
+@pytest.fixture
+def log_messages():
+    messages = []
+    handler_id = logger.add(lambda message: messages.append(message.record["message"]), level="INFO")
+    yield messages
+    logger.remove(handler_id)
+
+
+def request_ping(sample_rate: float, count: int) -> None:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping():
+        return {"pong": True}
+
+    app.add_middleware(SampledAccessLog, sample_rate=sample_rate)
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for _ in range(count):
+                assert (await client.get("/ping")).status_code == 200
+
+    asyncio.run(scenario())
+
+
+def test_sampled_access_log_logs_sampled_requests(log_messages):
+    request_ping(sample_rate=1, count=2)
+
+    assert len(log_messages) == 2
+    assert log_messages[0].startswith("GET /ping 200 ")
+
+
+def test_sampled_access_log_skips_unsampled_requests(log_messages):
+    request_ping(sample_rate=0, count=5)
+
+    assert log_messages == []
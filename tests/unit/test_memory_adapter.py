@@ -0,0 +1,121 @@
+import asyncio
+from time import monotonic
+
+import pytest
+
+from shortame.adapters.memory_adapter import (AsyncBufferedShortUrlQueue,
+                                              BufferedShortUrlQueue,
+                                              LocalCacheQueue)
+from shortame.adapters.redis_adapter import (EmptyQueueException,
+                                             ShortUrlMarkedAsMissing,
+                                             ShortUrlNotFoundOnCache)
+from shortame.domain.model import Url
+
+
+def test_local_cache_queue_can_add_and_get(sample_url):
+    cache = LocalCacheQueue(max_size=10, ttl=60)
+
+    assert cache.add(sample_url) is True
+    assert cache.get(sample_url.short_url) == sample_url.long_url
+
+    with pytest.raises(ShortUrlNotFoundOnCache) as excinfo:
+        cache.get("notexists")
+
+    assert str(excinfo.value) == "Short url 'notexists' not found on local cache"
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+
+
+def test_local_cache_queue_evicts_least_recently_used():
+    cache = LocalCacheQueue(max_size=2, ttl=60)
+    urls = [Url(short_url=f"abc000{i}", long_url="https://example.com") for i in range(3)]
+
+    cache.add(urls[0])
+    cache.add(urls[1])
+    cache.get(urls[0].short_url)
+    cache.add(urls[2])
+
+    assert cache.get(urls[0].short_url) == urls[0].long_url
+    assert cache.get(urls[2].short_url) == urls[2].long_url
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get(urls[1].short_url)
+    assert cache.evictions == 1
+
+
+def test_local_cache_queue_expires_entries(sample_url, monkeypatch):
+    cache = LocalCacheQueue(max_size=10, ttl=60)
+    cache.add(sample_url)
+
+    monkeypatch.setattr("shortame.adapters.memory_adapter.monotonic", lambda: 10**12)
+
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get(sample_url.short_url)
+    assert cache.stats()["size"] == 0
+
+
+def test_local_cache_queue_can_add_missing():
+    cache = LocalCacheQueue(max_size=10, ttl=60, negative_ttl=5)
+
+    assert cache.add_missing("notexists") is True
+
+    with pytest.raises(ShortUrlMarkedAsMissing):
+        cache.get("notexists")
+
+
+def test_buffered_short_url_queue_reserves_blocks(fake_short_url_queue):
+    fake_short_url_queue.enqueue_short_url_keys([f"{i:07d}" for i in range(10)])
+    queue = BufferedShortUrlQueue(queue=fake_short_url_queue, block_size=4, low_watermark=0)
+
+    assert queue.deque_short_url_key() == "0000000"
+    assert queue.buffered() == 3
+    assert fake_short_url_queue.current_size() == 6
+    assert queue.deque_short_url_keys(2) == ["0000001", "0000002"]
+
+    assert queue.release() == 1
+    assert fake_short_url_queue.current_size() == 7
+
+
+def test_buffered_short_url_queue_drains_last_keys(fake_short_url_queue, short_url_queue_name):
+    fake_short_url_queue.enqueue_short_url_key("abcd123")
+    queue = BufferedShortUrlQueue(queue=fake_short_url_queue, block_size=4, low_watermark=0)
+
+    assert queue.deque_short_url_key() == "abcd123"
+
+    with pytest.raises(EmptyQueueException) as excinfo:
+        queue.deque_short_url_key()
+
+    assert str(excinfo.value) == f"There are no keys left on queue {short_url_queue_name}"
+
+
+def test_async_buffered_short_url_queue_refills_in_background(fake_async_short_url_queue):
+    queue = AsyncBufferedShortUrlQueue(
+        queue=fake_async_short_url_queue, block_size=4, low_watermark=2
+    )
+
+    async def scenario():
+        await fake_async_short_url_queue.enqueue_short_url_keys([f"{i:07d}" for i in range(10)])
+
+        assert await queue.deque_short_url_key() == "0000000"
+        assert await queue.deque_short_url_key() == "0000001"
+        assert await queue.deque_short_url_key() == "0000002"
+        await queue._refill_task
+        assert queue.buffered() == 5
+        assert await queue.release() == 5
+        assert await fake_async_short_url_queue.current_size() == 7
+
+    asyncio.run(scenario())
+
+
+def test_local_cache_queue_keeps_expired_entries_stale(sample_url, monkeypatch):
+    cache = LocalCacheQueue(max_size=10, ttl=60, stale_ttl=600)
+    cache.add(sample_url)
+    cache.add_missing("unexistent")
+
+    later = monotonic() + 120
+    monkeypatch.setattr("shortame.adapters.memory_adapter.monotonic", lambda: later)
+
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get(sample_url.short_url)
+    assert cache.get_stale(sample_url.short_url) == sample_url.long_url
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get_stale("unexistent")
+    assert cache.stats()["size"] == 2
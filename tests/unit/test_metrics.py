@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from shortame.adapters.redis_adapter import ShortUrlNotFoundOnCache
+from shortame.services.metrics import (Histogram, Instrumented, InstrumentedCache,
+                                       InstrumentedUrlShortener, MetricsRegistry,
+                                       MultiProcessRegistry)
+from shortame.services.url_services import AsyncUrlShortener, UrlShortener
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.cumulative_counts() == [2, 3, 4]
+    assert histogram.sum == pytest.approx(2.65)
+
+
+def test_metrics_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Requests", route="get").inc(3)
+    registry.gauge("queue_depth", "Depth").set(42)
+    registry.histogram("duration_seconds", "Latency", operation="get").observe(0.0003)
+
+    text = registry.render()
+
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="get"} 3' in text
+    assert "queue_depth 42" in text
+    assert 'duration_seconds_bucket{operation="get",le="0.0005"} 1' in text
+    assert 'duration_seconds_bucket{operation="get",le="+Inf"} 1' in text
+    assert 'duration_seconds_count{operation="get"} 1' in text
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Requests")
+
+
+def test_instrumented_cache_counts_hits_and_misses(fake_cache, sample_url):
+    registry = MetricsRegistry()
+    cache = InstrumentedCache(fake_cache, component="cache", registry=registry)
+    cache.add(sample_url)
+    cache.add_missing("missing")
+
+    assert cache.get(sample_url.short_url) == sample_url.long_url
+    for short_url in ("missing", "unknown"):
+        with pytest.raises(ShortUrlNotFoundOnCache):
+            cache.get(short_url)
+
+    text = registry.render()
+    for result in ("hit", "miss", "negative_hit"):
+        assert f'shortame_cache_requests_total{{cache="cache",result="{result}"}} 1' in text
+    assert 'shortame_operation_duration_seconds_count{component="cache",operation="get"} 3' in text
+    assert "shortame_operation_errors_total" not in text
+    assert cache.ttl == fake_cache.ttl
+
+
+def test_instrumented_counts_dynamodb_throttles(fake_url_table):
+    registry = MetricsRegistry()
+
+    def throttled_get_url(short_url):
+        raise ClientError({"Error": {"Code": "ProvisionedThroughputExceededException"}}, "GetItem")
+
+    fake_url_table.get_url = throttled_get_url
+    table = Instrumented(fake_url_table, component="url_table", registry=registry)
+
+    with pytest.raises(ClientError):
+        table.get_url("abcd123")
+
+    text = registry.render()
+    assert 'shortame_dynamodb_throttles_total{component="url_table"} 1' in text
+    assert (
+        'shortame_operation_errors_total{component="url_table",'
+        'error="ProvisionedThroughputExceededException",operation="get_url"} 1'
+    ) in text
+
+
+def test_instrumented_url_shortener_counts_shortened_urls(
+    fake_short_url_queue, fake_url_table, fake_cache, sample_url
+):
+    registry = MetricsRegistry()
+    fake_short_url_queue.enqueue_short_url_keys(["aaaaaaa", "bbbbbbb", "ccccccc"])
+    shortener = InstrumentedUrlShortener(
+        UrlShortener(queue=fake_short_url_queue, table=fake_url_table, cache=fake_cache),
+        registry=registry,
+    )
+
+    shortener.shorten_and_persist(sample_url.long_url)
+    shortener.shorten_many(["https://example.com/1", "https://example.com/2"])
+
+    assert "shortame_shortened_urls_total 3" in registry.render()
+
+
+def test_instrumented_times_async_methods(
+    fake_async_short_url_queue, fake_async_url_table, fake_async_cache, sample_url
+):
+    registry = MetricsRegistry()
+    shortener = InstrumentedUrlShortener(
+        AsyncUrlShortener(
+            queue=fake_async_short_url_queue,
+            table=fake_async_url_table,
+            cache=InstrumentedCache(fake_async_cache, component="cache", registry=registry),
+        ),
+        registry=registry,
+    )
+
+    async def scenario():
+        return await shortener.get_long_url(sample_url.short_url)
+
+    assert asyncio.run(scenario()) == sample_url.long_url
+    text = registry.render()
+    assert 'shortame_cache_requests_total{cache="cache",result="miss"} 1' in text
+    assert 'shortame_operation_duration_seconds_count{component="url_shortener",operation="get_long_url"} 1' in text
+
+
+def test_multi_process_registry_renders_the_metrics_of_every_worker(tmp_path):
+    def worker_registry(requests: int, depth: int) -> MetricsRegistry:
+        registry = MetricsRegistry()
+        registry.counter("requests_total", "Requests", route="get").inc(requests)
+        registry.gauge("queue_depth", "Depth").set(depth)
+        registry.histogram("duration_seconds", "Latency").observe(0.0003)
+        return registry
+
+    # a live worker (the parent process) and a worker gone
+    for pid, registry in [(os.getppid(), worker_registry(2, 7)), (999999999, worker_registry(5, 9))]:
+        (tmp_path / f"{pid}.json").write_text(json.dumps(registry.snapshot()))
+    multiprocess = MultiProcessRegistry(directory=str(tmp_path), registry=worker_registry(3, 8))
+
+    text = multiprocess.render()
+
+    assert 'requests_total{route="get"} 10' in text
+    assert "duration_seconds_count 3" in text
+    assert f'queue_depth{{worker="{os.getpid()}"}} 8' in text
+    assert f'queue_depth{{worker="{os.getppid()}"}} 7' in text
+    assert 'queue_depth{worker="999999999"}' not in text
+    assert (tmp_path / f"{os.getpid()}.json").exists()
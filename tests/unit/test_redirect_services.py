@@ -0,0 +1,57 @@
+import pytest
+
+from shortame.domain.model import MAX_CACHE_MAX_AGE, Url, build_url
+from shortame.services.redirect_services import EXPIRES_CACHE_SIZE, RedirectPolicy
+
+
+def test_redirect_policy_uses_the_defaults_unless_overridden():
+    policy = RedirectPolicy(status=307, cache_max_age=0)
+
+    response = policy.response(Url(short_url="abc1234", long_url="https://www.example.com/a b"))
+    permanent = policy.response(build_url("abc1234", "https://www.example.com", redirect_status=301))
+
+    assert response.status_code == 307
+    assert dict(response.raw_headers) == {b"location": b"https://www.example.com/a%20b", b"content-length": b"0"}
+    assert permanent.status_code == 301
+    assert dict(permanent.raw_headers)[b"cache-control"] == b"no-store"
+    with pytest.raises(ValueError):
+        RedirectPolicy(status=200)
+
+
+def test_redirect_policy_makes_redirects_cacheable():
+    policy = RedirectPolicy(status=301, cache_max_age=3600)
+    url = Url(short_url="abc1234", long_url="https://www.example.com")
+
+    response = policy.response(url)
+    response.raw_headers.append((b"vary", b"origin"))
+    uncached = policy.response(build_url(url.short_url, url.long_url, redirect_status=302, cache_max_age=0))
+
+    headers = dict(policy.response(url).raw_headers)
+    assert headers[b"cache-control"] == b"public, max-age=3600"
+    assert headers[b"expires"].endswith(b" GMT")
+    assert b"vary" not in headers
+    assert uncached.status_code == 302
+    assert {b"cache-control", b"expires"}.isdisjoint(dict(uncached.raw_headers))
+
+
+def test_redirect_policy_bounds_the_expires_it_keeps_formatted():
+    policy = RedirectPolicy(cache_max_age=60)
+    url = Url(short_url="abc1234", long_url="https://www.example.com")
+
+    for cache_max_age in range(1, 1000):
+        policy.response(build_url(url.short_url, url.long_url, cache_max_age=cache_max_age))
+    policy.response(url)
+
+    assert len(policy._expires) == EXPIRES_CACHE_SIZE
+    assert 60 in policy._expires
+
+
+@pytest.mark.parametrize("cache_max_age", [10**12, 10**20])
+def test_redirect_policy_bounds_the_cache_max_age(cache_max_age):
+    policy = RedirectPolicy()
+
+    response = policy.response(build_url("abc1234", "https://www.example.com", cache_max_age=cache_max_age))
+
+    assert dict(response.raw_headers)[b"cache-control"] == f"public, max-age={MAX_CACHE_MAX_AGE}".encode()
+    with pytest.raises(ValueError):
+        RedirectPolicy(cache_max_age=cache_max_age)
@@ -1,8 +1,15 @@
+import asyncio
+
 import pytest
 
-from shortame.adapters.redis_adapter import (CacheQueue, EmptyQueueException,
+from shortame.adapters.redis_adapter import (AsyncBucketedCacheQueue,
+                                             BucketedCacheQueue, CacheQueue,
+                                             CompactUrlCodec, EmptyQueueException,
+                                             GeneratorLease, HotKeyTracker,
+                                             LongUrlIndexCache,
+                                             ShortUrlMarkedAsMissing,
                                              ShortUrlNotFoundOnCache,
-                                             ShortUrlQueue)
+                                             ShortUrlQueue, get_redis_client)
 from shortame.domain.model import Url
 
 
@@ -72,3 +79,189 @@ def test_cache_queue_can_get(fake_redis_client, sample_url):
         cache.get(wrong_url.short_url)
 
     assert str(excinfo.value) == f"Short url '{wrong_url.short_url}' not found on cache"
+
+
+def test_async_short_url_queue_can_deque_and_enque(
+    fake_async_short_url_queue, sample_url, short_url_queue_name
+):
+    async def scenario():
+        queue_size = await fake_async_short_url_queue.enqueue_short_url_key(
+            sample_url.short_url
+        )
+        assert queue_size == await fake_async_short_url_queue.current_size() == 1
+        assert await fake_async_short_url_queue.deque_short_url_key() == sample_url.short_url
+
+        with pytest.raises(EmptyQueueException) as excinfo:
+            await fake_async_short_url_queue.deque_short_url_key()
+
+        assert (
+            str(excinfo.value)
+            == f"There are no keys left on queue {short_url_queue_name}"
+        )
+
+    asyncio.run(scenario())
+
+
+def test_async_cache_queue_can_add_and_get(fake_async_cache, sample_url):
+    async def scenario():
+        assert await fake_async_cache.add(sample_url) is True
+        assert await fake_async_cache.get(sample_url.short_url) == sample_url.long_url
+
+        with pytest.raises(ShortUrlNotFoundOnCache):
+            await fake_async_cache.get("notexists")
+
+    asyncio.run(scenario())
+
+
+def test_short_url_queue_can_enque_many(fake_short_url_queue):
+    assert fake_short_url_queue.enqueue_short_url_keys([]) == 0
+    assert fake_short_url_queue.enqueue_short_url_keys(["a", "b", "c"]) == 3
+    assert fake_short_url_queue.deque_short_url_key() == "a"
+
+
+def test_cache_queue_can_add_missing(fake_redis_client, sample_url):
+    cache = CacheQueue(redis_client=fake_redis_client, negative_ttl=30)
+
+    assert cache.add_missing("notexists") is True
+    assert 0 < fake_redis_client.ttl("notexists") <= 30
+
+    with pytest.raises(ShortUrlMarkedAsMissing) as excinfo:
+        cache.get("notexists")
+
+    assert str(excinfo.value) == "Short url 'notexists' is marked as missing on cache"
+
+    cache.add(sample_url)
+
+    assert cache.add_missing(sample_url.short_url) is False
+    assert cache.get(sample_url.short_url) == sample_url.long_url
+
+
+def test_short_url_queue_can_deque_many(fake_short_url_queue, short_url_queue_name):
+    fake_short_url_queue.enqueue_short_url_keys(["a", "b", "c"])
+
+    assert fake_short_url_queue.deque_short_url_keys(2) == ["a", "b"]
+
+    with pytest.raises(EmptyQueueException) as excinfo:
+        fake_short_url_queue.deque_short_url_keys(2)
+
+    assert (
+        str(excinfo.value)
+        == f"There are less than 2 keys left on queue {short_url_queue_name}"
+    )
+    assert fake_short_url_queue.deque_short_url_key() == "c"
+
+
+def test_cache_queue_can_add_many(fake_redis_client):
+    cache = CacheQueue(redis_client=fake_redis_client)
+    urls = [Url(short_url=f"abc000{i}", long_url="https://example.com") for i in range(3)]
+
+    assert cache.add_many(urls) is True
+    assert [cache.get(url.short_url) for url in urls] == [url.long_url for url in urls]
+    assert fake_redis_client.ttl(urls[0].short_url) > -1
+
+
+def test_long_url_index_cache_can_add_and_get(fake_redis_client, sample_url):
+    index_cache = LongUrlIndexCache(redis_client=fake_redis_client)
+
+    assert index_cache.get_short_url(sample_url.long_url) is None
+    assert index_cache.add(sample_url) is True
+    assert index_cache.get_short_url(sample_url.long_url) == sample_url.short_url
+
+
+def test_short_url_queue_signals_low_stock(fake_redis_client, short_url_queue_name):
+    queue = ShortUrlQueue(
+        redis_client=fake_redis_client, queue_name=short_url_queue_name, low_watermark=2
+    )
+    queue.enqueue_short_url_keys(["a", "b", "c"])
+
+    assert queue.deque_short_url_key() == "a"
+    assert queue.wait_for_low_stock(timeout=0.01) is False
+    assert queue.deque_short_url_key() == "b"
+    assert queue.deque_short_url_key() == "c"
+    assert fake_redis_client.llen(queue.signal_name) == 1
+    assert queue.wait_for_low_stock(timeout=0.01) is True
+
+
+def test_generator_lease_is_held_by_a_single_owner(fake_redis_client):
+    lease_a = GeneratorLease(owner="a", redis_client=fake_redis_client, ttl=10)
+    lease_b = GeneratorLease(owner="b", redis_client=fake_redis_client, ttl=10)
+
+    assert lease_a.acquire() is True
+    assert lease_b.acquire() is False
+    assert lease_a.acquire() is True
+
+    lease_b.release()
+    assert lease_b.acquire() is False
+
+    lease_a.release()
+    assert lease_b.acquire() is True
+
+
+def test_redis_client_is_created_once_per_process():
+    client = get_redis_client()
+
+    assert get_redis_client() is client
+    assert client.connection_pool.max_connections > 0
+    assert ShortUrlQueue().redis_client is client
+
+
+def test_hot_key_tracker_keeps_the_most_requested_short_urls(fake_redis_client):
+    tracker = HotKeyTracker(redis_client=fake_redis_client, sample_rate=1, max_size=2)
+    # scores were decayed recently, so recording doesn't decay them again
+    fake_redis_client.set("hot_urls:decayed", 1)
+    for short_url in ["aaaaaaa"] * 3 + ["bbbbbbb"] * 2 + ["ccccccc"]:
+        tracker.record(short_url)
+
+    assert tracker.top(2) == ["aaaaaaa", "bbbbbbb"]
+
+    tracker.decay_scores()
+
+    assert tracker.top(10) == ["aaaaaaa", "bbbbbbb"]
+    assert fake_redis_client.zscore("hot_urls", "aaaaaaa") == 1.5
+    assert tracker.acquire_warm_up_lock(ttl=10) is True
+    assert tracker.acquire_warm_up_lock(ttl=10) is False
+
+
+def test_hot_key_tracker_skips_unsampled_requests(fake_redis_client):
+    tracker = HotKeyTracker(redis_client=fake_redis_client, sample_rate=0)
+    tracker.record("aaaaaaa")
+
+    assert tracker.top(10) == []
+
+
+def test_bucketed_cache_queue_keeps_urls_on_hashes(fake_redis_client, sample_url):
+    cache = BucketedCacheQueue(redis_client=fake_redis_client, codec=CompactUrlCodec(compress=True))
+    other_url = Url(short_url="abcz999", long_url="https://www.youtube.com/watch?v=dQw4w9WgXcQ")
+
+    cache.add_many([sample_url, other_url])
+
+    assert fake_redis_client.hlen("urls:abc") == 2
+    assert fake_redis_client.ttl("urls:abc") > 0
+    assert len(fake_redis_client.hget("urls:abc", "z999")) < len(other_url.long_url)
+    assert cache.get(sample_url.short_url) == sample_url.long_url
+    assert cache.get(other_url.short_url) == other_url.long_url
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get("abcx000")
+
+
+def test_bucketed_cache_queue_can_add_missing(fake_redis_client, sample_url):
+    cache = BucketedCacheQueue(redis_client=fake_redis_client)
+
+    assert cache.add_missing("abcx000")
+    with pytest.raises(ShortUrlMarkedAsMissing):
+        cache.get("abcx000")
+
+    cache.add(Url(short_url="abcx000", long_url=sample_url.long_url))
+
+    assert cache.get("abcx000") == sample_url.long_url
+
+
+def test_async_bucketed_cache_queue_can_add_and_get(fake_async_redis_client, sample_url):
+    cache = AsyncBucketedCacheQueue(redis_client=fake_async_redis_client)
+
+    async def scenario():
+        await cache.add(sample_url)
+        assert await cache.acquire_refill_lock(sample_url.short_url, ttl=1)
+        return await cache.get(sample_url.short_url)
+
+    assert asyncio.run(scenario()) == sample_url.long_url
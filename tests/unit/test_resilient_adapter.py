@@ -0,0 +1,99 @@
+import asyncio
+from time import sleep
+
+import pytest
+
+from shortame.adapters.dynamodb_adapter import ShortUrlNotFoundOnTable
+from shortame.adapters.resilient_adapter import (AsyncResilientUrlTable, CircuitBreaker,
+                                                 ResilientUrlTable, TableCircuitOpen,
+                                                 TableDeadlineExceeded)
+
+
+class SlowUrlTable:
+    """Answers after the delay of each call in turn, the last one repeating."""
+
+    def __init__(self, delays):
+        self.table_name = "url"
+        self.table = None
+        self.delays = list(delays)
+        self.calls = 0
+
+    def get_url(self, short_url):
+        delay = self.delays[min(self.calls, len(self.delays) - 1)]
+        self.calls += 1
+        sleep(delay)
+        if short_url == "missing":
+            raise ShortUrlNotFoundOnTable(f"Short url '{short_url}' does not exist on url table")
+        return {"short_url": short_url, "long_url": f"https://www.example.com/{self.calls}"}
+
+
+def primed(table: ResilientUrlTable, latency: float) -> ResilientUrlTable:
+    for _ in range(table.latencies.min_samples):
+        table.latencies.record(latency)
+    return table
+
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    circuit = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    circuit.record_failure()
+    assert circuit.allow()
+    circuit.record_failure()
+
+    assert circuit.state == "open"
+    assert not circuit.allow()
+    monkeypatch.setattr("shortame.adapters.resilient_adapter.monotonic", lambda: 10**12)
+    assert circuit.allow()
+    assert not circuit.allow()
+    circuit.record_success()
+    assert circuit.state == "closed"
+
+
+def test_circuit_breaker_gives_up_on_a_probe_never_recorded(monkeypatch):
+    now = 0
+    monkeypatch.setattr("shortame.adapters.resilient_adapter.monotonic", lambda: now)
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    circuit.record_failure()
+    now = 10
+    # the probe's call is cancelled before recording anything
+    assert circuit.allow()
+    assert not circuit.allow()
+
+    now = 20
+
+    assert circuit.allow()
+    circuit.record_success()
+    assert circuit.state == "closed"
+
+
+def test_resilient_url_table_hedges_slow_reads():
+    url_table = SlowUrlTable([0.5, 0])
+    table = primed(ResilientUrlTable(url_table=url_table, deadline=0.3), latency=0.01)
+
+    assert table.get_url("abc1234")["long_url"] == "https://www.example.com/2"
+    with pytest.raises(ShortUrlNotFoundOnTable):
+        table.get_url("missing")
+    assert table.stats() == {"hedged": 1, "timed_out": 0, "rejected": 0, "circuit": "closed"}
+
+
+def test_resilient_url_table_gives_up_and_opens_its_circuit():
+    url_table = SlowUrlTable([0.2])
+    table = ResilientUrlTable(url_table=url_table, deadline=0.05, failure_threshold=2)
+
+    for _ in range(2):
+        with pytest.raises(TableDeadlineExceeded):
+            table.get_url("abc1234")
+    with pytest.raises(TableCircuitOpen):
+        table.get_url("abc1234")
+
+    assert url_table.calls == 2
+    assert table.stats() == {"hedged": 0, "timed_out": 2, "rejected": 1, "circuit": "open"}
+
+
+def test_async_resilient_url_table_hedges_slow_reads():
+    url_table = SlowUrlTable([0.5, 0])
+    table = primed(AsyncResilientUrlTable(url_table=url_table, deadline=0.3), latency=0.01)
+
+    url = asyncio.run(table.get_url("abc1234"))
+
+    assert url["long_url"] == "https://www.example.com/2"
+    assert table.hedged == 1
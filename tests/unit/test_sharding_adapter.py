@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeServer, FakeStrictRedis
+from fakeredis.aioredis import FakeRedis as FakeAsyncRedis
+
+from shortame.adapters.redis_adapter import (AsyncCacheQueue, AsyncShortUrlQueue,
+                                             CacheQueue, EmptyQueueException,
+                                             ShortUrlQueue)
+from shortame.adapters.sharding_adapter import (AsyncShardedCacheQueue,
+                                                AsyncShardedShortUrlQueue, HashRing,
+                                                ShardedCacheQueue, ShardedShortUrlQueue)
+from shortame.domain.model import Url
+
+
+@pytest.fixture
+def fake_redis_nodes():
+    return {f"redis-{i}:6379": FakeStrictRedis(server=FakeServer(), version=7) for i in range(3)}
+
+
+def test_hash_ring_only_moves_the_keys_of_a_new_node():
+    keys = [f"key{i}" for i in range(10_000)]
+    ring = HashRing(["redis-0", "redis-1", "redis-2"])
+    grown_ring = HashRing(["redis-0", "redis-1", "redis-2", "redis-3"])
+
+    moved = [key for key in keys if ring.node_for(key) != grown_ring.node_for(key)]
+
+    assert all(grown_ring.node_for(key) == "redis-3" for key in moved)
+    assert 0.15 < len(moved) / len(keys) < 0.35
+    shares = [sum(ring.node_for(key) == node for key in keys) / len(keys) for node in ring.nodes]
+    assert all(0.25 < share < 0.42 for share in shares)
+
+
+def test_sharded_cache_queue_keeps_each_url_on_a_single_node(fake_redis_nodes, sample_url):
+    cache = ShardedCacheQueue({node: CacheQueue(redis_client=client) for node, client in fake_redis_nodes.items()})
+    urls = [Url(short_url=f"abc{i:04d}", long_url=f"https://www.example.com/{i}") for i in range(30)]
+
+    cache.add_many(urls)
+    cache.add(sample_url)
+
+    assert cache.get(sample_url.short_url) == sample_url.long_url
+    assert [cache.get(url.short_url) for url in urls] == [url.long_url for url in urls]
+    assert sum(client.dbsize() for client in fake_redis_nodes.values()) == len(urls) + 1
+    assert all(client.dbsize() > 0 for client in fake_redis_nodes.values())
+
+
+def test_sharded_short_url_queue_spreads_and_pops_keys(fake_redis_nodes):
+    clients = list(fake_redis_nodes.values())
+    queue = ShardedShortUrlQueue(
+        [ShortUrlQueue(redis_client=client, low_watermark=2, signal_client=clients[0]) for client in clients]
+    )
+    clients[0].lpush("available_urls", *(f"old{i:04d}" for i in range(4)))
+
+    assert queue.enqueue_short_url_keys([f"new{i:04d}" for i in range(8)]) == 12
+    assert [client.llen("available_urls") for client in clients] == [4, 4, 4]
+
+    popped = [queue.deque_short_url_key() for _ in range(12)]
+
+    assert len(set(popped)) == 12
+    assert queue.current_size() == 0
+    assert clients[0].llen("available_urls:low_stock") == 1
+    assert all(client.llen("available_urls:low_stock") == 0 for client in clients[1:])
+    with pytest.raises(EmptyQueueException):
+        queue.deque_short_url_key()
+
+
+def test_async_sharded_cache_and_queue():
+    clients = [FakeAsyncRedis(server=FakeServer(), version=7) for _ in range(2)]
+    queue = AsyncShardedShortUrlQueue([AsyncShortUrlQueue(redis_client=client) for client in clients])
+    cache = AsyncShardedCacheQueue(
+        {f"redis-{i}:6379": AsyncCacheQueue(redis_client=client) for i, client in enumerate(clients)}
+    )
+
+    async def scenario():
+        await queue.enqueue_short_url_keys(["abcd123", "xyz9876"])
+        short_urls = await queue.deque_short_url_keys(1) + [await queue.deque_short_url_key()]
+        await cache.add_many([Url(short_url=short_url, long_url="https://www.example.com") for short_url in short_urls])
+        return sorted(short_urls), [await cache.get(short_url) for short_url in short_urls]
+
+    assert asyncio.run(scenario()) == (["abcd123", "xyz9876"], ["https://www.example.com"] * 2)
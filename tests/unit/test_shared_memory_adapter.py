@@ -0,0 +1,76 @@
+import multiprocessing
+
+import pytest
+
+from shortame.adapters.redis_adapter import ShortUrlMarkedAsMissing, ShortUrlNotFoundOnCache
+from shortame.adapters.shared_memory_adapter import SEQUENCE, SharedMemoryCacheQueue
+from shortame.domain.model import Url
+
+
+@pytest.fixture
+def shared_cache_path(tmp_path):
+    return str(tmp_path / "shortame-redirects")
+
+
+def fill_shared_cache(path: str, count: int) -> None:
+    cache = SharedMemoryCacheQueue(path=path, slots=1024)
+    cache.add_many([Url(short_url=f"new{i:04d}", long_url=f"https://www.example.com/{i}") for i in range(count)])
+    cache.close()
+
+
+def test_shared_memory_cache_queue_can_add_and_get(shared_cache_path, sample_url):
+    cache = SharedMemoryCacheQueue(path=shared_cache_path, slots=64)
+
+    assert cache.add(sample_url)
+    assert cache.add_missing("unexistent")
+
+    assert cache.get(sample_url.short_url) == sample_url.long_url
+    with pytest.raises(ShortUrlMarkedAsMissing):
+        cache.get("unexistent")
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get("xyz9876")
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 0, "skipped": 0, "size": 2}
+
+
+def test_shared_memory_cache_queue_skips_long_urls_and_expires(shared_cache_path, sample_url):
+    cache = SharedMemoryCacheQueue(path=shared_cache_path, slots=64, slot_size=80, ttl=-1)
+
+    assert not cache.add(Url(short_url="abcd123", long_url="https://www.example.com/" + "x" * 64))
+    assert cache.add(sample_url)
+
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get(sample_url.short_url)
+    assert cache.stats()["skipped"] == 1
+
+
+def test_shared_memory_cache_queue_is_shared_between_processes(shared_cache_path):
+    cache = SharedMemoryCacheQueue(path=shared_cache_path, slots=1024)
+
+    worker = multiprocessing.get_context("fork").Process(target=fill_shared_cache, args=(shared_cache_path, 100))
+    worker.start()
+    worker.join()
+
+    assert cache.get("new0042") == "https://www.example.com/42"
+    assert cache.stats()["size"] >= 95
+
+
+def test_shared_memory_cache_queue_checks_the_layout(shared_cache_path):
+    SharedMemoryCacheQueue(path=shared_cache_path, slots=64)
+
+    with pytest.raises(ValueError):
+        SharedMemoryCacheQueue(path=shared_cache_path, slots=128)
+
+
+def test_shared_memory_cache_queue_recovers_a_slot_left_mid_write(shared_cache_path, sample_url):
+    cache = SharedMemoryCacheQueue(path=shared_cache_path, slots=64, max_probes=1)
+    cache.add(sample_url)
+    # a writer died between its two sequence bumps
+    offset = cache._offset(cache._probes(sample_url.short_url.encode("utf-8"))[0])
+    SEQUENCE.pack_into(cache._map, offset, SEQUENCE.unpack_from(cache._map, offset)[0] + 1)
+    with pytest.raises(ShortUrlNotFoundOnCache):
+        cache.get(sample_url.short_url)
+
+    cache.add(Url(short_url=sample_url.short_url, long_url="https://www.example.com/updated"))
+
+    assert cache.get(sample_url.short_url) == "https://www.example.com/updated"
+    assert SEQUENCE.unpack_from(cache._map, offset)[0] % 2 == 0
@@ -0,0 +1,63 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import sleep
+
+import pytest
+
+from shortame.services.single_flight import AsyncSingleFlight, SingleFlight
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    release = Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        release.wait(timeout=5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(single_flight.do, "key", slow_call) for _ in range(5)]
+        sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert single_flight.in_flight() == 0
+    assert single_flight.do("key", lambda: "again") == "again"
+
+
+def test_single_flight_shares_exceptions():
+    single_flight = SingleFlight()
+
+    def failing_call():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        single_flight.do("key", failing_call)
+
+    assert single_flight.in_flight() == 0
+
+
+def test_async_single_flight_coalesces_concurrent_calls():
+    single_flight = AsyncSingleFlight()
+    calls = []
+
+    async def slow_call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(single_flight.do("key", slow_call) for _ in range(10))
+        )
+        assert results == ["result"] * 10
+        assert single_flight.in_flight() == 0
+
+    asyncio.run(scenario())
+
+    assert len(calls) == 1
@@ -1,11 +1,18 @@
+import asyncio
 from dataclasses import asdict
+from time import monotonic
 
 import pytest
 
+from shortame.adapters.bloom_filter_adapter import BloomFilter
 from shortame.adapters.dynamodb_adapter import ShortUrlNotFoundOnTable
-from shortame.adapters.redis_adapter import EmptyQueueException
-from shortame.domain.model import Url
-from shortame.services.url_services import UrlShortener
+from shortame.adapters.memory_adapter import LocalCacheQueue
+from shortame.adapters.resilient_adapter import TableCircuitOpen
+from shortame.adapters.redis_adapter import (EmptyQueueException,
+                                             HotKeyTracker, LongUrlIndexCache,
+                                             PendingUrlStream)
+from shortame.domain.model import RedirectUrl, Url, hash_long_url
+from shortame.services.url_services import AsyncUrlShortener, UrlShortener
 
 
 def test_url_shortener_shorten_and_persist(
@@ -92,3 +99,315 @@ def test_url_shortener_add_on_cache(
     )
     assert fake_redis_client.ttl(sample_url.short_url) <= shortener.cache.ttl
     assert fake_redis_client.ttl(sample_url.short_url) > -1
+
+
+def test_async_url_shortener_shorten_and_persist(
+    fake_async_short_url_queue, fake_async_url_table, fake_async_cache, sample_url
+):
+    shortener = AsyncUrlShortener(
+        queue=fake_async_short_url_queue,
+        table=fake_async_url_table,
+        cache=fake_async_cache,
+    )
+
+    async def scenario():
+        await fake_async_short_url_queue.enqueue_short_url_key(sample_url.short_url)
+
+        url = await shortener.shorten_and_persist(long_url=sample_url.long_url)
+
+        assert url == sample_url
+        assert await fake_async_cache.get(sample_url.short_url) == sample_url.long_url
+        assert await fake_async_url_table.get_url(sample_url.short_url) == asdict(
+            sample_url
+        )
+
+        with pytest.raises(EmptyQueueException):
+            await shortener.shorten_and_persist(long_url="https://www.example.com")
+
+    asyncio.run(scenario())
+
+
+def test_async_url_shortener_get_long_url(
+    fake_async_short_url_queue, fake_async_url_table, fake_async_cache, sample_url
+):
+    shortener = AsyncUrlShortener(
+        queue=fake_async_short_url_queue,
+        table=fake_async_url_table,
+        cache=fake_async_cache,
+    )
+    new_url = Url(short_url="1234xyz", long_url="https://www.example.com")
+
+    async def scenario():
+        await fake_async_cache.add(sample_url)
+        await fake_async_url_table.add_url(new_url)
+
+        assert await shortener.get_long_url(sample_url.short_url) == sample_url.long_url
+        assert await shortener.get_long_url(new_url.short_url) == new_url.long_url
+
+        with pytest.raises(ShortUrlNotFoundOnTable):
+            await shortener.get_long_url("unexistent")
+
+    asyncio.run(scenario())
+
+
+def test_url_shortener_checks_local_cache_first(
+    fake_short_url_queue, fake_url_table, fake_cache, sample_url, fake_redis_client
+):
+    local_cache = LocalCacheQueue(max_size=10, ttl=60)
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        local_cache=local_cache,
+    )
+
+    assert shortener.get_long_url(short_url=sample_url.short_url) == sample_url.long_url
+    assert local_cache.get(sample_url.short_url) == sample_url.long_url
+
+    fake_short_url_queue.enqueue_short_url_key("1234xyz")
+    new_url = shortener.shorten_and_persist(long_url="https://www.example.com")
+    fake_redis_client.flushall()
+
+    assert shortener.get_long_url(short_url=new_url.short_url) == new_url.long_url
+    assert local_cache.hits == 2
+
+
+def test_url_shortener_caches_missing_short_urls(
+    fake_short_url_queue, fake_url_table, fake_cache, monkeypatch
+):
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        negative_caching=True,
+    )
+
+    with pytest.raises(ShortUrlNotFoundOnTable):
+        shortener.get_long_url(short_url="unexistent")
+
+    monkeypatch.setattr(fake_url_table, "get_url", None)
+
+    with pytest.raises(ShortUrlNotFoundOnTable) as excinfo:
+        shortener.get_long_url(short_url="unexistent")
+
+    assert str(excinfo.value) == "Short url 'unexistent' does not exist on url table"
+
+
+def test_url_shortener_rejects_unissued_short_urls(
+    fake_short_url_queue, fake_url_table, fake_cache, sample_url, monkeypatch
+):
+    bloom_filter = BloomFilter(capacity=1000, error_rate=0.001)
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        bloom_filter=bloom_filter,
+    )
+
+    fake_short_url_queue.enqueue_short_url_key("1234xyz")
+    url = shortener.shorten_and_persist(long_url="https://www.example.com")
+    fake_cache.redis_client.flushall()
+
+    assert bloom_filter.might_contain(url.short_url) is True
+    assert shortener.get_long_url(short_url=url.short_url) == url.long_url
+
+    monkeypatch.setattr(fake_url_table, "get_url", None)
+
+    with pytest.raises(ShortUrlNotFoundOnTable):
+        shortener.get_long_url(short_url=sample_url.short_url)
+
+
+def test_async_url_shortener_coalesces_concurrent_misses(
+    fake_async_short_url_queue, fake_async_url_table, fake_async_cache, sample_url
+):
+    shortener = AsyncUrlShortener(
+        queue=fake_async_short_url_queue,
+        table=fake_async_url_table,
+        cache=fake_async_cache,
+    )
+    table_reads = []
+    get_url = fake_async_url_table.get_url
+
+    async def counting_get_url(short_url):
+        table_reads.append(short_url)
+        return await get_url(short_url)
+
+    fake_async_url_table.get_url = counting_get_url
+
+    async def scenario():
+        long_urls = await asyncio.gather(
+            *(shortener.get_long_url(sample_url.short_url) for _ in range(20))
+        )
+        assert long_urls == [sample_url.long_url] * 20
+        assert await fake_async_cache.get(sample_url.short_url) == sample_url.long_url
+
+    asyncio.run(scenario())
+
+    assert table_reads == [sample_url.short_url]
+
+
+def test_url_shortener_waits_for_refill_lock_holder(
+    fake_short_url_queue, fake_url_table, fake_cache, sample_url, monkeypatch
+):
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        refill_lock_ttl=0.1,
+    )
+
+    assert fake_cache.acquire_refill_lock(sample_url.short_url, ttl=1) is True
+
+    monkeypatch.setattr(
+        "shortame.services.url_services.sleep", lambda _: fake_cache.add(sample_url)
+    )
+    monkeypatch.setattr(fake_url_table, "get_url", None)
+
+    assert shortener.get_long_url(short_url=sample_url.short_url) == sample_url.long_url
+
+
+def test_url_shortener_shorten_many(
+    fake_short_url_queue, fake_url_table, fake_cache
+):
+    shortener = UrlShortener(
+        queue=fake_short_url_queue, table=fake_url_table, cache=fake_cache
+    )
+    long_urls = [f"https://www.example.com/{i}" for i in range(30)]
+    fake_short_url_queue.enqueue_short_url_keys([f"{i:07d}" for i in range(30)])
+
+    urls = shortener.shorten_many(long_urls=long_urls)
+
+    assert [url.long_url for url in urls] == long_urls
+    assert len({url.short_url for url in urls}) == 30
+    for url in urls:
+        assert fake_cache.get(url.short_url) == url.long_url
+        assert fake_url_table.get_url(url.short_url) == asdict(url)
+
+    assert shortener.shorten_many(long_urls=[]) == []
+
+    with pytest.raises(EmptyQueueException):
+        shortener.shorten_many(long_urls=long_urls)
+
+
+def test_url_shortener_reuses_short_url_of_known_long_url(
+    fake_short_url_queue, fake_url_table, fake_cache, fake_dedup_table, fake_redis_client
+):
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        dedup_table=fake_dedup_table,
+        dedup_cache=LongUrlIndexCache(redis_client=fake_redis_client),
+    )
+    fake_short_url_queue.enqueue_short_url_keys(["1234xyz", "5678xyz"])
+
+    url = shortener.shorten_and_persist(long_url="https://www.example.com")
+
+    assert shortener.shorten_and_persist(long_url="https://www.example.com") == url
+    fake_redis_client.delete(f"dedup:{hash_long_url(url.long_url)}")
+    assert shortener.shorten_and_persist(long_url="https://www.example.com") == url
+    assert fake_short_url_queue.current_size() == 1
+
+
+def test_url_shortener_records_requested_short_urls(
+    fake_short_url_queue, fake_url_table, fake_cache, fake_redis_client, sample_url
+):
+    tracker = HotKeyTracker(redis_client=fake_redis_client, sample_rate=1)
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        local_cache=LocalCacheQueue(),
+        hot_key_tracker=tracker,
+    )
+
+    for _ in range(2):
+        assert shortener.get_long_url(sample_url.short_url) == sample_url.long_url
+
+    assert tracker.top(1) == [sample_url.short_url]
+
+
+def test_url_shortener_writes_behind_and_resolves_pending_urls(
+    fake_short_url_queue, fake_url_table, fake_cache, fake_redis_client, sample_url
+):
+    pending_urls = PendingUrlStream(redis_client=fake_redis_client)
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        negative_caching=True,
+        pending_urls=pending_urls,
+    )
+    fake_short_url_queue.enqueue_short_url_key(short_url="new1234")
+
+    url = shortener.shorten_and_persist(long_url="https://www.example.com")
+    fake_redis_client.delete(url.short_url)
+
+    with pytest.raises(ShortUrlNotFoundOnTable):
+        fake_url_table.get_url(short_url=url.short_url)
+    assert shortener.get_long_url(short_url=url.short_url) == url.long_url
+    assert pending_urls.size() == 1
+
+
+def test_url_shortener_keeps_redirect_overrides(
+    fake_short_url_queue, fake_url_table, fake_cache, fake_redis_client
+):
+    local_cache = LocalCacheQueue()
+    shortener = UrlShortener(
+        queue=fake_short_url_queue, table=fake_url_table, cache=fake_cache, local_cache=local_cache
+    )
+    fake_short_url_queue.enqueue_short_url_key(short_url="new1234")
+
+    url = shortener.shorten_and_persist(long_url="https://www.example.com", redirect_status=308, cache_max_age=60)
+
+    assert url == RedirectUrl(
+        short_url="new1234", long_url="https://www.example.com", redirect_status=308, cache_max_age=60
+    )
+    assert shortener.get_url(url.short_url) == url
+    assert shortener.get_long_url(url.short_url) == url.long_url
+    fake_redis_client.flushall()
+    restarted = UrlShortener(queue=fake_short_url_queue, table=fake_url_table, cache=fake_cache)
+    assert restarted.get_url(url.short_url) == url
+    assert fake_cache.get(url.short_url) == "!308,60!https://www.example.com"
+
+
+def test_url_shortener_serves_stale_urls_while_the_table_fails(
+    fake_short_url_queue, fake_url_table, fake_cache, fake_redis_client, sample_url, monkeypatch
+):
+    local_cache = LocalCacheQueue(ttl=60, stale_ttl=600)
+    shortener = UrlShortener(
+        queue=fake_short_url_queue,
+        table=fake_url_table,
+        cache=fake_cache,
+        local_cache=local_cache,
+        serve_stale=True,
+    )
+    assert shortener.get_long_url(sample_url.short_url) == sample_url.long_url
+    fake_redis_client.flushall()
+    later = monotonic() + 120
+    monkeypatch.setattr("shortame.adapters.memory_adapter.monotonic", lambda: later)
+
+    def get_url(short_url):
+        raise TableCircuitOpen(f"Circuit to url table is open, short url '{short_url}' was not read")
+
+    monkeypatch.setattr(fake_url_table, "get_url", get_url)
+
+    assert shortener.get_long_url(sample_url.short_url) == sample_url.long_url
+    with pytest.raises(TableCircuitOpen):
+        shortener.get_long_url("1234xyz")
+
+
+def test_url_shortener_returns_the_long_url_when_refilling_the_cache_fails(
+    fake_short_url_queue, fake_url_table, fake_cache, sample_url, monkeypatch
+):
+    shortener = UrlShortener(
+        queue=fake_short_url_queue, table=fake_url_table, cache=fake_cache
+    )
+    fake_url_table.add_url(sample_url)
+
+    def add(url):
+        raise ConnectionError("Connection refused")
+
+    monkeypatch.setattr(fake_cache, "add", add)
+
+    assert shortener.get_long_url(sample_url.short_url) == sample_url.long_url
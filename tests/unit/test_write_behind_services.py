@@ -0,0 +1,53 @@
+import asyncio
+from dataclasses import asdict
+
+from shortame.adapters.redis_adapter import AsyncPendingUrlStream, PendingUrlStream
+from shortame.domain.model import Url
+from shortame.services.write_behind_services import AsyncUrlFlusher, UrlFlusher
+
+
+def test_url_flusher_writes_pending_urls_on_table(fake_redis_client, fake_url_table):
+    pending_urls = PendingUrlStream(redis_client=fake_redis_client)
+    pending_urls.ensure_group()
+    pending_urls.ensure_group()
+    urls = [Url(short_url=f"new{i:04d}", long_url=f"https://www.example.com/{i}") for i in range(5)]
+    pending_urls.add_many(urls)
+    flusher = UrlFlusher(pending_urls=pending_urls, table=fake_url_table, consumer="worker-1", batch_size=2)
+
+    assert flusher.flush_all() == 5
+    assert pending_urls.size() == 0
+    assert fake_redis_client.xlen("pending_urls") == 0
+    assert [fake_url_table.get_url(url.short_url) for url in urls] == [asdict(url) for url in urls]
+
+
+def test_url_flusher_retries_urls_of_failed_flushes(fake_redis_client, fake_url_table, sample_url):
+    class BrokenTable:
+        def add_urls(self, urls):
+            raise ConnectionError("dynamodb is down")
+
+    pending_urls = PendingUrlStream(redis_client=fake_redis_client)
+    pending_urls.ensure_group()
+    pending_urls.add(sample_url)
+
+    assert UrlFlusher(pending_urls=pending_urls, table=BrokenTable(), consumer="worker-1").flush() == 0
+    assert pending_urls.get(sample_url.short_url) == sample_url.long_url
+
+    other_worker = UrlFlusher(pending_urls=pending_urls, table=fake_url_table, consumer="worker-2", min_idle=0)
+    assert other_worker.flush() == 1
+    assert pending_urls.get(sample_url.short_url) is None
+
+
+def test_async_url_flusher_writes_pending_urls_on_table(
+    fake_async_redis_client, fake_async_url_table, fake_url_table
+):
+    pending_urls = AsyncPendingUrlStream(redis_client=fake_async_redis_client)
+    url = Url(short_url="new1234", long_url="https://www.example.com")
+
+    async def scenario():
+        await pending_urls.ensure_group()
+        await pending_urls.add(url)
+        flusher = AsyncUrlFlusher(pending_urls=pending_urls, table=fake_async_url_table, consumer="worker-1")
+        return await flusher.flush_all(), await pending_urls.size()
+
+    assert asyncio.run(scenario()) == (1, 0)
+    assert fake_url_table.get_url(url.short_url) == asdict(url)
@@ -0,0 +1,85 @@
+import argparse
+import sys
+
+from loguru import logger
+
+from cache_warmer import create_cache
+from shortame.config import settings
+from shortame.logs import configure_logging
+from shortame.services.bulk_services import UrlExporter, UrlImporter, UrlWriter, read_urls
+from shortame.adapters.redis_adapter import ShortUrlQueue, get_redis_clients
+from shortame.adapters.sharding_adapter import ShardedShortUrlQueue
+from shortame.adapters.dynamodb_adapter import FastUrlTable, UrlTable, create_dyn_resource
+from shortame.adapters.embedded_adapter import EmbeddedUrlTable
+from shortame.adapters.bloom_filter_adapter import RedisBloomFilter
+
+
+def create_url_tables(count: int):
+    """Creates a table per worker, DynamoDB resources are not thread-safe (clients and the embedded table are)."""
+    if settings.url_table_adapter == "embedded":
+        return [EmbeddedUrlTable(path=settings.embedded_table_path, sync=settings.embedded_table_sync)] * count
+    if settings.url_table_adapter == "client":
+        return [FastUrlTable(verify_table=False)] * count
+    return [UrlTable(dyn_resource=create_dyn_resource(), verify_table=False) for _ in range(count)]
+
+
+def create_queue():
+    if settings.key_strategy != "queue":
+        logger.warning("Short urls are not issued from a queue, imported ones may be issued again")
+        return None
+    redis_clients = list(get_redis_clients().values())
+    if len(redis_clients) == 1:
+        return ShortUrlQueue()
+    return ShardedShortUrlQueue([ShortUrlQueue(redis_client=redis_client) for redis_client in redis_clients])
+
+
+def file_format(path: str, format: str | None) -> str:
+    return format or ("csv" if path.endswith(".csv") else "jsonl")
+
+
+def import_urls(args) -> int:
+    importer = UrlImporter(
+        tables=create_url_tables(args.workers),
+        queue=create_queue(),
+        cache=create_cache() if args.warm_cache else None,
+        bloom_filter=(
+            RedisBloomFilter(capacity=settings.bloom_filter_capacity, error_rate=settings.bloom_filter_error_rate)
+            if settings.bloom_filter_enabled
+            else None
+        ),
+        batch_size=args.batch_size,
+        progress_interval=args.progress_interval,
+    )
+    lines = sys.stdin if args.path == "-" else open(args.path, newline="", encoding="utf-8")
+    with lines:
+        report = importer.run(read_urls(lines, file_format(args.path, args.format)))
+    print(report)
+    return 1 if report["failed"] else 0
+
+
+def export_urls(args) -> int:
+    exporter = UrlExporter(tables=create_url_tables(args.segments), progress_interval=args.progress_interval)
+    lines = sys.stdout if args.path == "-" else open(args.path, "w", newline="", encoding="utf-8")
+    with lines:
+        report = exporter.run(UrlWriter(lines, file_format(args.path, args.format)).write)
+    print(report, file=sys.stderr)
+    return 1 if report["failed_segments"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Imports urls to or exports them from the url table in bulk")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the extension of the file")
+    parser.add_argument("--progress-interval", type=float, default=5, help="seconds between progress logs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importing = commands.add_parser("import", help="writes the urls of a file to the table")
+    importing.add_argument("path", help="a CSV (short_url,long_url header) or JSONL file, - for stdin")
+    importing.add_argument("--workers", type=int, default=8, help="concurrent BatchWriteItem workers")
+    importing.add_argument("--batch-size", type=int, default=100, help="urls written by a worker at once")
+    importing.add_argument("--warm-cache", action="store_true", help="also caches the imported urls")
+    exporting = commands.add_parser("export", help="writes every url on the table to a file")
+    exporting.add_argument("path", help="a CSV or JSONL file, - for stdout")
+    exporting.add_argument("--segments", type=int, default=8, help="Scan segments read in parallel")
+    args = parser.parse_args()
+
+    configure_logging(sink="url_table_cli.log")
+    sys.exit(import_urls(args) if args.command == "import" else export_urls(args))